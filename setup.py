@@ -5,5 +5,6 @@ setup(
     version="0.0.1",
     author="Ulkesh Patil",
     author_email="ulkesh13@gmail.com",
-    packages=find_packages()
+    packages=find_packages(),
+    entry_points={"console_scripts": ["search-engine=src.cli:main"]}
 )
\ No newline at end of file
@@ -0,0 +1,137 @@
+from src.entity.config_entity import DatabaseConfig
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Set
+import numpy as np
+import importlib
+import shutil
+import time
+import os
+
+
+class LocalS3Connector:
+    """
+    Stand-in for S3Connector that serves objects from a local directory laid out like the bucket.
+    """
+    def __init__(self, bucket_dir: str):
+        """
+        Args:
+            bucket_dir (str): Directory playing the role of the bucket root.
+        """
+        self.bucket_dir = bucket_dir
+
+    def download_dir(self, prefix: str, path: str, exclude: Optional[Set[str]] = None):
+        """
+        Copy every object under a prefix, skipping files that already exist locally with the same size.
+
+        Args:
+            prefix (str): Key prefix to download.
+            path (str): Local destination directory.
+            exclude (Set[str], optional): Keys relative to the prefix to skip.
+
+        Returns:
+            dict: A response dictionary with the number of downloaded files and bytes.
+        """
+        source = os.path.join(self.bucket_dir, prefix)
+        files, size = 0, 0
+        for root, _, names in os.walk(source):
+            for name in names:
+                remote = os.path.join(root, name)
+                relative = os.path.relpath(remote, source)
+                if exclude and relative in exclude:
+                    continue
+                local = os.path.join(path, relative)
+                remote_size = os.path.getsize(remote)
+                if os.path.exists(local) and os.path.getsize(local) == remote_size:
+                    continue
+                os.makedirs(os.path.dirname(local), exist_ok=True)
+                shutil.copyfile(remote, local)
+                files += 1
+                size += remote_size
+        return {"Response": "Success", "Downloaded Files": files, "Downloaded Bytes": size}
+
+
+class InMemoryMongoClient:
+    """
+    Stand-in for MongoDBClient keeping the embedding collection in a dict keyed by the unique key.
+    """
+    def __init__(self):
+        self.config = DatabaseConfig()
+        self.documents: Dict[str, Dict[str, Any]] = {}
+
+    def insert_bulk_record(self, documents: List[Dict[str, Any]]):
+        for document in documents:
+            self.documents.setdefault(document[self.config.UNIQUE_KEY], document)
+        return {"Response": "Success", "Inserted Documents": len(documents)}
+
+    def upsert_bulk_record(self, documents: List[Dict[str, Any]]):
+        upserted = sum(document[self.config.UNIQUE_KEY] not in self.documents for document in documents)
+        self.documents.update((document[self.config.UNIQUE_KEY], document) for document in documents)
+        return {"Response": "Success", "Upserted Documents": upserted,
+                "Modified Documents": len(documents) - upserted}
+
+    def get_collection_documents(self):
+        return {"Response": "Success", "Info": iter(list(self.documents.values()))}
+
+    def export_embeddings(self, workers: Optional[int] = None, batch_size: Optional[int] = None):
+        """
+        Return the stored embeddings in the same shape as MongoDBClient.export_embeddings.
+        """
+        start = time.perf_counter()
+        documents = list(self.documents.values())
+        vectors = np.array([document[self.config.VECTOR_FIELD] for document in documents], dtype=np.float32)
+        links = [document[self.config.UNIQUE_KEY] for document in documents]
+        labels = np.array([document.get(self.config.LABEL_FIELD, -1) for document in documents], dtype=np.int64)
+        ingested_at = np.array([document.get(self.config.INGESTED_FIELD, 0) for document in documents],
+                               dtype=np.int64)
+        seconds = time.perf_counter() - start
+        return {"Response": "Success", "Vectors": vectors.reshape(len(documents), -1), "Links": links,
+                "Labels": labels, "IngestedAt": ingested_at,
+                "Rows": len(documents), "Seconds": seconds,
+                "Throughput": len(documents) / seconds if seconds else 0.0}
+
+    def drop_collection(self):
+        self.documents.clear()
+        return {"Response": "Success"}
+
+    def async_client(self):
+        return InMemoryAsyncMongoClient(self)
+
+
+class InMemoryAsyncMongoClient:
+    """
+    Stand-in for AsyncMongoDBClient writing to an InMemoryMongoClient.
+    """
+    def __init__(self, mongo: InMemoryMongoClient):
+        self.mongo = mongo
+
+    async def upsert_bulk_record(self, documents: List[Dict[str, Any]]):
+        return self.mongo.upsert_bulk_record(documents)
+
+
+@contextmanager
+def local_backends(bucket_dir: str):
+    """
+    Route the pipeline components to local S3 and MongoDB stand-ins for the duration of the block.
+
+    Args:
+        bucket_dir (str): Directory playing the role of the S3 bucket.
+
+    Yields:
+        InMemoryMongoClient: The collection shared by every component.
+    """
+    mongo = InMemoryMongoClient()
+    replacements = [("src.components.data_ingestion", "S3Connector", lambda: LocalS3Connector(bucket_dir)),
+                    ("src.components.embeddings", "MongoDBClient", lambda: mongo),
+                    ("src.components.nearest_neighbours", "MongoDBClient", lambda: mongo),
+                    ("src.components.dedup", "MongoDBClient", lambda: mongo),
+                    ("src.components.projection", "MongoDBClient", lambda: mongo)]
+    originals = []
+    try:
+        for module_name, attribute, replacement in replacements:
+            module = importlib.import_module(module_name)
+            originals.append((module, attribute, getattr(module, attribute)))
+            setattr(module, attribute, replacement)
+        yield mongo
+    finally:
+        for module, attribute, original in originals:
+            setattr(module, attribute, original)
@@ -0,0 +1,253 @@
+from src.entity.config_entity import BenchmarkConfig, ImageFolderConfig, MetricsConfig
+from src.benchmark.backends import local_backends
+from src.components.data_ingestion import DataIngestion
+from src.components.data_preprocessing import DataPreprocessing
+from src.components.embeddings import ShardedEmbeddingGenerator
+from src.components.nearest_neighbours import Annoy
+from src.components.dedup import Deduplicator
+from src.components.projection import Projector
+from src.components.model import NeuralNet
+from src.components.export import ModelExporter
+from src.components.trainer import Trainer
+from src.pipeline.pipeline import Pipeline
+from src.service.benchmark import sample_images, run_benchmark
+from src.utils.metrics import metrics
+from PIL import Image, ImageDraw
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List
+import numpy as np
+import platform
+import argparse
+import shutil
+import torch
+import json
+import time
+import sys
+import os
+
+
+def generate_image_tree(root: str, classes: int, per_class: int, size: int, seed: int) -> Dict:
+    """
+    Write a reproducible tree of JPEG images, one directory per class, where each class has its own
+    palette and shape so the classifier has something to learn.
+
+    Args:
+        root (str): Destination directory.
+        classes (int): Number of classes.
+        per_class (int): Images per class.
+        size (int): Width and height of the images.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Number of files and bytes written.
+    """
+    rng = np.random.default_rng(seed)
+    files, size_on_disk = 0, 0
+    for label in range(classes):
+        folder = os.path.join(root, f"class_{label:03d}")
+        os.makedirs(folder, exist_ok=True)
+        palette = rng.integers(0, 256, size=(2, 3))
+        for index in range(per_class):
+            pixels = rng.normal(palette[0], 24, size=(size, size, 3)).clip(0, 255).astype(np.uint8)
+            image = Image.fromarray(pixels)
+            draw = ImageDraw.Draw(image)
+            for _ in range(3):
+                x, y = rng.integers(0, size * 3 // 4, size=2)
+                extent = int(rng.integers(size // 8, size // 3))
+                box = [int(x), int(y), int(x) + extent, int(y) + extent]
+                fill = tuple(int(c) for c in palette[1])
+                (draw.ellipse if label % 2 else draw.rectangle)(box, fill=fill)
+            path = os.path.join(folder, f"{index:05d}.jpg")
+            image.save(path, quality=90)
+            files += 1
+            size_on_disk += os.path.getsize(path)
+    return {"Files": files, "Bytes": size_on_disk}
+
+
+def compare_reports(report: Dict, baseline: Dict, tolerance: float, min_seconds: float = 0.0) -> List[str]:
+    """
+    List the stages that got slower than the baseline by more than the tolerance.
+
+    Args:
+        report (dict): Current benchmark report.
+        baseline (dict): Earlier report from the same kind of machine.
+        tolerance (float): Allowed relative slowdown, e.g. 0.25 for 25%.
+        min_seconds (float): Ignore stage slowdowns smaller than this, which are timer noise on tiny trees.
+
+    Returns:
+        list: Human readable regression messages, empty when there is none.
+    """
+    regressions = []
+    for name, stage in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if previous and stage["seconds"] > max(previous["seconds"] * (1 + tolerance),
+                                               previous["seconds"] + min_seconds):
+            regressions.append(f"{name}: {stage['seconds']:.3f}s vs baseline {previous['seconds']:.3f}s")
+    query, previous = report.get("query", {}), baseline.get("query", {})
+    if previous and query.get("latency_ms_p95", 0) > previous["latency_ms_p95"] * (1 + tolerance):
+        regressions.append(f"query p95: {query['latency_ms_p95']:.2f}ms vs baseline {previous['latency_ms_p95']:.2f}ms")
+    if previous and query.get("throughput_qps", 0) < previous["throughput_qps"] / (1 + tolerance):
+        regressions.append(f"query throughput: {query['throughput_qps']:.1f}qps "
+                           f"vs baseline {previous['throughput_qps']:.1f}qps")
+    return regressions
+
+
+class BenchmarkSuite:
+    def __init__(self, workspace: str = None, classes: int = None, images_per_class: int = None,
+                 device: str = "cpu"):
+        """
+        Time every pipeline stage on a synthetic image tree with local S3 and MongoDB stand-ins.
+
+        Parameters:
+        - workspace (str, optional): Scratch directory; it is wiped before each run.
+        - classes (int, optional): Number of synthetic classes.
+        - images_per_class (int, optional): Synthetic images per class.
+        - device (str): Device used for training and embedding.
+
+        """
+        self.config = BenchmarkConfig()
+        self.workspace = workspace or self.config.WORKSPACE
+        self.classes = classes or self.config.CLASSES
+        self.images_per_class = images_per_class or self.config.IMAGES_PER_CLASS
+        self.device = device
+        self.bucket_dir = os.path.join(self.workspace, "bucket")
+        self.root_dir = os.path.join(self.workspace, "root")
+        self.results = {}
+
+    def prepare(self):
+        """
+        Create a fresh workspace, generate the synthetic bucket and point every config at the workspace.
+        """
+        shutil.rmtree(self.workspace, ignore_errors=True)
+        prefix = DataIngestion().config.PREFIX
+        generated = generate_image_tree(os.path.join(self.bucket_dir, prefix), self.classes,
+                                        self.images_per_class, self.config.SOURCE_IMAGE_SIZE, self.config.SEED)
+        os.environ["SEARCH_ENGINE_ROOT"] = self.root_dir
+        for folder in Pipeline().paths:
+            os.makedirs(os.path.join(self.root_dir, folder), exist_ok=True)
+        print(f"Generated {generated['Files']} synthetic images ({generated['Bytes']} bytes)")
+        return generated
+
+    def time_stage(self, name: str, func, items=None):
+        """
+        Run one stage and record its wall time and, when an item count is known, its throughput.
+
+        Parameters:
+        - name (str): Stage name.
+        - func (Callable): Stage body.
+        - items (int or Callable, optional): Items processed, or a function of the stage's return value.
+
+        Returns:
+        - The stage's return value.
+
+        """
+        print(f"\n====================== Benchmarking {name} ======================\n")
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+        result = {"seconds": seconds}
+        count = items(value) if callable(items) else items
+        if count:
+            result.update({"items": count, "items_per_second": count / seconds})
+        self.results[name] = result
+        return value
+
+    def read_batches(self, loader) -> int:
+        """
+        Read the first LOADER_BATCHES batches of a loader and return the number of images.
+        """
+        return sum(len(batch[1]) for batch in islice(loader, self.config.LOADER_BATCHES))
+
+    def run_step(self):
+        """
+        Run the whole benchmark.
+
+        Returns:
+        - dict: Report with per-stage timings, query latency and the collected metrics.
+
+        """
+        metrics.reset()
+        generated = self.prepare()
+        images = generated["Files"]
+
+        with local_backends(self.bucket_dir) as mongo:
+            ingestion = DataIngestion()
+            self.time_stage("ingest", ingestion.download_dir, images)
+            self.time_stage("split", ingestion.split_data, images)
+            loaders = self.time_stage("preprocess", DataPreprocessing().run_step)
+            self.time_stage("loader", lambda: self.read_batches(loaders["train_data_loader"][0]), lambda n: n)
+
+            trainer = Trainer(loaders, self.device, net=NeuralNet(pretrained=False))
+            self.time_stage("train", lambda: trainer.train_epoch(0), len(loaders["train_data_loader"][1]))
+            trainer.save_model_in_pth()
+
+            self.time_stage("export", ModelExporter(loaders).run_step)
+            label_map = loaders["valid_data_loader"][1].class_to_idx
+            self.time_stage("embed", ShardedEmbeddingGenerator(label_map, self.device).run_step, images)
+            self.time_stage("dedup", Deduplicator().run_step, images)
+            self.time_stage("project", Projector().run_step, images)
+            self.time_stage("index", Annoy().build_annoy_format, lambda _: len(mongo.documents))
+
+        queries = sample_images(ImageFolderConfig().ROOT_DIR, self.config.QUERY_SAMPLES, self.config.SEED)
+        query = run_benchmark(queries, self.config.QUERY_CONCURRENCY, self.config.QUERY_REQUESTS,
+                              self.config.TOP_K, cached=False)
+
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "environment": {"python": platform.python_version(), "torch": torch.__version__,
+                            "platform": platform.platform(), "cpu_count": os.cpu_count(), "device": self.device},
+            "parameters": {"classes": self.classes, "images_per_class": self.images_per_class,
+                           "source_image_size": self.config.SOURCE_IMAGE_SIZE, "seed": self.config.SEED},
+            "stages": self.results,
+            "query": query,
+            "metrics": metrics.snapshot(),
+        }
+
+
+if __name__ == "__main__":
+    config, reports = BenchmarkConfig(), MetricsConfig()
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument("--workspace", default=config.WORKSPACE)
+    parser.add_argument("--classes", type=int, default=config.CLASSES)
+    parser.add_argument("--images-per-class", type=int, default=config.IMAGES_PER_CLASS)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--output", default=os.path.join(
+        reports.REPORT_DIR, f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"))
+    parser.add_argument("--baseline", default=config.BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=config.TOLERANCE)
+    parser.add_argument("--update-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit non-zero on a regression")
+    args = parser.parse_args()
+
+    report = BenchmarkSuite(args.workspace, args.classes, args.images_per_class, args.device).run_step()
+    for path in [args.output] + ([args.baseline] if args.update_baseline else []):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Benchmark report written to {path}")
+
+    for name, stage in report["stages"].items():
+        rate = f" ({stage['items_per_second']:.1f} items/s)" if "items_per_second" in stage else ""
+        print(f"{name:<12}: {stage['seconds']:.3f}s{rate}")
+    print(f"{'query':<12}: p50 {report['query']['latency_ms_p50']:.2f}ms, "
+          f"p95 {report['query']['latency_ms_p95']:.2f}ms, {report['query']['throughput_qps']:.1f}qps")
+
+    if not args.update_baseline:
+        baseline = None
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        if baseline is None or baseline.get("parameters") != report["parameters"]:
+            # Without a comparable baseline there is nothing to check; a regression gate must not pass silently.
+            reason = "does not exist" if baseline is None else "was recorded with different parameters"
+            print(f"WARNING: baseline {args.baseline} {reason}, no regression check was made; "
+                  f"record one with --update-baseline")
+            if args.fail_on_regression:
+                sys.exit(2)
+        else:
+            regressions = compare_reports(report, baseline, args.tolerance, config.MIN_REGRESSION_SECONDS)
+            for regression in regressions:
+                print(f"REGRESSION {regression}")
+            if regressions and args.fail_on_regression:
+                sys.exit(1)
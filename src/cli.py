@@ -0,0 +1,70 @@
+"""
+Command line entry point, installed as `search-engine`.
+
+Every command imports only the modules it needs, so lightweight commands such as `index` or `pull` start without
+loading torch, and only need the credentials of the services they talk to.
+"""
+from typing import List, Optional
+import argparse
+
+STAGES = ["ingest", "split", "preprocess", "model", "train", "distill", "export", "embed", "dedup", "project", "index",
+          "push"]
+
+
+def run_pipeline(args):
+    from src.pipeline.pipeline import Pipeline
+    return Pipeline().run_pipeline(start=args.start, until=args.until, force=args.force)
+
+
+def run_stage(name: str):
+    """
+    Build a command that runs one self-contained pipeline stage directly, without checking upstream stages.
+    """
+    def command(args):
+        from src.pipeline.pipeline import Pipeline
+        pipeline = Pipeline()
+        actions = {"ingest": pipeline.initiate_data_ingestion, "split": pipeline.initiate_data_split,
+                   "dedup": pipeline.deduplicate, "project": pipeline.project_embeddings,
+                   "index": pipeline.create_annoy,
+                   "push": pipeline.push_artifacts, "pull": pipeline.pull_artifacts}
+        return actions[name]()
+    return command
+
+
+def serve(args):
+    from src.service.server import serve as serve_forever
+    return serve_forever()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="search-engine", description="Image search engine training pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the stage graph, skipping stages whose outputs are up to date")
+    run.add_argument("--from", dest="start", choices=STAGES, help="re-run this stage and everything after it")
+    run.add_argument("--until", choices=STAGES, help="stop after this stage")
+    run.add_argument("--force", action="store_true", help="ignore cached stage results")
+    run.set_defaults(func=run_pipeline)
+
+    for name, description in [("ingest", "download the catalogue images from S3"),
+                              ("split", "split the downloaded images into train, validation and test sets"),
+                              ("dedup", "rebuild the canonical map of duplicate images"),
+                              ("project", "refit the PCA projection and project the stored embeddings"),
+                              ("index", "rebuild the Annoy index from the stored embeddings"),
+                              ("push", "upload the index and model artifacts to S3"),
+                              ("pull", "download and extract the artifacts of an earlier run")]:
+        commands.add_parser(name, help=description).set_defaults(func=run_stage(name))
+
+    commands.add_parser("serve", help="start the query-by-image search service").set_defaults(func=serve)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = build_parser().parse_args(argv)
+    response = args.func(args)
+    if response is not None:
+        print(response)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
-from src.entity.config_entity import DataIngestionConfig
-from src.utils.storage_handler import S3Connector
+from src.entity.config_entity import DataIngestionConfig, DedupConfig, project_root
+from src.utils.duplicates import load_canonical_map
+from src.utils.storage_handler import S3Connector, AsyncS3Connector
+from src.utils.async_utils import run_sync
+from src.utils.metrics import metrics
 from from_root import from_root
-import splitfolders
+import shutil
 import os
 
 
@@ -24,28 +27,70 @@ class DataIngestion:
         """
         try:
             print("\n====================== Fetching Data ==============================\n")
-            data_path = os.path.join(from_root(), self.config.RAW, self.config.PREFIX)
-            os.system(f"aws s3 sync s3://image-database-system-01/images/ {data_path} --no-progress")
+            data_path = os.path.join(project_root(), self.config.RAW, self.config.PREFIX)
+            duplicates = set(load_canonical_map(DedupConfig().CANONICAL_MAP_PATH))
+            with metrics.timer("ingest_download"):
+                response = S3Connector().download_dir(self.config.PREFIX, data_path, duplicates)
+            removed = self.remove_duplicates(data_path, duplicates)
+            metrics.increment("ingest_files_downloaded", response["Downloaded Files"])
+            metrics.increment("ingest_bytes_downloaded", response["Downloaded Bytes"])
+            print(f"Downloaded {response['Downloaded Files']} files ({response['Downloaded Bytes']} bytes), "
+                  f"skipped {len(duplicates)} known duplicates and removed {removed} local copies")
             print("\n====================== Fetching Completed ==========================\n")
 
         except Exception as e:
             raise e
 
+    @staticmethod
+    def remove_duplicates(data_path: str, duplicates):
+        """
+        Delete local copies of images the dedup job mapped to a canonical image, so the next split leaves them out.
+
+        Args:
+            data_path (str): Local image directory.
+            duplicates: Image keys ("<class>/<file>") of the duplicates.
+
+        Returns:
+            int: Number of removed files.
+        """
+        removed = 0
+        for key in duplicates:
+            path = os.path.join(data_path, key)
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def remote_manifest(self):
+        """
+        Describe the remote image prefix so unchanged data can be detected without downloading it.
+
+        Returns:
+            list: Sorted (key, etag, size) triples of every object under the prefix.
+        """
+        objects = run_sync(AsyncS3Connector().list_objects(self.config.PREFIX))
+        return sorted((item["Key"], item["ETag"], item["Size"]) for item in objects)
+
     def split_data(self):
         """
-        Split data into train, validation, and test sets.
+        Split data into train, validation, and test sets, replacing any earlier split so images removed from the
+        raw data, or shuffled into a different set, do not linger in the old one.
 
         Raises:
             Exception: If an error occurs during the data splitting process.
         """
+        import splitfolders
         try:
-            splitfolders.ratio(
-                input=os.path.join(self.config.RAW, self.config.PREFIX),
-                output=self.config.SPLIT,
-                seed=self.config.SEED,
-                ratio=self.config.RATIO,
-                group_prefix=None, move=False
-            )
+            split_path = os.path.join(project_root(), self.config.SPLIT)
+            shutil.rmtree(split_path, ignore_errors=True)
+            with metrics.timer("ingest_split"):
+                splitfolders.ratio(
+                    input=os.path.join(project_root(), self.config.RAW, self.config.PREFIX),
+                    output=split_path,
+                    seed=self.config.SEED,
+                    ratio=self.config.RATIO,
+                    group_prefix=None, move=False
+                )
         except Exception as e:
             raise e
 
@@ -0,0 +1,178 @@
+from src.entity.config_entity import DedupConfig
+from src.utils.database_handler import MongoDBClient
+from src.utils.duplicates import UnionFind, image_key, load_canonical_map
+from src.utils.metrics import metrics
+from concurrent.futures import ThreadPoolExecutor
+from annoy import AnnoyIndex
+from typing import Dict, List
+import numpy as np
+import hashlib
+import json
+import os
+
+
+class Deduplicator:
+    def __init__(self):
+        """
+        Find byte-identical and near-identical catalogue images and map each duplicate to a canonical image.
+
+        """
+        self.config = DedupConfig()
+        self.mongo = MongoDBClient()
+
+    def hash_files(self) -> Dict[str, str]:
+        """
+        Hash every local catalogue image.
+
+        Returns:
+        - dict: Content digest of every image key.
+
+        """
+        if not os.path.isdir(self.config.ROOT_DIR):
+            return {}
+        paths = [os.path.join(self.config.ROOT_DIR, label, name)
+                 for label in sorted(os.listdir(self.config.ROOT_DIR))
+                 for name in sorted(os.listdir(os.path.join(self.config.ROOT_DIR, label)))]
+
+        def digest(path):
+            value = hashlib.blake2b(digest_size=16)
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    value.update(chunk)
+            return value.hexdigest()
+
+        with ThreadPoolExecutor(max_workers=self.config.HASH_WORKERS) as executor:
+            digests = list(executor.map(digest, paths))
+        return {image_key(path): value for path, value in zip(paths, digests)}
+
+    @staticmethod
+    def exact_duplicates(forest: UnionFind, digests: Dict[str, str]) -> int:
+        """
+        Merge images with identical bytes.
+
+        Returns:
+        - int: Number of merges.
+
+        """
+        first, merges = {}, 0
+        for key, value in digests.items():
+            forest.add(key)
+            if value in first:
+                merges += forest.union(first[value], key)
+            else:
+                first[value] = key
+        return merges
+
+    def neighbours(self, vectors: np.ndarray):
+        """
+        Self-join the embeddings: the NEIGHBOURS nearest other items of every item and their distances.
+
+        Returns:
+        - Tuple[np.ndarray, np.ndarray]: Neighbour ids and distances of shape (items, NEIGHBOURS),
+          padded with -1 and inf.
+
+        """
+        index = AnnoyIndex(vectors.shape[1], "euclidean")
+        for i, vector in enumerate(vectors):
+            index.add_item(i, vector)
+        index.build(self.config.N_TREES)
+
+        count, k = len(vectors), self.config.NEIGHBOURS
+        ids = np.full((count, k), -1, dtype=np.int64)
+        distances = np.full((count, k), np.inf, dtype=np.float32)
+
+        def search(chunk):
+            for item in chunk:
+                found, found_distances = index.get_nns_by_item(item, k + 1, -1, True)
+                pairs = [(other, distance) for other, distance in zip(found, found_distances) if other != item][:k]
+                ids[item, :len(pairs)] = [other for other, _ in pairs]
+                distances[item, :len(pairs)] = [distance for _, distance in pairs]
+
+        chunks = np.array_split(np.arange(count), max(1, self.config.SEARCH_WORKERS * 4))
+        with ThreadPoolExecutor(max_workers=self.config.SEARCH_WORKERS) as executor:
+            list(executor.map(search, chunks))
+        return ids, distances
+
+    def threshold(self, distances: np.ndarray) -> float:
+        """
+        Distance under which two embeddings count as duplicates: DISTANCE_THRESHOLD if set, otherwise
+        RELATIVE_THRESHOLD times the median nearest-neighbour distance of the catalogue.
+        """
+        if self.config.DISTANCE_THRESHOLD is not None:
+            return self.config.DISTANCE_THRESHOLD
+        nearest = distances[:, 0][np.isfinite(distances[:, 0])]
+        return float(np.median(nearest)) * self.config.RELATIVE_THRESHOLD if len(nearest) else 0.0
+
+    @staticmethod
+    def near_duplicates(forest: UnionFind, keys: List[str], ids: np.ndarray, distances: np.ndarray,
+                        threshold: float) -> int:
+        """
+        Merge every pair of images closer than the threshold.
+
+        Returns:
+        - int: Number of merges.
+
+        """
+        merges = 0
+        for item, other in zip(*np.nonzero(distances <= threshold)):
+            merges += forest.union(keys[item], keys[ids[item, other]])
+        return merges
+
+    @staticmethod
+    def canonical_map(forest: UnionFind, ingested_at: Dict[str, int]) -> Dict[str, str]:
+        """
+        Choose the earliest ingested image of every cluster as canonical and map the others to it.
+        """
+        mapping = {}
+        for members in forest.groups().values():
+            if len(members) < 2:
+                continue
+            canonical = min(members, key=lambda key: (ingested_at.get(key, float("inf")), key))
+            mapping.update({key: canonical for key in members if key != canonical})
+        return mapping
+
+    def run_step(self):
+        """
+        Run the dedup job and write the canonical map.
+
+        Returns:
+        - dict: Response with the number of images, duplicates found by each pass and clusters.
+
+        """
+        forest = UnionFind()
+        for duplicate, canonical in load_canonical_map(self.config.CANONICAL_MAP_PATH).items():
+            # Earlier duplicates are pruned locally, so keep their clusters from the previous map.
+            forest.union(canonical, duplicate)
+
+        with metrics.timer("dedup_hash"):
+            exact = self.exact_duplicates(forest, self.hash_files())
+
+        export = self.mongo.export_embeddings()
+        keys = [image_key(link) for link in export["Links"]]
+        for key in keys:
+            forest.add(key)
+        near, threshold = 0, 0.0
+        if export["Rows"] > 1:
+            with metrics.timer("dedup_self_join"):
+                ids, distances = self.neighbours(export["Vectors"])
+            threshold = self.threshold(distances)
+            near = self.near_duplicates(forest, keys, ids, distances, threshold)
+
+        mapping = self.canonical_map(forest, dict(zip(keys, export["IngestedAt"].tolist())))
+        os.makedirs(os.path.dirname(self.config.CANONICAL_MAP_PATH), exist_ok=True)
+        temporary = f"{self.config.CANONICAL_MAP_PATH}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(mapping, file, indent=0, sort_keys=True)
+        os.replace(temporary, self.config.CANONICAL_MAP_PATH)
+
+        clusters = len(set(mapping.values()))
+        metrics.gauge("dedup_duplicates", len(mapping))
+        print(f"Found {exact} exact and {near} near duplicate merges (threshold {threshold:.4f}) : "
+              f"{len(mapping)} duplicates in {clusters} clusters")
+        return {"Response": "Completed Deduplication", "Images": len(forest.parent), "Exact Duplicates": exact,
+                "Near Duplicates": near, "Duplicates": len(mapping), "Clusters": clusters}
+
+
+if __name__ == "__main__":
+    dedup = Deduplicator()
+    print(dedup.run_step())
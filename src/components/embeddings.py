@@ -1,22 +1,27 @@
 from src.components.data_preprocessing import DataPreprocessing
-from src.entity.config_entity import ImageFolderConfig, EmbeddingsConfig
-from src.utils.database_handler import MongoDBClient
+from src.entity.config_entity import ImageFolderConfig, EmbeddingsConfig, DedupConfig
+from src.utils.duplicates import load_canonical_map
+from src.utils.image_table import ImageTable
+from src.utils.database_handler import MongoDBClient, MongoWriteBuffer
 from torch.utils.data import Dataset, DataLoader
-from src.components.model import NeuralNet
-from typing import List, Dict
+from src.components.model import load_serving_student
+from src.components.export import exported_or_checkpoint, set_thread_counts
+from src.utils.metrics import metrics
+from concurrent.futures import ProcessPoolExecutor
+from torch.utils.data import Subset
+from typing import Dict
 from torchvision import transforms
 from collections import namedtuple
 from PIL import Image
-from torch import nn
-import pandas as pd
 from tqdm import tqdm
+import multiprocessing
 import numpy as np
-import json
 import torch
+import glob
+import time
 import os
-from pathlib import Path
 
-ImageRecord = namedtuple("ImageRecord", ["img", "label", "s3_link"])
+ImageRecord = namedtuple("ImageRecord", ["img", "label", "s3_link", "ingested_at"])
 
 
 class ImageFolder(Dataset):
@@ -31,20 +36,13 @@ class ImageFolder(Dataset):
         self.config = ImageFolderConfig()
         self.config.LABEL_MAP = label_map
         self.transform = self.transformations()
-        self.image_records: List[ImageRecord] = []
-        self.record = ImageRecord
-
-        file_list = os.listdir(self.config.ROOT_DIR)
-
-        for class_path in file_list:
-            path = os.path.join(self.config.ROOT_DIR, f"{class_path}")
-            images = os.listdir(path)
-            for image in tqdm(images):
-                image_path = Path(f"""{self.config.ROOT_DIR}/{class_path}/{image}""")
-                self.image_records.append(self.record(img=image_path,
-                                                      label=self.config.LABEL_MAP[class_path],
-                                                      s3_link=self.config.S3_LINK.format(
-                                                          self.config.BUCKET, class_path, image)))
+        # The local copy is written when the image is ingested and left alone by later syncs, so its
+        # modification time is the ingestion time.
+        with metrics.timer("image_scan"):
+            table = ImageTable.load_or_scan(self.config.ROOT_DIR, self.config.TABLE_CACHE_PATH,
+                                            self.config.SCAN_WORKERS)
+        self.table = table.without(load_canonical_map(DedupConfig().CANONICAL_MAP_PATH))
+        self.class_labels = np.array([self.config.LABEL_MAP[name] for name in self.table.classes], dtype=np.int64)
 
     def transformations(self):
         """
@@ -64,8 +62,25 @@ class ImageFolder(Dataset):
 
         return TRANSFORM_IMG
 
+    def record(self, idx: int) -> ImageRecord:
+        """
+        Materialise one row of the image table.
+
+        Parameters:
+        - idx (int): Index of the item.
+
+        Returns:
+        - ImageRecord: Local path, label, S3 link and ingestion time of the image.
+
+        """
+        class_name, name = self.table.relative_path(idx).split("/", 1)
+        return ImageRecord(img=os.path.join(self.config.ROOT_DIR, class_name, name),
+                           label=int(self.class_labels[self.table.class_ids[idx]]),
+                           s3_link=self.config.S3_LINK.format(self.config.BUCKET, class_name, name),
+                           ingested_at=int(self.table.ingested_at[idx]))
+
     def __len__(self):
-        return len(self.image_records)
+        return len(self.table)
 
     def __getitem__(self, idx):
         """
@@ -78,13 +93,14 @@ class ImageFolder(Dataset):
         - Tuple: Image, target, and link.
 
         """
-        record = self.image_records[idx]
+        record = self.record(idx)
         images, targets, links = record.img, record.label, record.s3_link
-        images = Image.open(images)
+        with metrics.timer("image_decode"):
+            images = Image.open(images)
 
-        if len(images.getbands()) < 3:
-            images = images.convert('RGB')
-        images = np.array(self.transform(images))
+            if len(images.getbands()) < 3:
+                images = images.convert('RGB')
+            images = np.array(self.transform(images))
         targets = torch.from_numpy(np.array(targets))
         images = torch.from_numpy(images)
 
@@ -97,12 +113,13 @@ class EmbeddingGenerator:
         Initialize the EmbeddingGenerator.
 
         Parameters:
-        - model: Neural network model for generating embeddings.
+        - model: Neural network model to load the trained weights into, or None to build one from the checkpoint.
         - device (str): Device to run the model on (e.g., "cpu" or "cuda").
 
         """
         self.config = EmbeddingsConfig()
         self.mongo = MongoDBClient()
+        self.writer = MongoWriteBuffer(self.mongo)
         self.model = model
         self.device = device
         self.embedding_model = self.load_model()
@@ -110,44 +127,192 @@ class EmbeddingGenerator:
 
     def load_model(self):
         """
-        Load the trained model.
+        Load the distilled student when it is selected, otherwise the trained model, preferring the exported
+        CPU graph when running on CPU.
 
         Returns:
-        - nn.Sequential: Trained model without the final fully connected layer.
+        - nn.Module: Embedding network.
 
         """
-        model = self.model.to(self.device)
-        model.load_state_dict(torch.load(self.config.MODEL_STORE_PATH, map_location=self.device))
-        return nn.Sequential(*list(model.children())[:-1])
+        student = load_serving_student(self.device)
+        if student is not None:
+            return student
+        return exported_or_checkpoint(self.config.EXPORTED_MODEL_PATH, self.config.MODEL_STORE_PATH, self.device,
+                                      self.config.INTRA_OP_THREADS, self.config.INTER_OP_THREADS, self.model)
 
-    def run_step(self, batch_size, image, label, s3_link):
+    def run_step(self, batch_size, image, label, s3_link, ingested_at=None):
         """
-        Generate embeddings for a batch of images and store them in MongoDB.
+        Generate embeddings for a batch of images and queue them for storage in MongoDB.
 
         Parameters:
         - batch_size (int): Size of the image batch.
         - image: Input image batch.
         - label: Target labels.
         - s3_link (str): S3 link for the images.
+        - ingested_at (List[int], optional): Ingestion time of each image in epoch seconds; defaults to now.
 
         Returns:
         - dict: Response indicating the completion of embeddings generation.
 
         """
-        records = dict()
+        with torch.inference_mode(), metrics.timer("embedding_batch"):
+            images = self.embedding_model(image.to(self.device))
+            images = images.cpu().numpy()
+        metrics.increment("embedded_images", len(images))
 
-        images = self.embedding_model(image.to(self.device))
-        images = images.detach().cpu().numpy()
+        if ingested_at is None:
+            ingested_at = [int(time.time())] * len(images)
+        records = [{"images": vector, "label": target, "s3_link": link, "ingested_at": int(timestamp)}
+                   for vector, target, link, timestamp in zip(images.tolist(), label.tolist(), s3_link, ingested_at)]
+        self.writer.add(records)
 
-        records['images'] = images.tolist()
-        records['label'] = label.tolist()
-        records['s3_link'] = s3_link
+        return {"Response": f"Completed Embeddings Generation for {batch_size}."}
 
-        df = pd.DataFrame(records)
-        records = list(json.loads(df.T.to_json()).values())
-        self.mongo.insert_bulk_record(records)
+    def close(self):
+        """
+        Flush any embeddings still buffered for MongoDB.
 
-        return {"Response": f"Completed Embeddings Generation for {batch_size}."}
+        Returns:
+        - dict: Response from the write buffer with the number of stored documents.
+
+        """
+        return self.writer.close()
+
+
+def embed_shard(shard: int, num_shards: int, label_map: Dict, device: str, threads: int):
+    """
+    Embed one deterministic, contiguous slice of the image folder and save it as an .npz shard.
+
+    Parameters:
+    - shard (int): Index of the shard to process.
+    - num_shards (int): Total number of shards.
+    - label_map (Dict): Dictionary mapping class names to label indices.
+    - device (str): Device holding this worker's model replica.
+    - threads (int): Intra-op thread budget of this worker.
+
+    Returns:
+    - dict: Shard path, number of embedded images and the worker's metrics for the parent to merge.
+
+    """
+    metrics.reset()
+    config = EmbeddingsConfig()
+    set_thread_counts(threads, 1)
+    model = load_serving_student(device)
+    if model is None:
+        model = exported_or_checkpoint(config.EXPORTED_MODEL_PATH, config.MODEL_STORE_PATH, device, threads, 1)
+
+    data = ImageFolder(label_map=label_map)
+    start, end = len(data) * shard // num_shards, len(data) * (shard + 1) // num_shards
+    dataloader = DataLoader(dataset=Subset(data, range(start, end)),
+                            batch_size=config.BATCH_SIZE, shuffle=False)
+
+    vectors, labels, links = [], [], []
+    with torch.inference_mode():
+        for img, target, link in dataloader:
+            with metrics.timer("embedding_batch"):
+                vectors.append(model(img.to(device)).cpu().numpy().astype(np.float32))
+            metrics.increment("embedded_images", len(target))
+            labels.append(target.numpy())
+            links.extend(link)
+
+    path = os.path.join(config.SHARD_DIR, f"shard-{shard:05d}-of-{num_shards:05d}.npz")
+    np.savez(path, ids=np.arange(start, end, dtype=np.int64),
+             vectors=np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32),
+             labels=np.concatenate(labels) if labels else np.empty(0, dtype=np.int64),
+             links=np.array(links),
+             ingested_at=data.table.ingested_at[start:end])
+    return {"Shard": path, "Images": end - start, "Metrics": metrics.state()}
+
+
+class ShardedEmbeddingGenerator:
+    def __init__(self, label_map: Dict, device: str):
+        """
+        Generate embeddings with one model replica per worker process over disjoint shards of the image folder.
+
+        Parameters:
+        - label_map (Dict): Dictionary mapping class names to label indices.
+        - device (str): "cpu" to shard across cores, or "cuda" to shard across visible GPUs.
+
+        """
+        self.config = EmbeddingsConfig()
+        self.label_map = label_map
+        self.device = device
+        if device.startswith("cuda"):
+            self.devices = [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+        else:
+            self.devices = ["cpu"] * self.config.NUM_WORKERS
+        self.num_shards = len(self.devices)
+        self.threads = max(1, (os.cpu_count() or 1) // self.num_shards)
+
+    def generate_shards(self):
+        """
+        Run every shard in its own spawned process and merge the workers' metrics into this process.
+
+        Returns:
+        - List[dict]: Per-shard responses.
+
+        """
+        os.makedirs(self.config.SHARD_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(self.config.SHARD_DIR, "shard-*.npz")):
+            os.remove(path)
+        # Refresh the cached image table once here, so the workers all load the same current table instead of
+        # each rescanning the image folder.
+        folder = ImageFolderConfig()
+        with metrics.timer("image_scan"):
+            ImageTable.load_or_scan(folder.ROOT_DIR, folder.TABLE_CACHE_PATH, folder.SCAN_WORKERS)
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.num_shards, mp_context=context) as executor:
+            futures = [executor.submit(embed_shard, shard, self.num_shards, self.label_map, device, self.threads)
+                       for shard, device in enumerate(self.devices)]
+            results = [future.result() for future in futures]
+        for result in results:
+            metrics.merge(result.pop("Metrics"))
+        return results
+
+    def merge_shards(self):
+        """
+        Concatenate the shards and order the rows by image id.
+
+        Returns:
+        - dict: Arrays of ids, vectors, labels, links and ingestion times.
+
+        """
+        keys = ("ids", "vectors", "labels", "links", "ingested_at")
+        shards = [np.load(path) for path in sorted(glob.glob(os.path.join(self.config.SHARD_DIR, "shard-*.npz")))]
+        shards = [shard for shard in shards if len(shard["ids"])]
+        if not shards:
+            return {"ids": np.empty(0, dtype=np.int64), "vectors": np.empty((0, 0), dtype=np.float32),
+                    "labels": np.empty(0, dtype=np.int64), "links": np.empty(0, dtype=str),
+                    "ingested_at": np.empty(0, dtype=np.int64)}
+        merged = {key: np.concatenate([shard[key] for shard in shards]) for key in keys}
+        order = np.argsort(merged["ids"], kind="stable")
+        return {key: value[order] for key, value in merged.items()}
+
+    def run_step(self):
+        """
+        Embed all shards in parallel, merge them by id and upsert the result into MongoDB.
+
+        Returns:
+        - dict: Response indicating the completion of embeddings generation.
+
+        """
+        with metrics.timer("embedding_shards"):
+            shards = self.generate_shards()
+        merged = self.merge_shards()
+
+        mongo = MongoDBClient()
+        with MongoWriteBuffer(mongo) as writer:
+            for start in range(0, len(merged["ids"]), mongo.config.WRITE_BATCH_SIZE):
+                end = start + mongo.config.WRITE_BATCH_SIZE
+                writer.add([{"images": vector, "label": int(label), "s3_link": str(link),
+                             "ingested_at": int(timestamp)}
+                            for vector, label, link, timestamp in zip(merged["vectors"][start:end].tolist(),
+                                                                      merged["labels"][start:end],
+                                                                      merged["links"][start:end],
+                                                                      merged["ingested_at"][start:end])])
+        return {"Response": f"Completed Embeddings Generation for {len(merged['ids'])} images "
+                            f"across {len(shards)} shards."}
 
 
 if __name__ == "__main__":
@@ -156,8 +321,12 @@ if __name__ == "__main__":
 
     data = ImageFolder(label_map=loaders["valid_data_loader"][1].class_to_idx)
     dataloader = DataLoader(dataset=data, batch_size=64, shuffle=True)
-    embeds = EmbeddingGenerator(model=NeuralNet(), device="cpu")
+    embeds = EmbeddingGenerator(model=None, device="cpu")
 
     for batch, values in tqdm(enumerate(dataloader)):
         img, target, link = values
-        print(embeds.run_step(batch, img, target, link))
\ No newline at end of file
+        print(embeds.run_step(batch, img, target, link))
+    print(embeds.close())
+
+    # Sharded alternative using every CPU core
+    # print(ShardedEmbeddingGenerator(loaders["valid_data_loader"][1].class_to_idx, "cpu").run_step())
\ No newline at end of file
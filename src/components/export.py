@@ -0,0 +1,206 @@
+from src.components.data_preprocessing import DataPreprocessing
+from src.entity.config_entity import ExportConfig
+from src.components.model import load_embedding_network
+from src.pipeline.dag import hash_path
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from itertools import islice
+from typing import Dict, Optional
+from torch import nn
+import torch
+import copy
+import os
+
+
+def set_thread_counts(intra_op_threads: int, inter_op_threads: int) -> None:
+    """
+    Tune the CPU thread pools used for inference.
+
+    Parameters:
+    - intra_op_threads (int): Threads used inside a single operator.
+    - inter_op_threads (int): Threads used to run independent operators concurrently.
+
+    """
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+        # The inter-op pool can only be sized once, before any parallel work has started.
+        pass
+
+
+def load_exported_model(path: str, model_path: str, intra_op_threads: int, inter_op_threads: int):
+    """
+    Load an exported TorchScript embedding graph for CPU inference, if it was exported from the current
+    checkpoint.
+
+    Parameters:
+    - path (str): Path of the TorchScript file.
+    - model_path (str): Path of the trained checkpoint the graph must have been exported from.
+    - intra_op_threads (int): Threads used inside a single operator.
+    - inter_op_threads (int): Threads used to run independent operators concurrently.
+
+    Returns:
+    - torch.jit.ScriptModule: Embedding graph in eval mode, or None when there is no export or it was made from
+      another checkpoint, e.g. after a retrain whose export stage did not run.
+
+    """
+    if not os.path.exists(path):
+        return None
+    set_thread_counts(intra_op_threads, inter_op_threads)
+    extra_files = {"source_model": ""}
+    model = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+    source = extra_files["source_model"]
+    if (source.decode() if isinstance(source, bytes) else source) != hash_path(model_path):
+        print(f"{path} was not exported from the current {model_path}, using the checkpoint instead")
+        return None
+    model.eval()
+    return model
+
+
+def exported_or_checkpoint(exported_path: str, model_path: str, device: str, intra_op_threads: int,
+                           inter_op_threads: int, model: Optional[nn.Module] = None):
+    """
+    Load the exported CPU graph when running on CPU and it matches the checkpoint, otherwise the checkpoint.
+
+    Parameters:
+    - exported_path (str): Path of the TorchScript file.
+    - model_path (str): Path of the trained checkpoint.
+    - device (str): Device to run the model on.
+    - intra_op_threads (int): Threads used inside a single operator by the exported graph.
+    - inter_op_threads (int): Threads used to run independent operators concurrently by the exported graph.
+    - model (nn.Module, optional): Network to load the checkpoint into.
+
+    Returns:
+    - nn.Module: Embedding network.
+
+    """
+    exported = load_exported_model(exported_path, model_path, intra_op_threads, inter_op_threads) \
+        if device == "cpu" else None
+    if exported is not None:
+        print(f"Loaded exported embedding graph from {exported_path}")
+        return exported
+    print(f"Loaded embedding network from {model_path}")
+    return load_embedding_network(model_path, device, model)
+
+
+class ModelExporter:
+    def __init__(self, loaders: Dict):
+        """
+        Export the trained embedding network as an optimised CPU inference graph.
+
+        Parameters:
+        - loaders (Dict): Data loaders; train batches calibrate quantisation, test batches measure drift.
+
+        """
+        self.config = ExportConfig()
+        self.calibration_loader = loaders["train_data_loader"][0]
+        self.evaluation_loader = loaders["test_data_loader"][0]
+        self.example_input = torch.zeros(1, 3, self.config.IMAGE_SIZE, self.config.IMAGE_SIZE)
+
+    def load_embedding_model(self):
+        """
+        Load the trained checkpoint on CPU without the final classification layer.
+
+        Returns:
+        - nn.Sequential: fp32 embedding network in eval mode.
+
+        """
+        return load_embedding_network(self.config.MODEL_STORE_PATH, "cpu")
+
+    def batches(self, loader):
+        """
+        Yield the first CALIBRATION_BATCHES image batches of a loader.
+        """
+        for batch in islice(loader, self.config.CALIBRATION_BATCHES):
+            yield batch[0]
+
+    def quantize(self, model):
+        """
+        Apply static int8 post-training quantisation, calibrated on training images.
+
+        Parameters:
+        - model: fp32 embedding network.
+
+        Returns:
+        - torch.fx.GraphModule: Quantised embedding network.
+
+        """
+        torch.backends.quantized.engine = self.config.BACKEND
+        qconfig_mapping = get_default_qconfig_mapping(self.config.BACKEND)
+        prepared = prepare_fx(copy.deepcopy(model), qconfig_mapping, (self.example_input,))
+        with torch.inference_mode():
+            for images in self.batches(self.calibration_loader):
+                prepared(images)
+        return convert_fx(prepared)
+
+    def embedding_drift(self, reference, candidate):
+        """
+        Compare candidate embeddings against fp32 embeddings on test images.
+
+        Parameters:
+        - reference: fp32 embedding network.
+        - candidate: Optimised embedding network.
+
+        Returns:
+        - dict: Minimum and mean cosine similarity between the two embeddings.
+
+        """
+        similarities = []
+        with torch.inference_mode():
+            for images in self.batches(self.evaluation_loader):
+                similarities.append(nn.functional.cosine_similarity(reference(images), candidate(images)))
+        similarities = torch.cat(similarities)
+        return {"min": similarities.min().item(), "mean": similarities.mean().item()}
+
+    def export_torchscript(self, model):
+        """
+        Trace, freeze and save the embedding network as TorchScript.
+        """
+        with torch.inference_mode():
+            traced = torch.jit.freeze(torch.jit.trace(model, self.example_input))
+        # Record the checkpoint the graph comes from, so loaders can tell when a retrain has made it stale.
+        traced.save(self.config.TORCHSCRIPT_PATH,
+                    _extra_files={"source_model": hash_path(self.config.MODEL_STORE_PATH)})
+        print(f"Saving TorchScript embedding graph at {self.config.TORCHSCRIPT_PATH}")
+
+    def export_onnx(self, model):
+        """
+        Save the fp32 embedding network as ONNX with a dynamic batch dimension.
+        """
+        torch.onnx.export(model, self.example_input, self.config.ONNX_PATH,
+                          input_names=["images"], output_names=["embeddings"],
+                          dynamic_axes={"images": {0: "batch"}, "embeddings": {0: "batch"}})
+        print(f"Saving ONNX embedding graph at {self.config.ONNX_PATH}")
+
+    def run_step(self):
+        """
+        Export the embedding graph, quantised when the accuracy drift stays within bounds.
+
+        Returns:
+        - dict: Response with whether the export is quantised and the measured drift.
+
+        """
+        model = self.load_embedding_model()
+        exported, drift = model, None
+
+        if self.config.QUANTIZE:
+            quantized = self.quantize(model)
+            drift = self.embedding_drift(model, quantized)
+            print(f"int8 embedding drift : min cosine {drift['min']:.4f}, mean cosine {drift['mean']:.4f}")
+            if drift["min"] >= self.config.MIN_COSINE_SIMILARITY:
+                exported = quantized
+            else:
+                print("Quantised embeddings drift too far from fp32, exporting fp32 graph instead")
+
+        self.export_torchscript(exported)
+        if self.config.EXPORT_ONNX:
+            self.export_onnx(model)
+        return {"Response": "Completed Model Export", "Quantized": exported is not model, "Drift": drift}
+
+
+if __name__ == "__main__":
+    dp = DataPreprocessing()
+    loaders = dp.run_step()
+    exporter = ModelExporter(loaders)
+    print(exporter.run_step())
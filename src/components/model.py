@@ -1,18 +1,26 @@
-from src.entity.config_entity import ModelConfig
+from src.entity.config_entity import ModelConfig, DistillationConfig
+from src.pipeline.dag import hash_path
+from torchvision import models
 from torch import nn
+import torch.nn.functional as F
 import torch
+import os
 
 
 class NeuralNet(nn.Module):
     """
     Neural network model for image classification.
     """
-    def __init__(self):
+    def __init__(self, pretrained: bool = None):
         """
         Initialize the neural network model.
+
+        Args:
+            pretrained (bool, optional): Load ImageNet weights into the backbone. Defaults to ModelConfig.PRETRAINED.
         """
         super().__init__()
         self.config = ModelConfig()
+        self.pretrained = self.config.PRETRAINED if pretrained is None else pretrained
         self.base_model = self.get_model()
         self.conv1 = nn.Conv2d(512, 32, kernel_size=(3, 3), stride=(1, 1), padding=(1, 1))
         self.conv2 = nn.Conv2d(32, 16, kernel_size=(3, 3), stride=(1, 1), padding=(1, 1))
@@ -22,17 +30,14 @@ class NeuralNet(nn.Module):
 
     def get_model(self):
         """
-        Load and return the base model.
+        Build the base model from the local torchvision package, downloading weights only when pretrained.
 
         Returns:
             nn.Sequential: Base model for feature extraction.
         """
-        torch.hub.set_dir(self.config.STORE_PATH)
-        model = torch.hub.load(
-            self.config.REPOSITORY,
-            self.config.BASEMODEL,
-            pretrained=self.config.PRETRAINED
-        )
+        if self.pretrained:
+            torch.hub.set_dir(self.config.STORE_PATH)
+        model = getattr(models, self.config.BASEMODEL)(weights="DEFAULT" if self.pretrained else None)
         return nn.Sequential(*list(model.children())[:-2])
 
     def forward(self, x):
@@ -53,6 +58,133 @@ class NeuralNet(nn.Module):
         x = self.final(x)
         return x
 
+    def embedding_network(self):
+        """
+        Return the network without its final classification layer.
+
+        Returns:
+            nn.Sequential: Embedding sub-network sharing this model's parameters.
+        """
+        return nn.Sequential(*list(self.children())[:-1])
+
+
+class StudentNet(nn.Module):
+    """
+    Small embedding network distilled from NeuralNet's embedding network: it maps the same preprocessed images to
+    the same embedding space, so it can query or rebuild the existing index.
+    """
+    def __init__(self, pretrained: bool = None):
+        """
+        Initialize the student network.
+
+        Args:
+            pretrained (bool, optional): Load ImageNet weights into the backbone. Defaults to
+                DistillationConfig.PRETRAINED.
+        """
+        super().__init__()
+        self.config = DistillationConfig()
+        self.pretrained = self.config.PRETRAINED if pretrained is None else pretrained
+        self.base_model = self.get_model()
+        with torch.no_grad():
+            channels = self.base_model(torch.zeros(1, 3, 64, 64)).shape[1]
+        self.pool = nn.AdaptiveAvgPool2d((4, 4))
+        self.flatten = nn.Flatten()
+        self.final = nn.Linear(channels * 4 * 4, self.config.EMBEDDING_DIMENSION)
+
+    def get_model(self):
+        """
+        Build the student backbone from the local torchvision package, downloading weights only when pretrained.
+
+        Returns:
+            nn.Sequential: Backbone without its pooling and classification layers.
+        """
+        if self.pretrained:
+            torch.hub.set_dir(ModelConfig().STORE_PATH)
+        model = getattr(models, self.config.BACKBONE)(weights="DEFAULT" if self.pretrained else None)
+        return nn.Sequential(*list(model.children())[:-2])
+
+    def forward(self, x):
+        """
+        Embed a batch of images preprocessed for the teacher, downscaling them to the student resolution first.
+
+        Args:
+            x (torch.Tensor): Input data of shape (N, 3, H, W).
+
+        Returns:
+            torch.Tensor: Embeddings of shape (N, EMBEDDING_DIMENSION).
+        """
+        if x.shape[-1] != self.config.IMAGE_SIZE:
+            x = F.interpolate(x, size=self.config.IMAGE_SIZE, mode="bilinear", antialias=True, align_corners=False)
+        x = self.base_model(x)
+        x = self.pool(x)
+        x = self.flatten(x)
+        return self.final(x)
+
+
+def load_student_network(checkpoint_path: str, device: str = "cpu", teacher_path: str = None):
+    """
+    Build the distilled student from a checkpoint saved by Trainer.distill_model.
+
+    Args:
+        checkpoint_path (str): Path of the student checkpoint.
+        device (str): Device to place the network on.
+        teacher_path (str, optional): Teacher checkpoint the student must have been distilled from.
+
+    Returns:
+        StudentNet: Student in eval mode.
+
+    Raises:
+        ValueError: If the student was distilled from another teacher checkpoint than `teacher_path`.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location=device)
+    if teacher_path is not None and checkpoint.get("teacher") != hash_path(teacher_path):
+        raise ValueError(f"{checkpoint_path} was distilled from another {teacher_path}; run the distill stage again")
+    model = StudentNet(pretrained=False)
+    model.load_state_dict(checkpoint["state_dict"])
+    return model.to(device).eval()
+
+
+def load_serving_student(device: str = "cpu"):
+    """
+    Load the distilled student when DistillationConfig.SERVE_STUDENT selects it for embedding and queries.
+
+    Args:
+        device (str): Device to place the network on.
+
+    Returns:
+        StudentNet: Student in eval mode, or None when the teacher should be used.
+
+    Raises:
+        FileNotFoundError: If the student is selected but was never distilled.
+        ValueError: If the student was distilled from another teacher checkpoint than the current one.
+    """
+    config = DistillationConfig()
+    if not config.SERVE_STUDENT:
+        return None
+    if not os.path.exists(config.STUDENT_STORE_PATH):
+        raise FileNotFoundError(f"SERVE_STUDENT is set but {config.STUDENT_STORE_PATH} does not exist; "
+                                f"enable distillation and run the distill stage")
+    student = load_student_network(config.STUDENT_STORE_PATH, device, config.MODEL_STORE_PATH)
+    print(f"Loaded distilled student from {config.STUDENT_STORE_PATH}")
+    return student
+
+
+def load_embedding_network(checkpoint_path: str, device: str = "cpu", model: NeuralNet = None):
+    """
+    Build the embedding sub-network from a trained checkpoint without touching the network.
+
+    Args:
+        checkpoint_path (str): Path of the state dict saved by the Trainer.
+        device (str): Device to place the network on.
+        model (NeuralNet, optional): Architecture to load into; an untrained one is built when omitted.
+
+    Returns:
+        nn.Sequential: Embedding network in eval mode.
+    """
+    model = model if model is not None else NeuralNet(pretrained=False)
+    model.load_state_dict(torch.load(checkpoint_path, map_location=device))
+    return model.embedding_network().to(device).eval()
+
 
 if __name__ == '__main__':
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -1,9 +1,18 @@
 from src.utils.database_handler import MongoDBClient
-from src.entity.config_entity import AnnoyConfig
+from src.entity.config_entity import AnnoyConfig, DedupConfig, ProjectionConfig
+from src.utils.duplicates import image_key, load_canonical_map
+from src.components.projection import embeddings_digest, load_projection
+from src.utils.metrics import metrics
 from annoy import AnnoyIndex
 from typing_extensions import Literal
+from typing import Dict, List, Optional
 from tqdm import tqdm
+import numpy as np
+import resource
+import shutil
 import json
+import math
+import os
 
 
 class CustomAnnoy(AnnoyIndex):
@@ -33,7 +42,7 @@ class CustomAnnoy(AnnoyIndex):
         self.label.append(label)
 
     def get_nns_by_vector(
-            self, vector, n: int, search_k: int = ..., include_distances: Literal[False] = ...):
+            self, vector, n: int, search_k: int = -1, include_distances: bool = False):
         """
         Get the nearest neighbors by vector.
 
@@ -41,13 +50,16 @@ class CustomAnnoy(AnnoyIndex):
         - vector: Query vector.
         - n (int): Number of neighbors to retrieve.
         - search_k (int): Search parameter.
-        - include_distances (Literal[False]): Whether to include distances in the result.
+        - include_distances (bool): Whether to include distances in the result.
 
         Returns:
-        - List[str]: Labels of the nearest neighbors.
+        - List[str]: Labels of the nearest neighbors, paired with their distances if requested.
 
         """
-        indexes = super().get_nns_by_vector(vector, n, search_k, include_distances)
+        if include_distances:
+            indexes, distances = super().get_nns_by_vector(vector, n, search_k, True)
+            return [self.label[link] for link in indexes], distances
+        indexes = super().get_nns_by_vector(vector, n, search_k, False)
         labels = [self.label[link] for link in indexes]
         return labels
 
@@ -78,6 +90,466 @@ class CustomAnnoy(AnnoyIndex):
         json.dump(self.label, open(path, "w"))
 
 
+def metadata_paths(fn: str):
+    """
+    Locate the metadata columns and the per-label sub-index directory stored next to an index file.
+
+    Parameters:
+    - fn (str): File name of the main index.
+
+    Returns:
+    - Tuple[str, str]: Path of the metadata .npz and of the label index directory.
+
+    """
+    stem = os.path.splitext(fn)[0]
+    return f"{stem}.meta.npz", f"{stem}_labels"
+
+
+def read_index_record(fn: str):
+    """
+    Read the vector dimension and the projection an index was built with from its metadata.
+
+    Parameters:
+    - fn (str): File name of the main index.
+
+    Returns:
+    - Tuple[Optional[int], str]: Dimension (None for indexes saved without it) and the digest of the PCA
+      projection applied to the indexed vectors ("" when they are unprojected).
+
+    """
+    meta_path = metadata_paths(fn)[0]
+    if not os.path.exists(meta_path):
+        return None, ""
+    with np.load(meta_path) as meta:
+        dimension = int(meta["dimension"]) if "dimension" in meta else None
+        return dimension, str(meta["projection"]) if "projection" in meta else ""
+
+
+def index_paths(fn: str) -> List[str]:
+    """
+    List every file and directory that makes up a saved FilteredAnnoy index: the main index, its links, the
+    metadata columns and the label sub-index directory.
+    """
+    return [fn, fn.replace(".ann", ".json"), *metadata_paths(fn)]
+
+
+def replace_path(source: str, destination: str):
+    """
+    Move a freshly built file or directory over the one it replaces.
+
+    Files are swapped with an atomic rename, so processes that memory-mapped the previous file keep reading it
+    until they reload. A directory cannot be renamed over a non-empty one, so the previous directory is moved
+    aside first and removed after the swap.
+
+    Parameters:
+    - source (str): Newly built file or directory.
+    - destination (str): Path it is published at.
+
+    """
+    if not os.path.isdir(source):
+        os.replace(source, destination)
+        return
+    previous = f"{destination}.previous"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(destination):
+        os.replace(destination, previous)
+    os.replace(source, destination)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def remove_paths(paths: List[str]):
+    """
+    Remove the given files and directories if they exist.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak resident memory the kernel records for this process to its current resident memory, so
+    peak_rss_bytes() covers only the work that follows. Only Linux supports this.
+
+    Returns:
+    - bool: True if the peak was reset.
+
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident memory of this process since the last reset_peak_rss(), in bytes. Without /proc this falls back
+    to the peak over the whole life of the process.
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def rank_order(distances, metric: str) -> np.ndarray:
+    """
+    Order Annoy distances from best to worst; the "dot" metric reports similarities, where larger is better.
+    """
+    distances = np.asarray(distances)
+    return np.argsort(-distances if metric == "dot" else distances, kind="stable")
+
+
+def vector_distances(vectors: np.ndarray, vector, metric: str) -> np.ndarray:
+    """
+    Compute Annoy-compatible distances from one query vector to a matrix of item vectors.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if metric == "euclidean":
+        return np.sqrt(((vectors - vector) ** 2).sum(axis=1))
+    if metric == "manhattan":
+        return np.abs(vectors - vector).sum(axis=1)
+    if metric == "dot":
+        return vectors @ vector
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(vector)
+    cosine = (vectors @ vector) / np.maximum(norms, 1e-12)
+    return np.sqrt(np.maximum(2 - 2 * cosine, 0))
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int, metric: str, chunk: int = 65536):
+    """
+    Find the exact k nearest items of every query, scanning the items in chunks to bound memory.
+
+    Parameters:
+    - vectors (np.ndarray): Item vectors.
+    - queries (np.ndarray): Query vectors.
+    - k (int): Number of neighbours.
+    - metric (str): Annoy distance metric.
+    - chunk (int): Items scanned at a time.
+
+    Returns:
+    - np.ndarray: Item ids of shape (queries, k), best first.
+
+    """
+    sign = -1 if metric == "dot" else 1
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    best = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk]
+        distances = sign * np.stack([vector_distances(block, query, metric) for query in queries])
+        ids = np.broadcast_to(np.arange(start, start + len(block)), distances.shape)
+        best, best_ids = np.hstack([best, distances]), np.hstack([best_ids, ids])
+        keep = np.argsort(best, axis=1, kind="stable")[:, :k]
+        best, best_ids = np.take_along_axis(best, keep, 1), np.take_along_axis(best_ids, keep, 1)
+    return best_ids
+
+
+def measure_recall(index: AnnoyIndex, vectors: np.ndarray, metric: str, k: int, queries: int,
+                   search_k: int = -1, seed: int = 0) -> float:
+    """
+    Estimate recall@k of an Annoy index against an exact scan, querying with a sample of its own items
+    and leaving the query item out of both neighbour lists.
+
+    Parameters:
+    - index (AnnoyIndex): Built index whose item i is row i of `vectors`.
+    - vectors (np.ndarray): Item vectors.
+    - metric (str): Annoy distance metric.
+    - k (int): Number of neighbours.
+    - queries (int): Number of sampled queries.
+    - search_k (int): Annoy search_k used for the queries.
+    - seed (int): Sampling seed.
+
+    Returns:
+    - float: Mean fraction of the exact neighbours found.
+
+    """
+    if len(vectors) <= k + 1:
+        return 1.0
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(vectors), min(queries, len(vectors)), replace=False)
+    exact = exact_neighbours(vectors, vectors[sample], k + 1, metric)
+    found = 0
+    for query, neighbours in zip(sample, exact):
+        approximate = AnnoyIndex.get_nns_by_vector(index, vectors[query], k + 1, search_k)
+        truth = [item for item in neighbours if item != query][:k]
+        found += len(set(truth) & set(item for item in approximate if item != query))
+    return found / (len(sample) * k)
+
+
+def choose_n_trees(vectors: np.ndarray, metric: str, target_recall: float, k: int, queries: int, sample: int,
+                   min_trees: int, max_trees: int, n_jobs: int = -1, seed: int = 0) -> int:
+    """
+    Pick the number of trees for a catalogue: double the trees of an index built on a sample until it reaches
+    the target recall, then scale by log(catalogue size) / log(sample size) since the same number of trees
+    loses recall as the catalogue grows.
+
+    Parameters:
+    - vectors (np.ndarray): Item vectors of the whole catalogue.
+    - metric (str): Annoy distance metric.
+    - target_recall (float): Recall@k the index should reach.
+    - k (int): Number of neighbours recall is measured at.
+    - queries (int): Number of sampled queries per measurement.
+    - sample (int): Catalogue items used for calibration.
+    - min_trees (int): Lower bound and first candidate.
+    - max_trees (int): Upper bound.
+    - n_jobs (int): Threads used to build the calibration indexes.
+    - seed (int): Sampling seed.
+
+    Returns:
+    - int: Number of trees.
+
+    """
+    rng = np.random.default_rng(seed)
+    subset = vectors[np.sort(rng.choice(len(vectors), min(sample, len(vectors)), replace=False))]
+    n_trees = min_trees
+    while True:
+        index = AnnoyIndex(vectors.shape[1], metric)
+        for i, vector in enumerate(subset):
+            index.add_item(i, vector)
+        index.build(n_trees, n_jobs)
+        recall = measure_recall(index, subset, metric, k, queries, seed=seed)
+        index.unload()
+        print(f"Calibration : {n_trees} trees on {len(subset)} items reach recall@{k} {recall:.3f}")
+        if recall >= target_recall or n_trees >= max_trees:
+            break
+        n_trees = min(max_trees, n_trees * 2)
+    if len(subset) > 1 and len(vectors) > len(subset):
+        n_trees = math.ceil(n_trees * math.log(len(vectors)) / math.log(len(subset)))
+    return int(min(max(n_trees, min_trees), max_trees))
+
+
+class FilteredAnnoy:
+    def __init__(self, f: int, metric: Literal["angular", "euclidean", "manhattan", "hamming", "dot"],
+                 overfetch: float = 1.5, brute_force_limit: int = 2048):
+        """
+        Annoy index with per-item metadata (label id and ingestion time) kept in columnar arrays,
+        per-label sub-indexes and filter-aware search.
+
+        Parameters:
+        - f (int): The number of dimensions in the vector.
+        - metric (Literal["angular", "euclidean", "manhattan", "hamming", "dot"]): Distance metric.
+        - overfetch (float): Extra candidates fetched on top of the expected number needed to find k matches.
+        - brute_force_limit (int): Filters matching at most this many items are answered with an exact scan.
+
+        """
+        self.f = f
+        self.metric = metric
+        self.overfetch = overfetch
+        self.brute_force_limit = brute_force_limit
+        self.index = CustomAnnoy(f, metric)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.ingested_at = np.empty(0, dtype=np.int64)
+        self.label_ids: Dict[int, np.ndarray] = {}
+        self.label_indexes: Dict[int, AnnoyIndex] = {}
+        self.n_trees = 0
+        self.on_disk_path = None
+        # Digest of the PCA projection applied to the indexed vectors, "" when they are unprojected.
+        self.projection = ""
+
+    def build(self, vectors: np.ndarray, links: List[str], labels: np.ndarray, ingested_at: np.ndarray,
+              n_trees: int, label_indexes: bool = True, n_jobs: int = -1, on_disk_path: Optional[str] = None):
+        """
+        Build the main index and, optionally, one sub-index per label.
+
+        Parameters:
+        - vectors (np.ndarray): Item vectors; row i becomes item i.
+        - links (List[str]): S3 link of every item.
+        - labels (np.ndarray): Label id of every item.
+        - ingested_at (np.ndarray): Ingestion time of every item in epoch seconds.
+        - n_trees (int): Number of trees per index.
+        - label_indexes (bool): Build per-label sub-indexes for label-restricted search.
+        - n_jobs (int): Threads used to build the trees, -1 for every core.
+        - on_disk_path (str, optional): Build the indexes straight into their files at this location instead of
+          in RAM; `save` must then be called with the same path. Anything already at that location is
+          overwritten in place, so it must not be an index other processes have loaded.
+
+        """
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.ingested_at = np.asarray(ingested_at, dtype=np.int64)
+        self.n_trees = n_trees
+        self.on_disk_path = on_disk_path
+        label_dir = None
+        if on_disk_path:
+            os.makedirs(os.path.dirname(on_disk_path) or ".", exist_ok=True)
+            label_dir = metadata_paths(on_disk_path)[1]
+            shutil.rmtree(label_dir, ignore_errors=True)
+            os.makedirs(label_dir)
+            self.index.on_disk_build(on_disk_path)
+        with metrics.timer("index_add"):
+            for i in tqdm(range(len(links))):
+                self.index.add_item(i, vectors[i], links[i])
+        with metrics.timer("index_build"):
+            self.index.build(n_trees, n_jobs)
+
+        self.label_ids, self.label_indexes = {}, {}
+        if not label_indexes:
+            return
+        with metrics.timer("index_label_build"):
+            for label in np.unique(self.labels):
+                ids = np.flatnonzero(self.labels == label)
+                sub_index = AnnoyIndex(self.f, self.metric)
+                if label_dir:
+                    sub_index.on_disk_build(os.path.join(label_dir, f"label-{label}.ann"))
+                for position, item in enumerate(ids):
+                    sub_index.add_item(position, vectors[item])
+                sub_index.build(n_trees, n_jobs)
+                self.label_ids[int(label)] = ids
+                self.label_indexes[int(label)] = sub_index
+
+    def save(self, fn: str):
+        """
+        Save the index, its links, the metadata columns and the label sub-indexes.
+
+        Parameters:
+        - fn (str): File name of the main index.
+
+        """
+        self.index.save(fn)
+        meta_path, label_dir = metadata_paths(fn)
+        keys = np.array(sorted(self.label_ids), dtype=np.int64)
+        offsets = np.cumsum([0] + [len(self.label_ids[key]) for key in keys])
+        ids = np.concatenate([self.label_ids[key] for key in keys]) if len(keys) else np.empty(0, dtype=np.int64)
+        np.savez(meta_path, labels=self.labels, ingested_at=self.ingested_at, n_trees=self.n_trees,
+                 label_keys=keys, label_offsets=offsets, label_ids=ids, dimension=self.f, projection=self.projection)
+
+        if self.on_disk_path:
+            if os.path.abspath(fn) != os.path.abspath(self.on_disk_path):
+                raise ValueError(f"Index was built on disk at {self.on_disk_path}, cannot save it to {fn}")
+            return
+        shutil.rmtree(label_dir, ignore_errors=True)
+        os.makedirs(label_dir, exist_ok=True)
+        for label, sub_index in self.label_indexes.items():
+            sub_index.save(os.path.join(label_dir, f"label-{label}.ann"))
+
+    def load(self, fn: str):
+        """
+        Memory-map the index and its label sub-indexes and read the metadata columns.
+
+        Parameters:
+        - fn (str): File name of the main index.
+
+        """
+        self.index.load(fn)
+        meta_path, label_dir = metadata_paths(fn)
+        if not os.path.exists(meta_path):
+            # Index built before metadata was recorded: only unfiltered search is available.
+            return
+        with np.load(meta_path) as meta:
+            self.labels, self.ingested_at = meta["labels"], meta["ingested_at"]
+            self.n_trees = int(meta["n_trees"])
+            self.projection = str(meta["projection"]) if "projection" in meta else ""
+            keys, offsets, ids = meta["label_keys"], meta["label_offsets"], meta["label_ids"]
+        self.label_ids = {int(key): ids[offsets[i]:offsets[i + 1]] for i, key in enumerate(keys)}
+        self.label_indexes = {}
+        for label in self.label_ids:
+            path = os.path.join(label_dir, f"label-{label}.ann")
+            if os.path.exists(path):
+                sub_index = AnnoyIndex(self.f, self.metric)
+                sub_index.load(path)
+                self.label_indexes[label] = sub_index
+
+    def candidates(self, label: Optional[int], since: Optional[int], until: Optional[int]):
+        """
+        Resolve the filters to the item ids they allow.
+
+        Returns:
+        - Tuple: Allowed item ids (None when unrestricted) and whether the label sub-index covers the label filter.
+
+        """
+        if label is None and since is None and until is None:
+            return None, False
+        if len(self.labels) != self.index.get_n_items():
+            raise ValueError("Index has no metadata; rebuild it to enable filtered search")
+        use_label_index = label is not None and label in self.label_indexes
+        if label is not None:
+            ids = self.label_ids.get(label, np.flatnonzero(self.labels == label))
+        else:
+            ids = np.arange(len(self.labels))
+        if since is not None or until is not None:
+            times = self.ingested_at[ids]
+            mask = np.ones(len(ids), dtype=bool)
+            if since is not None:
+                mask &= times >= since
+            if until is not None:
+                mask &= times <= until
+            ids = ids[mask]
+        return ids, use_label_index
+
+    def search(self, vector, k: int, search_k: int = -1, label: Optional[int] = None,
+               since: Optional[int] = None, until: Optional[int] = None, include_distances: bool = False):
+        """
+        Find the k nearest items that satisfy the label and ingestion-time filters.
+
+        Label filters are served by the label's sub-index. Time filters over-fetch from the smallest index that
+        covers the label, sizing the candidate count and search_k from the filter's selectivity and doubling
+        them until k matches are found; very selective filters fall back to an exact scan of the matching items.
+
+        Parameters:
+        - vector: Query vector.
+        - k (int): Number of neighbours.
+        - search_k (int): Annoy search_k for k results, scaled with the candidate count; -1 uses Annoy's default.
+        - label (int, optional): Only return items with this label id.
+        - since (int, optional): Only return items ingested at or after this epoch second.
+        - until (int, optional): Only return items ingested at or before this epoch second.
+        - include_distances (bool): Whether to include distances in the result.
+
+        Returns:
+        - List[str]: S3 links ordered by distance, paired with their distances if requested.
+
+        """
+        items, distances = self.search_items(vector, k, search_k, label, since, until)
+        links = [self.index.label[int(item)] for item in items]
+        return (links, list(distances)) if include_distances else links
+
+    def search_items(self, vector, k: int, search_k: int, label: Optional[int],
+                     since: Optional[int], until: Optional[int]):
+        """
+        Filtered search returning item ids and their distances; see `search`.
+        """
+        allowed, use_label_index = self.candidates(label, since, until)
+        if allowed is None:
+            return AnnoyIndex.get_nns_by_vector(self.index, vector, k, search_k, True)
+        if len(allowed) == 0:
+            return [], []
+        if use_label_index and since is None and until is None:
+            items, distances = self.label_indexes[label].get_nns_by_vector(vector, k, search_k, True)
+            return self.label_ids[label][items], distances
+
+        if len(allowed) <= self.brute_force_limit:
+            vectors = np.array([self.index.get_item_vector(int(item)) for item in allowed], dtype=np.float32)
+            distances = vector_distances(vectors, vector, self.metric)
+            order = rank_order(distances, self.metric)[:k]
+            return allowed[order], distances[order].tolist()
+
+        if use_label_index:
+            sub_index, ids = self.label_indexes[label], self.label_ids[label]
+        else:
+            sub_index, ids = self.index, None
+        mask = np.zeros(len(self.labels), dtype=bool)
+        mask[allowed] = True
+        universe = sub_index.get_n_items()
+        n = min(universe, math.ceil(k * universe / len(allowed) * self.overfetch))
+        while True:
+            budget = -1 if search_k == -1 else math.ceil(search_k * n / k)
+            items, distances = AnnoyIndex.get_nns_by_vector(sub_index, vector, n, budget, True)
+            items, distances = np.asarray(items, dtype=np.int64), np.asarray(distances)
+            if ids is not None:
+                items = ids[items]
+            matches = mask[items]
+            found, found_distances = items[matches][:k], distances[matches][:k]
+            if len(found) == k or n >= universe:
+                return found, found_distances.tolist()
+            n = min(universe, n * 2)
+
+
 class Annoy(object):
     def __init__(self):
         """
@@ -86,23 +558,107 @@ class Annoy(object):
         """
         self.config = AnnoyConfig()
         self.mongo = MongoDBClient()
-        self.result = self.mongo.get_collection_documents()["Info"]
+
+    def load_catalogue(self):
+        """
+        Export the embeddings, projecting them when ProjectionConfig.ENABLED is set, and drop the images the dedup
+        job mapped to a canonical image.
+
+        The projected vectors stored by the project stage are reused only if they were made with the current
+        projection from exactly the embeddings MongoDB holds now; otherwise the fresh embeddings are projected here.
+
+        Returns:
+        - Tuple[np.ndarray, List[str], np.ndarray, np.ndarray, str]: Vectors, links, labels, ingestion times and
+          the digest of the projection applied to the vectors ("" when unprojected).
+
+        """
+        config = ProjectionConfig()
+        projection = load_projection(config.PROJECTION_PATH) if config.ENABLED else None
+        if config.ENABLED and projection is None:
+            raise FileNotFoundError(f"Projection is enabled but {config.PROJECTION_PATH} does not exist; "
+                                    f"run the project stage first")
+        export = self.mongo.export_embeddings()
+        if projection is not None:
+            projected = None
+            if os.path.exists(config.PROJECTED_PATH):
+                with np.load(config.PROJECTED_PATH) as data:
+                    if "source" in data and str(data["projection"]) == projection.digest() \
+                            and str(data["source"]) == embeddings_digest(export["Links"], export["Vectors"]):
+                        projected = data["vectors"]
+                    else:
+                        print(f"{config.PROJECTED_PATH} is stale, projecting the stored embeddings again")
+            if projected is None:
+                with metrics.timer("projection_transform"):
+                    projected = projection.transform_stored(export["Vectors"])
+            export["Vectors"] = projected.astype(np.float32)
+        duplicates = load_canonical_map(DedupConfig().CANONICAL_MAP_PATH)
+        keep = np.array([image_key(link) not in duplicates for link in export["Links"]], dtype=bool)
+        links = [link for link, kept in zip(export["Links"], keep) if kept]
+        print(f"Skipping {int((~keep).sum())} duplicate images")
+        return (export["Vectors"][keep], links, export["Labels"][keep], export["IngestedAt"][keep],
+                projection.digest() if projection is not None else "")
+
+    def n_trees(self, vectors: np.ndarray) -> int:
+        """
+        Number of trees to build: N_TREES if set, otherwise calibrated for TARGET_RECALL on this catalogue.
+        """
+        if self.config.N_TREES is not None:
+            return self.config.N_TREES
+        with metrics.timer("index_calibration"):
+            return choose_n_trees(vectors, 'euclidean', self.config.TARGET_RECALL, self.config.RECALL_K,
+                                  self.config.RECALL_QUERIES, self.config.CALIBRATION_SAMPLE,
+                                  self.config.MIN_TREES, self.config.MAX_TREES, self.config.BUILD_JOBS)
 
     def build_annoy_format(self):
         """
-        Build Annoy index and store it in the specified file.
+        Build Annoy index and store it in the specified file. With SHARDS > 1 the catalogue is partitioned and
+        the shard indexes are built in parallel instead.
 
         Returns:
         - bool: True if successful.
 
         """
-        Ann = CustomAnnoy(256, 'euclidean')
-        print("Creating Ann for predictions : ")
-        for i, record in tqdm(enumerate(self.result), total=8677):
-            Ann.add_item(i, record["images"], record["s3_link"])
+        vectors, links, labels, ingested_at, projection = self.load_catalogue()
+        # Peak memory is reported for the build alone, not for training or embedding earlier in this process.
+        reset_peak_rss()
+        n_trees = self.n_trees(vectors)
+        metrics.gauge("index_n_trees", n_trees)
+        if self.config.SHARDS > 1:
+            from src.components.sharded_index import ShardedIndexBuilder
+            manifest = ShardedIndexBuilder().run_step(vectors, links, labels, ingested_at, n_trees, projection)
+            # The manifest takes precedence when serving, but a stale single index must not be archived with it.
+            remove_paths(index_paths(self.config.EMBEDDING_STORE_PATH))
+            metrics.gauge("index_items", len(links))
+            shard_peaks = [shard["peak_rss_bytes"] for shard in manifest["shards"]]
+            metrics.gauge("index_peak_rss_bytes", max([peak_rss_bytes(), *shard_peaks]))
+            return True
+        # A stale shard manifest would otherwise keep being served instead of the new index.
+        shutil.rmtree(self.config.SHARD_DIR, ignore_errors=True)
+
+        # Build next to the published index and swap it in once complete: the search service keeps the published
+        # files memory-mapped, and a failed build leaves them untouched.
+        building_path = self.config.EMBEDDING_STORE_PATH.replace(".ann", ".building.ann")
+        remove_paths(index_paths(building_path))
+        Ann = FilteredAnnoy(vectors.shape[1], 'euclidean')
+        Ann.projection = projection
+        print(f"Creating Ann for predictions with {n_trees} trees : ")
+        Ann.build(vectors, links, labels, ingested_at, n_trees, self.config.LABEL_INDEXES,
+                  self.config.BUILD_JOBS, building_path if self.config.ON_DISK_BUILD else None)
+        with metrics.timer("index_save"):
+            Ann.save(building_path)
+            # The service versions the index by the stat of the .ann file, so it is published last: a reload
+            # triggered by the new .ann always finds the links, metadata and label indexes that belong to it.
+            for source, destination in reversed(list(zip(index_paths(building_path),
+                                                         index_paths(self.config.EMBEDDING_STORE_PATH)))):
+                replace_path(source, destination)
+        metrics.gauge("index_items", len(links))
+        metrics.gauge("index_peak_rss_bytes", peak_rss_bytes())
 
-        Ann.build(100)
-        Ann.save(self.config.EMBEDDING_STORE_PATH)
+        with metrics.timer("index_recall"):
+            recall = measure_recall(Ann.index, vectors, 'euclidean', self.config.RECALL_K,
+                                    self.config.RECALL_QUERIES)
+        metrics.gauge("index_recall", recall)
+        print(f"Index recall@{self.config.RECALL_K} : {recall:.3f} (target {self.config.TARGET_RECALL})")
         return True
 
     def run_step(self):
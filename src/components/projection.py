@@ -0,0 +1,229 @@
+from src.entity.config_entity import ProjectionConfig
+from src.utils.database_handler import MongoDBClient
+from src.utils.metrics import metrics
+from typing import Optional
+import numpy as np
+import hashlib
+import os
+
+
+class Projection:
+    def __init__(self, mean: np.ndarray, components: np.ndarray, scale: Optional[np.ndarray] = None,
+                 normalize: bool = False, explained_variance: float = 1.0):
+        """
+        PCA projection of embeddings, optionally whitened and L2-normalised.
+
+        Parameters:
+        - mean (np.ndarray): Mean of the fitted sample, shape (input_dim,).
+        - components (np.ndarray): Principal axes, shape (output_dim, input_dim).
+        - scale (np.ndarray, optional): Per-component whitening factors, shape (output_dim,).
+        - normalize (bool): L2-normalise the projected vectors.
+        - explained_variance (float): Fraction of the sample variance kept by the components.
+
+        """
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+        self.scale = scale.astype(np.float32) if scale is not None else None
+        self.normalize = normalize
+        self.explained_variance = explained_variance
+
+    @property
+    def dimension(self) -> int:
+        return self.components.shape[0]
+
+    def digest(self) -> str:
+        """
+        Identify the projection by its parameters, so indexes and projected vectors can record which one they used.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (self.mean, self.components, self.scale if self.scale is not None else np.empty(0)):
+            digest.update(array.tobytes())
+        digest.update(b"normalize" if self.normalize else b"")
+        return digest.hexdigest()
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dimension: int, whiten: bool = False, normalize: bool = True,
+            epsilon: float = 1e-6) -> "Projection":
+        """
+        Fit the projection on a sample of embeddings.
+
+        Parameters:
+        - vectors (np.ndarray): Sample of shape (N, input_dim).
+        - dimension (int): Number of principal components to keep.
+        - whiten (bool): Scale every component to unit variance.
+        - normalize (bool): L2-normalise the projected vectors.
+        - epsilon (float): Added to the variances before whitening.
+
+        Returns:
+        - Projection: The fitted projection.
+
+        """
+        vectors = np.asarray(vectors, dtype=np.float64)
+        mean = vectors.mean(axis=0)
+        centered = vectors - mean
+        variances, axes = np.linalg.eigh(centered.T @ centered / max(1, len(vectors) - 1))
+        order = np.argsort(variances)[::-1][:dimension]
+        variances, components = np.maximum(variances[order], 0), axes[:, order].T
+        scale = 1 / np.sqrt(variances + epsilon) if whiten else None
+        total = np.maximum(centered.var(axis=0, ddof=1).sum(), epsilon)
+        return cls(mean, components, scale, normalize, float(variances.sum() / total))
+
+    def transform(self, vectors) -> np.ndarray:
+        """
+        Project embeddings.
+
+        Parameters:
+        - vectors: One embedding of shape (input_dim,) or a batch of shape (N, input_dim).
+
+        Returns:
+        - np.ndarray: Projected float32 vectors with the same leading shape.
+
+        """
+        projected = (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+        if self.scale is not None:
+            projected *= self.scale
+        if self.normalize:
+            projected /= np.maximum(np.linalg.norm(projected, axis=-1, keepdims=True), 1e-12)
+        return projected
+
+    def transform_stored(self, vectors: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        """
+        Project a whole catalogue chunk by chunk to the float16 vectors the project stage stores.
+        """
+        return np.concatenate([self.transform(part).astype(np.float16)
+                               for part in np.array_split(vectors, max(1, len(vectors) // chunk))])
+
+    def save(self, path: str):
+        """
+        Write the projection to an .npz file.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, mean=self.mean, components=self.components,
+                 scale=self.scale if self.scale is not None else np.empty(0, dtype=np.float32),
+                 normalize=self.normalize, explained_variance=self.explained_variance)
+
+    @classmethod
+    def load(cls, path: str) -> "Projection":
+        """
+        Read a projection written by `save`.
+        """
+        with np.load(path) as data:
+            scale = data["scale"] if len(data["scale"]) else None
+            return cls(data["mean"], data["components"], scale, bool(data["normalize"]),
+                       float(data["explained_variance"]))
+
+
+def embeddings_digest(links, vectors: np.ndarray) -> str:
+    """
+    Identify an export of the stored embeddings by its links and vectors, so projected vectors can record which
+    embeddings they were made from.
+
+    Parameters:
+    - links (List[str]): S3 link of every embedding, in export order.
+    - vectors (np.ndarray): Exported embeddings.
+
+    Returns:
+    - str: Hex digest.
+
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for link in links:
+        digest.update(link.encode())
+        digest.update(b"\0")
+    digest.update(np.ascontiguousarray(vectors).tobytes())
+    return digest.hexdigest()
+
+
+def load_projection(path: str) -> Optional[Projection]:
+    """
+    Load the projection saved by the project stage.
+
+    Parameters:
+    - path (str): Location of the projection.
+
+    Returns:
+    - Projection: The projection, or None when embeddings are indexed unprojected.
+
+    """
+    return Projection.load(path) if os.path.exists(path) else None
+
+
+class Projector:
+    def __init__(self):
+        """
+        Reduce the stored embeddings with PCA before indexing and save the projection for the query path.
+
+        """
+        self.config = ProjectionConfig()
+        self.mongo = MongoDBClient()
+
+    def clear(self):
+        """
+        Remove the projection artifacts so the index is built from, and queried with, the raw embeddings.
+        """
+        for path in (self.config.PROJECTION_PATH, self.config.PROJECTED_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evaluate(self, vectors: np.ndarray, projected: np.ndarray) -> float:
+        """
+        Recall@RECALL_K of exact search over the stored projected vectors against exact search over the raw
+        embeddings, for a sample of catalogue items used as queries.
+
+        Returns:
+        - float: Mean fraction of the raw neighbours kept after projection.
+
+        """
+        from src.components.nearest_neighbours import exact_neighbours
+        k = self.config.RECALL_K
+        if len(vectors) <= k + 1:
+            return 1.0
+        rng = np.random.default_rng(self.config.SEED)
+        queries = rng.choice(len(vectors), min(self.config.RECALL_QUERIES, len(vectors)), replace=False)
+        before = exact_neighbours(vectors, vectors[queries], k + 1, "euclidean")
+        after = exact_neighbours(projected, projected[queries], k + 1, "euclidean")
+        found = sum(len(set(truth[truth != query][:k]) & set(result[result != query][:k]))
+                    for query, truth, result in zip(queries, before, after))
+        return found / (len(queries) * k)
+
+    def run_step(self):
+        """
+        Fit the projection on a sample, project every stored embedding to float16 and report the recall kept.
+
+        Returns:
+        - dict: Response with the dimensions, storage sizes, explained variance and recall.
+
+        """
+        if not self.config.ENABLED:
+            self.clear()
+            return {"Response": "Projection disabled"}
+
+        export = self.mongo.export_embeddings()
+        vectors = export["Vectors"]
+        rng = np.random.default_rng(self.config.SEED)
+        sample = vectors[rng.choice(len(vectors), min(self.config.SAMPLE, len(vectors)), replace=False)]
+        with metrics.timer("projection_fit"):
+            projection = Projection.fit(sample, self.config.DIMENSION, self.config.WHITEN, self.config.NORMALIZE)
+        with metrics.timer("projection_transform"):
+            projected = projection.transform_stored(vectors)
+
+        with metrics.timer("projection_evaluation"):
+            recall = self.evaluate(vectors, projected.astype(np.float32))
+        projection.save(self.config.PROJECTION_PATH)
+        np.savez(self.config.PROJECTED_PATH, vectors=projected, links=np.array(export["Links"]),
+                 labels=export["Labels"], ingested_at=export["IngestedAt"], projection=projection.digest(),
+                 source=embeddings_digest(export["Links"], vectors))
+
+        metrics.gauge("projection_recall", recall)
+        metrics.gauge("projection_explained_variance", projection.explained_variance)
+        print(f"Projected {len(vectors)} embeddings {vectors.shape[1]} -> {projection.dimension} dims "
+              f"({projection.explained_variance:.1%} variance), recall@{self.config.RECALL_K} {recall:.3f}")
+        return {"Response": "Completed Projection", "Input Dimension": int(vectors.shape[1]),
+                "Output Dimension": projection.dimension, "Raw Bytes": int(vectors.shape[0] * vectors.shape[1] * 4),
+                "Projected Bytes": int(projected.nbytes), "Explained Variance": projection.explained_variance,
+                "Recall": recall}
+
+
+if __name__ == "__main__":
+    projector = Projector()
+    print(projector.run_step())
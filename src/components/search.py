@@ -0,0 +1,297 @@
+from src.components.data_preprocessing import DataPreprocessing
+from src.components.nearest_neighbours import FilteredAnnoy, read_index_record
+from src.components.sharded_index import ShardCoordinator
+from src.components.projection import load_projection
+from src.entity.config_entity import SearchConfig
+from src.exception.exception import InvalidImageError
+from src.utils.cache import QueryCache
+from src.utils.metrics import metrics
+from src.components.model import load_serving_student
+from src.components.export import exported_or_checkpoint
+from concurrent.futures import Future
+from typing import List, Optional
+from PIL import Image
+import threading
+import queue
+import torch
+import time
+import io
+import os
+
+
+class SearchEngine:
+    def __init__(self):
+        """
+        Load the embedding model and the Annoy index once for serving queries.
+
+        """
+        self.config = SearchConfig()
+        self.device = self.config.DEVICE
+        self.transform = DataPreprocessing().transformations()
+        self.embedding_model = self.load_model()
+        self.embedding_model.eval()
+        self.cache = QueryCache(self.config.CACHE_EMBEDDINGS, self.config.CACHE_RESULTS,
+                                self.config.CACHE_MAX_BYTES, self.config.CACHE_TTL)
+        self.index, self.projection = self.load_index()
+        self.cache.set_index_version(self.index_version())
+        self.in_flight = {}
+        self.idle = threading.Condition()
+        self.reload_lock = threading.Lock()
+
+    def load_model(self):
+        """
+        Load the distilled student when it is selected, otherwise the exported CPU graph if it matches the trained
+        model, otherwise the trained model without its final classification layer.
+
+        Returns:
+        - nn.Module: Embedding network.
+
+        """
+        student = load_serving_student(self.device)
+        if student is not None:
+            return student
+        return exported_or_checkpoint(self.config.EXPORTED_MODEL_PATH, self.config.MODEL_STORE_PATH, self.device,
+                                      self.config.INTRA_OP_THREADS, self.config.INTER_OP_THREADS)
+
+    def load_index(self):
+        """
+        Memory-map the Annoy index together with its S3 links, or connect to every shard when a shard
+        manifest exists, and load the projection the index was built with.
+
+        Returns:
+        - Tuple[FilteredAnnoy or ShardCoordinator, Optional[Projection]]: Loaded index with its metadata and label
+          sub-indexes, and the projection to apply to query embeddings (None when the index is unprojected).
+
+        """
+        if os.path.exists(self.config.SHARD_MANIFEST_PATH):
+            index = ShardCoordinator(self.config.SHARD_MANIFEST_PATH, self.config.SHARD_WORKERS,
+                                     self.config.PROBE_SHARDS, self.config.FILTER_OVERFETCH,
+                                     self.config.BRUTE_FORCE_LIMIT)
+            return index, self.load_projection(index.manifest.get("projection") or "")
+        dimension, projection = read_index_record(self.config.EMBEDDING_STORE_PATH)
+        index = FilteredAnnoy(dimension or self.config.DIMENSION, self.config.METRIC,
+                              self.config.FILTER_OVERFETCH, self.config.BRUTE_FORCE_LIMIT)
+        index.load(self.config.EMBEDDING_STORE_PATH)
+        return index, self.load_projection(projection)
+
+    def load_projection(self, digest: str):
+        """
+        Load the projection recorded in the index metadata, ignoring any projection file an unprojected index
+        does not refer to.
+
+        Parameters:
+        - digest (str): Projection digest recorded by the index build, "" for an unprojected index.
+
+        Returns:
+        - Projection: The projection, or None for an unprojected index.
+
+        """
+        if not digest:
+            return None
+        projection = load_projection(self.config.PROJECTION_PATH)
+        if projection is None or projection.digest() != digest:
+            raise ValueError(f"The index was built with a projection that {self.config.PROJECTION_PATH} "
+                             f"does not hold; pull or rebuild the artifacts together")
+        return projection
+
+    def index_version(self) -> str:
+        """
+        Identify the index file, or the shard manifest of a sharded index, by its modification time and size.
+
+        Returns:
+        - str: Version string.
+
+        """
+        path = self.config.SHARD_MANIFEST_PATH
+        stat = os.stat(path if os.path.exists(path) else self.config.EMBEDDING_STORE_PATH)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def reload_index(self):
+        """
+        Load the index again if the file changed, invalidating cached neighbour lists. A replaced shard
+        coordinator is closed once the searches still running against it have finished. Concurrent reloads
+        run one at a time, so a changed index is loaded only once.
+
+        Returns:
+        - dict: Response with the loaded index version.
+
+        """
+        with self.reload_lock:
+            version = self.index_version()
+            if version != self.cache.index_version:
+                index, projection = self.load_index()
+                with self.idle:
+                    previous, self.index, self.projection = self.index, index, projection
+                self.cache.set_index_version(version)
+                if isinstance(previous, ShardCoordinator):
+                    # Searches that picked up the old coordinator still use its shards and executor.
+                    with self.idle:
+                        self.idle.wait_for(lambda: id(previous) not in self.in_flight)
+                    previous.close()
+        return {"Response": "Success", "Info": version}
+
+    def preprocess(self, data: bytes) -> torch.Tensor:
+        """
+        Decode and transform an uploaded image.
+
+        Parameters:
+        - data (bytes): Encoded image.
+
+        Returns:
+        - torch.Tensor: Normalised image tensor of shape (3, H, W).
+
+        Raises:
+        - InvalidImageError: If the bytes are not a readable image.
+
+        """
+        try:
+            image = Image.open(io.BytesIO(data))
+            if image.mode != "RGB":
+                image = image.convert('RGB')
+            return self.transform(image)
+        except (OSError, SyntaxError) as e:
+            raise InvalidImageError(f"Cannot decode the uploaded image: {e}") from e
+
+    def embed(self, images: torch.Tensor):
+        """
+        Run a single forward pass over a batch of images.
+
+        Parameters:
+        - images (torch.Tensor): Batch of shape (N, 3, H, W).
+
+        Returns:
+        - np.ndarray: Embeddings of shape (N, DIMENSION).
+
+        """
+        with torch.inference_mode():
+            return self.embedding_model(images.to(self.device)).cpu().numpy()
+
+    def search(self, vector, k: int, label: Optional[int] = None,
+               since: Optional[int] = None, until: Optional[int] = None) -> List[str]:
+        """
+        Find the S3 links of the k nearest catalogue images, optionally restricted by label and ingestion time.
+
+        Parameters:
+        - vector: Query embedding, projected here when the index holds projected vectors.
+        - k (int): Number of neighbours.
+        - label (int, optional): Only return images with this label id.
+        - since (int, optional): Only return images ingested at or after this epoch second.
+        - until (int, optional): Only return images ingested at or before this epoch second.
+
+        Returns:
+        - List[str]: S3 links ordered by distance.
+
+        """
+        with self.idle:
+            index, projection = self.index, self.projection
+            self.in_flight[id(index)] = self.in_flight.get(id(index), 0) + 1
+        try:
+            if projection is not None:
+                vector = projection.transform(vector)
+            return index.search(vector, k, self.config.SEARCH_K, label, since, until)
+        finally:
+            with self.idle:
+                self.in_flight[id(index)] -= 1
+                if not self.in_flight[id(index)]:
+                    del self.in_flight[id(index)]
+                    self.idle.notify_all()
+
+
+class MicroBatcher:
+    def __init__(self, engine: SearchEngine):
+        """
+        Collect concurrent queries into one forward pass, waiting at most MAX_WAIT_MS for a batch to fill.
+
+        Parameters:
+        - engine (SearchEngine): Engine performing embedding and lookup.
+
+        """
+        self.engine = engine
+        self.max_batch_size = engine.config.MAX_BATCH_SIZE
+        self.max_wait = engine.config.MAX_WAIT_MS / 1000
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        self.thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, image: torch.Tensor) -> Future:
+        """
+        Queue a preprocessed image for embedding.
+
+        Parameters:
+        - image (torch.Tensor): Preprocessed image tensor.
+
+        Returns:
+        - Future: Resolves to the image embedding.
+
+        """
+        future = Future()
+        self.queue.put((image, future))
+        return future
+
+    def query(self, data: bytes, k: int, label: Optional[int] = None,
+              since: Optional[int] = None, until: Optional[int] = None) -> List[str]:
+        """
+        Return the neighbours of an uploaded image, consulting the result and embedding caches first.
+
+        Parameters:
+        - data (bytes): Encoded image.
+        - k (int): Number of neighbours.
+        - label (int, optional): Only return images with this label id.
+        - since (int, optional): Only return images ingested at or after this epoch second.
+        - until (int, optional): Only return images ingested at or before this epoch second.
+
+        Returns:
+        - List[str]: S3 links ordered by distance.
+
+        """
+        cache = self.engine.cache
+        key = cache.image_key(data)
+        filters = (label, since, until)
+        result_key = key if filters == (None, None, None) else f"{key}:{label}:{since}:{until}"
+        version = cache.index_version
+        links = cache.get_results(result_key, k)
+        if links is not None:
+            return links
+
+        vector = cache.get_embedding(key)
+        if vector is None:
+            vector = self.submit(self.engine.preprocess(data)).result()
+            cache.put_embedding(key, vector)
+        with metrics.timer("search_lookup"):
+            links = self.engine.search(vector, k, *filters)
+        cache.put_results(result_key, k, links, version)
+        return links
+
+    def _collect(self):
+        """
+        Block for the first request, then gather more until the batch is full or the deadline passes.
+        """
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.requests += len(batch)
+            metrics.observe("search_batch_size", len(batch))
+            try:
+                with metrics.timer("search_embed_batch"):
+                    vectors = self.engine.embed(torch.stack([image for image, _ in batch]))
+                for vector, (_, future) in zip(vectors, batch):
+                    future.set_result(vector.copy())
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
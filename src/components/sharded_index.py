@@ -0,0 +1,308 @@
+from src.components.nearest_neighbours import FilteredAnnoy, peak_rss_bytes, replace_path, reset_peak_rss
+from src.entity.config_entity import AnnoyConfig
+from src.utils.metrics import metrics
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+import multiprocessing
+import numpy as np
+import threading
+import hashlib
+import shutil
+import heapq
+import json
+import time
+import os
+
+
+def partition_by_hash(links: List[str], shards: int) -> np.ndarray:
+    """
+    Assign every item to a shard by a stable hash of its S3 link, so assignments survive rebuilds.
+
+    Args:
+        links (List[str]): S3 link of every item.
+        shards (int): Number of shards.
+
+    Returns:
+        np.ndarray: Shard of every item.
+    """
+    return np.array([int.from_bytes(hashlib.blake2b(link.encode(), digest_size=8).digest(), "little") % shards
+                     for link in links], dtype=np.int64)
+
+
+def partition_by_cluster(vectors: np.ndarray, shards: int, sample: int, iterations: int, seed: int = 0):
+    """
+    Assign every item to the nearest of `shards` k-means centroids fitted on a sample, so queries can probe only
+    the shards closest to them. Shards may be unbalanced when the catalogue is.
+
+    Args:
+        vectors (np.ndarray): Item vectors.
+        shards (int): Number of shards.
+        sample (int): Number of items used to fit the centroids.
+        iterations (int): Lloyd iterations.
+        seed (int): Sampling seed.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Shard of every item and the centroids.
+    """
+    rng = np.random.default_rng(seed)
+    fit = vectors[rng.choice(len(vectors), min(sample, len(vectors)), replace=False)]
+    # A catalogue smaller than the shard count leaves the remaining shards empty.
+    centroids = fit[rng.choice(len(fit), min(shards, len(fit)), replace=False)].copy()
+    for _ in range(iterations):
+        nearest = nearest_centroids(fit, centroids, 1)[:, 0]
+        for shard in range(len(centroids)):
+            members = fit[nearest == shard]
+            if len(members):
+                centroids[shard] = members.mean(axis=0)
+    assignments = np.concatenate([nearest_centroids(chunk, centroids, 1)[:, 0]
+                                  for chunk in np.array_split(vectors, max(1, len(vectors) // 65536))])
+    return assignments, centroids
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, count: int) -> np.ndarray:
+    """
+    Return the indices of the `count` nearest centroids of every vector.
+    """
+    distances = (vectors ** 2).sum(axis=1)[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1)
+    return np.argsort(distances, axis=1)[:, :count]
+
+
+def build_index_shard(input_path: str, index_path: str, metric: str, n_trees: int, label_indexes: bool,
+                      n_jobs: int = 1, on_disk: bool = True):
+    """
+    Build and save one shard index from its partition of the catalogue.
+
+    Args:
+        input_path (str): .npz with the shard's vectors, links, labels and ingestion times.
+        index_path (str): Destination of the shard index.
+        metric (str): Distance metric.
+        n_trees (int): Number of trees.
+        label_indexes (bool): Build per-label sub-indexes.
+        n_jobs (int): Threads used to build the trees.
+        on_disk (bool): Build the index straight into its file instead of in RAM.
+
+    Returns:
+        dict: Shard path, number of items, build time and peak resident memory of the build.
+    """
+    # Pool workers build several shards in turn; measure each build on its own.
+    reset_peak_rss()
+    start = time.perf_counter()
+    with np.load(input_path) as data:
+        vectors, links = data["vectors"], data["links"].tolist()
+        labels, ingested_at = data["labels"], data["ingested_at"]
+    index = FilteredAnnoy(vectors.shape[1], metric)
+    index.build(vectors, links, labels, ingested_at, n_trees, label_indexes, n_jobs,
+                index_path if on_disk else None)
+    index.save(index_path)
+    return {"Shard": index_path, "Items": len(links), "Seconds": time.perf_counter() - start,
+            "PeakRSS": peak_rss_bytes()}
+
+
+class ShardedIndexBuilder:
+    def __init__(self):
+        """
+        Partition the catalogue into shards and build the shard indexes in parallel processes.
+
+        """
+        self.config = AnnoyConfig()
+
+    def partition(self, vectors: np.ndarray, links: List[str]):
+        """
+        Split the catalogue by link hash or by coarse cluster, depending on PARTITION; an empty catalogue has no
+        centroids to fit and is hash-partitioned.
+
+        Returns:
+        - Tuple[np.ndarray, Optional[np.ndarray]]: Shard of every item and the centroids of cluster partitioning.
+
+        """
+        if self.config.PARTITION == "cluster" and len(vectors):
+            return partition_by_cluster(vectors, self.config.SHARDS, self.config.KMEANS_SAMPLE,
+                                        self.config.KMEANS_ITERATIONS)
+        return partition_by_hash(links, self.config.SHARDS), None
+
+    def run_step(self, vectors: np.ndarray, links: List[str], labels: np.ndarray, ingested_at: np.ndarray,
+                 n_trees: int, projection: str = ""):
+        """
+        Build every shard and write the shard manifest.
+
+        Parameters:
+        - vectors (np.ndarray): Item vectors.
+        - links (List[str]): S3 link of every item.
+        - labels (np.ndarray): Label id of every item.
+        - ingested_at (np.ndarray): Ingestion time of every item.
+        - n_trees (int): Number of trees per shard.
+        - projection (str): Digest of the PCA projection applied to the vectors, "" when they are unprojected.
+
+        Returns:
+        - dict: The manifest.
+
+        """
+        # Shards are built into a separate directory and swapped in once every shard and the manifest exist.
+        shard_dir = f"{self.config.SHARD_DIR}.building"
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        os.makedirs(os.path.join(shard_dir, "inputs"))
+
+        with metrics.timer("index_partition"):
+            assignments, centroids = self.partition(vectors, links)
+        links = np.array(links)
+        jobs = []
+        for shard in range(self.config.SHARDS):
+            rows = np.flatnonzero(assignments == shard)
+            input_path = os.path.join(shard_dir, "inputs", f"shard-{shard:05d}.npz")
+            np.savez(input_path, vectors=vectors[rows], links=links[rows], labels=labels[rows],
+                     ingested_at=ingested_at[rows])
+            jobs.append((input_path, os.path.join(shard_dir, f"shard-{shard:05d}.ann")))
+
+        # Split the cores between the concurrent shard builds instead of oversubscribing them.
+        n_jobs = max(1, (os.cpu_count() or 1) // self.config.BUILD_WORKERS)
+        context = multiprocessing.get_context("spawn")
+        with metrics.timer("index_shard_build"), \
+                ProcessPoolExecutor(max_workers=self.config.BUILD_WORKERS, mp_context=context) as executor:
+            futures = [executor.submit(build_index_shard, input_path, index_path, "euclidean", n_trees,
+                                       self.config.LABEL_INDEXES, n_jobs, self.config.ON_DISK_BUILD)
+                       for input_path, index_path in jobs]
+            results = [future.result() for future in futures]
+        shutil.rmtree(os.path.join(shard_dir, "inputs"))
+
+        manifest = {"dimension": int(vectors.shape[1]), "metric": "euclidean", "partition": self.config.PARTITION,
+                    "n_trees": n_trees, "projection": projection,
+                    "centroids": centroids.tolist() if centroids is not None else None,
+                    "shards": [{"id": shard, "path": os.path.basename(result["Shard"]), "items": result["Items"],
+                                "seconds": result["Seconds"], "peak_rss_bytes": result["PeakRSS"]}
+                               for shard, result in enumerate(results)]}
+        with open(os.path.join(shard_dir, "manifest.json"), "w") as file:
+            json.dump(manifest, file, indent=2)
+        replace_path(shard_dir, self.config.SHARD_DIR)
+        print(f"Built {len(results)} index shards : {[result['Items'] for result in results]} items")
+        return manifest
+
+
+class LocalShard:
+    """
+    Shard served from the coordinator's own process.
+    """
+    def __init__(self, path: str, dimension: int, metric: str, overfetch: float, brute_force_limit: int):
+        self.index = FilteredAnnoy(dimension, metric, overfetch, brute_force_limit)
+        self.index.load(path)
+
+    def search(self, vector, k: int, search_k: int, label, since, until):
+        return self.index.search(vector, k, search_k, label, since, until, include_distances=True)
+
+    def close(self):
+        self.index.index.unload()
+
+
+def serve_shard(path: str, dimension: int, metric: str, overfetch: float, brute_force_limit: int, connection):
+    """
+    Worker loop of a ProcessShard: answer search requests from the pipe until it receives None.
+    """
+    shard = LocalShard(path, dimension, metric, overfetch, brute_force_limit)
+    connection.send("ready")
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        try:
+            connection.send(shard.search(*request))
+        except Exception as e:
+            connection.send(e)
+    connection.close()
+
+
+class ProcessShard:
+    """
+    Shard served by a separate worker process over a pipe, standing in for a remote shard server.
+    """
+    def __init__(self, path: str, dimension: int, metric: str, overfetch: float, brute_force_limit: int):
+        context = multiprocessing.get_context("spawn")
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve_shard, daemon=True,
+                                       args=(path, dimension, metric, overfetch, brute_force_limit, child))
+        self.process.start()
+        self.lock = threading.Lock()
+        self.connection.recv()
+
+    def search(self, vector, k: int, search_k: int, label, since, until):
+        with self.lock:
+            self.connection.send((np.asarray(vector, dtype=np.float32), k, search_k, label, since, until))
+            result = self.connection.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        with self.lock:
+            self.connection.send(None)
+        self.process.join(timeout=5)
+
+
+class ShardCoordinator:
+    def __init__(self, manifest_path: str, mode: str = "local", probe_shards: int = 0,
+                 overfetch: float = 1.5, brute_force_limit: int = 2048):
+        """
+        Fan queries out to every shard of a sharded index and merge their top-k by distance.
+
+        Parameters:
+        - manifest_path (str): Shard manifest written by ShardedIndexBuilder.
+        - mode (str): "local" to load shards in this process, "process" to serve each from a worker process.
+        - probe_shards (int): With cluster partitioning, only query this many shards nearest to the query; 0 queries all.
+        - overfetch (float): Over-fetch factor of filtered shard searches.
+        - brute_force_limit (int): Exact-scan threshold of filtered shard searches.
+
+        """
+        with open(manifest_path) as file:
+            self.manifest = json.load(file)
+        self.metric = self.manifest["metric"]
+        self.centroids = np.array(self.manifest["centroids"], dtype=np.float32) \
+            if self.manifest["centroids"] is not None else None
+        self.probe_shards = probe_shards
+        shard_type = ProcessShard if mode == "process" else LocalShard
+        root = os.path.dirname(manifest_path)
+        self.shards = [shard_type(os.path.join(root, shard["path"]), self.manifest["dimension"], self.metric,
+                                  overfetch, brute_force_limit)
+                       for shard in self.manifest["shards"]]
+        self.executor = ThreadPoolExecutor(max_workers=len(self.shards))
+
+    def route(self, vector) -> List[int]:
+        """
+        Select the shards a query is sent to.
+        """
+        if self.centroids is None or not self.probe_shards or self.probe_shards >= len(self.shards):
+            return list(range(len(self.shards)))
+        query = np.asarray(vector, dtype=np.float32)[None, :]
+        return nearest_centroids(query, self.centroids, self.probe_shards)[0].tolist()
+
+    def search(self, vector, k: int, search_k: int = -1, label: Optional[int] = None,
+               since: Optional[int] = None, until: Optional[int] = None, include_distances: bool = False):
+        """
+        Query the routed shards concurrently and merge their results.
+
+        Parameters:
+        - vector: Query vector.
+        - k (int): Number of neighbours.
+        - search_k (int): Annoy search_k used on every shard.
+        - label (int, optional): Only return items with this label id.
+        - since (int, optional): Only return items ingested at or after this epoch second.
+        - until (int, optional): Only return items ingested at or before this epoch second.
+        - include_distances (bool): Whether to include distances in the result.
+
+        Returns:
+        - List[str]: S3 links ordered by distance, paired with their distances if requested.
+
+        """
+        futures = [self.executor.submit(self.shards[shard].search, vector, k, search_k, label, since, until)
+                   for shard in self.route(vector)]
+        sign = -1 if self.metric == "dot" else 1
+        merged = heapq.nsmallest(k, ((sign * distance, link)
+                                     for future in futures
+                                     for link, distance in zip(*future.result())))
+        links, distances = [link for _, link in merged], [sign * distance for distance, _ in merged]
+        return (links, distances) if include_distances else links
+
+    def close(self):
+        """
+        Stop the shard workers.
+        """
+        for shard in self.shards:
+            shard.close()
+        self.executor.shutdown()
@@ -1,11 +1,17 @@
 from src.components.data_preprocessing import DataPreprocessing
-from src.entity.config_entity import TrainerConfig
+from src.entity.config_entity import TrainerConfig, MetricsConfig, DistillationConfig
+from src.utils.metrics import metrics, profile_trace
+from src.pipeline.dag import hash_path
 from torch import nn
 import torch
 import numpy as np
-from src.components.model import NeuralNet
+from src.components.model import NeuralNet, StudentNet
+from itertools import islice
 from typing import Dict
 from tqdm import tqdm
+import copy
+import time
+import os
 
 
 class Trainer:
@@ -28,6 +34,7 @@ class Trainer:
         self.model = net.to(self.device)
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=1e-4)
         self.evaluation = self.config.Evaluation
+        self.metrics_config = MetricsConfig()
 
     def train_model(self):
         """
@@ -35,32 +42,59 @@ class Trainer:
 
         """
         print("Start training...\n")
-        for epoch in range(self.config.EPOCHS):
-            print(f'Epoch Number : {epoch}')
-            running_loss = 0.0
-            running_correct = 0
-            for i, data in enumerate(tqdm(self.trainLoader)):
-                data, target = data[0].to(self.device), data[1].to(self.device)
-                self.optimizer.zero_grad()
-                outputs = self.model(data)
-                loss = self.criterion(outputs, target)
-                running_loss += loss.item()
-                _, preds = torch.max(outputs.data, 1)
-                running_correct += (preds == target).sum().item()
-
-                loss.backward()
-                self.optimizer.step()
-
-            loss = running_loss / len(self.trainLoader.dataset)
-            accuracy = 100. * running_correct / len(self.trainLoader.dataset)
-
-            val_loss, val_accuracy = self.evaluate()
-
-            print(f"Train Acc : {accuracy:.2f}, Train Loss : {loss:.4f}, "
-                  f"Validation Acc : {val_accuracy:.2f}, Validation Loss : {val_loss:.4f}")
+        trace_path = os.path.join(self.metrics_config.REPORT_DIR, "train_trace.json")
+        with profile_trace(trace_path, self.metrics_config.PROFILE_TRAINING,
+                           self.metrics_config.PROFILE_STEPS) as profiler:
+            for epoch in range(self.config.EPOCHS):
+                self.train_epoch(epoch, profiler)
 
         print("Training complete!...\n")
 
+    def train_epoch(self, epoch: int, profiler=None):
+        """
+        Train for one epoch, recording data-wait and compute time per step.
+
+        Parameters:
+        - epoch (int): Epoch number.
+        - profiler: Optional torch profiler stepped once per batch.
+
+        """
+        print(f'Epoch Number : {epoch}')
+        self.model.train()
+        running_loss = 0.0
+        running_correct = 0
+        wait_start = time.perf_counter()
+        for i, data in enumerate(tqdm(self.trainLoader)):
+            metrics.observe("train_data_wait_seconds", time.perf_counter() - wait_start)
+            compute_start = time.perf_counter()
+
+            data, target = data[0].to(self.device), data[1].to(self.device)
+            self.optimizer.zero_grad()
+            outputs = self.model(data)
+            loss = self.criterion(outputs, target)
+            running_loss += loss.item()
+            _, preds = torch.max(outputs.data, 1)
+            running_correct += (preds == target).sum().item()
+
+            loss.backward()
+            self.optimizer.step()
+
+            if self.device.startswith("cuda"):
+                torch.cuda.synchronize()
+            metrics.observe("train_compute_seconds", time.perf_counter() - compute_start)
+            metrics.increment("train_images", data.size(0))
+            if profiler is not None:
+                profiler.step()
+            wait_start = time.perf_counter()
+
+        loss = running_loss / len(self.trainLoader.dataset)
+        accuracy = 100. * running_correct / len(self.trainLoader.dataset)
+
+        val_loss, val_accuracy = self.evaluate()
+
+        print(f"Train Acc : {accuracy:.2f}, Train Loss : {loss:.4f}, "
+              f"Validation Acc : {val_accuracy:.2f}, Validation Loss : {val_loss:.4f}")
+
     def evaluate(self, validate=False):
         """
         Evaluate the neural network model.
@@ -78,7 +112,7 @@ class Trainer:
 
         loader = self.testLoader if not validate else self.validLoader
 
-        with torch.no_grad():
+        with torch.no_grad(), metrics.timer("evaluation"):
             for batch in tqdm(loader):
                 img = batch[0].to(self.device)
                 labels = batch[1].to(self.device)
@@ -95,6 +129,119 @@ class Trainer:
 
         return val_loss, val_accuracy
 
+    def distill_model(self, student: nn.Module = None):
+        """
+        Train a smaller student to reproduce the trained model's embeddings, then compare the two on CPU
+        throughput and neighbour overlap and save the student.
+
+        Parameters:
+        - student (nn.Module, optional): Student network; a StudentNet is built when omitted.
+
+        Returns:
+        - dict: Response with the throughput and neighbour-overlap report.
+
+        """
+        config = DistillationConfig()
+        teacher = self.model.embedding_network().eval()
+        student = (student if student is not None else StudentNet()).to(self.device)
+        optimizer = torch.optim.Adam(student.parameters(), lr=config.LEARNING_RATE)
+        criterion = nn.MSELoss()
+
+        print("Start distillation...\n")
+        with metrics.timer("distillation"):
+            for epoch in range(config.EPOCHS):
+                student.train()
+                running_loss = 0.0
+                for images, _ in tqdm(self.trainLoader):
+                    images = images.to(self.device)
+                    with torch.no_grad():
+                        targets = teacher(images)
+                    optimizer.zero_grad()
+                    loss = criterion(student(images), targets)
+                    loss.backward()
+                    optimizer.step()
+                    running_loss += loss.item() * images.size(0)
+                    metrics.increment("distill_images", images.size(0))
+                print(f"Distillation Epoch : {epoch}, Embedding MSE : "
+                      f"{running_loss / len(self.trainLoader.dataset):.4f}")
+        student.eval()
+
+        teacher_rate = self.embedding_throughput(teacher, config.THROUGHPUT_BATCHES)
+        student_rate = self.embedding_throughput(student, config.THROUGHPUT_BATCHES)
+        query_overlap, catalogue_overlap = self.neighbour_overlap(teacher, student, config.OVERLAP_K)
+        report = {"Teacher Images Per Second": teacher_rate, "Student Images Per Second": student_rate,
+                  "Speedup": student_rate / teacher_rate if teacher_rate else 0.0,
+                  f"Query Overlap@{config.OVERLAP_K}": query_overlap,
+                  f"Catalogue Overlap@{config.OVERLAP_K}": catalogue_overlap}
+        for name, value in [("teacher_images_per_second", teacher_rate), ("student_images_per_second", student_rate),
+                            ("query_overlap", query_overlap), ("catalogue_overlap", catalogue_overlap)]:
+            metrics.gauge(f"distill_{name}", value)
+
+        print(f"Saving Student at {config.STUDENT_STORE_PATH}")
+        # Record the teacher checkpoint, so a student left over from an earlier teacher is never served.
+        torch.save({"state_dict": student.state_dict(), "teacher": hash_path(config.MODEL_STORE_PATH)},
+                   config.STUDENT_STORE_PATH)
+        return {"Response": "Completed Distillation", "Info": report}
+
+    def embedding_throughput(self, network: nn.Module, batches: int) -> float:
+        """
+        Measure CPU embedding throughput over the first batches of the validation loader.
+
+        Parameters:
+        - network (nn.Module): Embedding network; a CPU copy is timed.
+        - batches (int): Number of batches timed, after a warm-up pass over the first one.
+
+        Returns:
+        - float: Images per second, excluding data loading.
+
+        """
+        network = copy.deepcopy(network).cpu().eval()
+        loaded = [images for images, _ in islice(self.validLoader, batches)]
+        with torch.inference_mode():
+            network(loaded[0])
+            start = time.perf_counter()
+            count = sum(network(images).shape[0] for images in loaded)
+            seconds = time.perf_counter() - start
+        return count / seconds if seconds else 0.0
+
+    def neighbour_overlap(self, teacher: nn.Module, student: nn.Module, k: int):
+        """
+        Compare nearest neighbours over the validation set embedded by both networks.
+
+        Parameters:
+        - teacher (nn.Module): Teacher embedding network.
+        - student (nn.Module): Student embedding network.
+        - k (int): Number of neighbours.
+
+        Returns:
+        - Tuple[float, float]: Overlap@k of student queries against the teacher-embedded catalogue (serving
+          queries with the student), and of the student-embedded catalogue against the teacher one
+          (re-embedding the catalogue with the student).
+
+        """
+        teacher_vectors, student_vectors = [], []
+        with torch.inference_mode():
+            for images, _ in self.validLoader:
+                images = images.to(self.device)
+                teacher_vectors.append(teacher(images).cpu())
+                student_vectors.append(student(images).cpu())
+        teacher_vectors, student_vectors = torch.cat(teacher_vectors), torch.cat(student_vectors)
+        k = min(k, len(teacher_vectors) - 1)
+        if k < 1:
+            return 1.0, 1.0
+
+        def neighbours(queries, catalogue):
+            distances = torch.cdist(queries, catalogue)
+            distances.fill_diagonal_(float("inf"))
+            return distances.topk(k, largest=False).indices.tolist()
+
+        def overlap(found, truth):
+            return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)]))
+
+        truth = neighbours(teacher_vectors, teacher_vectors)
+        return (overlap(neighbours(student_vectors, teacher_vectors), truth),
+                overlap(neighbours(student_vectors, student_vectors), truth))
+
     def save_model_in_pth(self):
         """
         Save the trained model in a .pth file.
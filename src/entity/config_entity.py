@@ -1,19 +1,49 @@
 from from_root import from_root
 import os
 
+
+def project_root() -> str:
+    """
+    Directory that data and model paths resolve against. SEARCH_ENGINE_ROOT overrides the repository root,
+    e.g. to run the benchmark suite in a scratch workspace.
+    """
+    return os.environ.get("SEARCH_ENGINE_ROOT") or str(from_root())
+
+
 class DatabaseConfig:
     """
     Configuration class for database settings.
     """
     def __init__(self):
         """
-        Initialize DatabaseConfig with environment variables and default values.
+        Initialize DatabaseConfig with default values. Credentials are read from the environment on first
+        access, so stages that never connect to MongoDB do not need them.
         """
-        self.USERNAME: str = os.environ["DATABASE_USERNAME"]
-        self.PASSWORD: str = os.environ["DATABASE_PASSWORD"]
         self.URL: str = "mongodb+srv://<username>:<password>@projects.ch4mixt.mongodb.net/?retryWrites=true&w=majority"
         self.DBNAME: str = "ReverseImageSearchEngine"
         self.COLLECTION: str = "Embeddings"
+        self.UNIQUE_KEY: str = "s3_link"
+        self.MAX_POOL_SIZE: int = 32
+        self.MIN_POOL_SIZE: int = 4
+        self.MAX_IDLE_TIME_MS: int = 60000
+        self.SERVER_SELECTION_TIMEOUT_MS: int = 10000
+        self.WRITE_BATCH_SIZE: int = 2048
+        self.WRITE_QUEUE_SIZE: int = 64
+        self.WRITE_FLUSH_INTERVAL: float = 1.0
+        self.WRITE_CONCURRENCY: int = 4
+        self.VECTOR_FIELD: str = "images"
+        self.LABEL_FIELD: str = "label"
+        self.INGESTED_FIELD: str = "ingested_at"
+        self.READ_BATCH_SIZE: int = 5000
+        self.READ_WORKERS: int = 4
+
+    @property
+    def USERNAME(self) -> str:
+        return os.environ["DATABASE_USERNAME"]
+
+    @property
+    def PASSWORD(self) -> str:
+        return os.environ["DATABASE_PASSWORD"]
 
     def get_database_config(self):
         """
@@ -54,9 +84,9 @@ class DataPreprocessingConfig:
         """
         self.BATCH_SIZE = 32
         self.IMAGE_SIZE = 256
-        self.TRAIN_DATA_PATH = os.path.join(from_root(), "data", "splitted", "train")
-        self.TEST_DATA_PATH = os.path.join(from_root(), "data", "splitted", "test")
-        self.VALID_DATA_PATH = os.path.join(from_root(), "data", "splitted", "valid")
+        self.TRAIN_DATA_PATH = os.path.join(project_root(), "data", "splitted", "train")
+        self.TEST_DATA_PATH = os.path.join(project_root(), "data", "splitted", "test")
+        self.VALID_DATA_PATH = os.path.join(project_root(), "data", "splitted", "valid")
 
     def get_data_preprocessing_config(self):
         """
@@ -74,8 +104,7 @@ class ModelConfig:
         Initialize ModelConfig with default values.
         """
         self.LABEL = 101
-        self.STORE_PATH = os.path.join(from_root(), "model", "benchmark")
-        self.REPOSITORY = 'pytorch/vision:v0.10.0'
+        self.STORE_PATH = os.path.join(project_root(), "model", "benchmark")
         self.BASEMODEL = 'resnet18'
         self.PRETRAINED = True
 
@@ -94,7 +123,7 @@ class TrainerConfig:
         """
         Initialize TrainerConfig with default values.
         """
-        self.MODEL_STORE_PATH = os.path.join(from_root(), "model", "finetuned", "model.pth")
+        self.MODEL_STORE_PATH = os.path.join(project_root(), "model", "finetuned", "model.pth")
         self.EPOCHS = 2
         self.Evaluation = True
 
@@ -105,6 +134,35 @@ class TrainerConfig:
         return self.__dict__
 
 
+class DistillationConfig:
+    """
+    Configuration class for distilling the embedding network into a smaller student.
+    """
+    def __init__(self):
+        """
+        Initialize DistillationConfig with default values.
+        """
+        self.ENABLED = False
+        self.BACKBONE = "mobilenet_v3_small"
+        self.PRETRAINED = True
+        self.IMAGE_SIZE = 160
+        self.EMBEDDING_DIMENSION = 256
+        self.EPOCHS = 5
+        self.LEARNING_RATE = 1e-3
+        self.OVERLAP_K = 10
+        self.THROUGHPUT_BATCHES = 5
+        self.MODEL_STORE_PATH = os.path.join(project_root(), "model", "finetuned", "model.pth")
+        self.STUDENT_STORE_PATH = os.path.join(project_root(), "model", "finetuned", "student.pth")
+        # Embed the catalogue and serve queries with the student instead of the teacher.
+        self.SERVE_STUDENT = False
+
+    def get_distillation_config(self):
+        """
+        Get the distillation configuration as a dictionary.
+        """
+        return self.__dict__
+
+
 class ImageFolderConfig:
     """
     Configuration class for image folder settings.
@@ -113,11 +171,13 @@ class ImageFolderConfig:
         """
         Initialize ImageFolderConfig with default values.
         """
-        self.ROOT_DIR = os.path.join(from_root(), "data", "raw", "images")
+        self.ROOT_DIR = os.path.join(project_root(), "data", "raw", "images")
         self.IMAGE_SIZE = 256
         self.LABEL_MAP = {}
         self.BUCKET: str = "image-database-system-01"
         self.S3_LINK = "https://{0}.s3.ap-south-1.amazonaws.com/images/{1}/{2}"
+        self.TABLE_CACHE_PATH = os.path.join(project_root(), "data", "raw", "image_table.npz")
+        self.SCAN_WORKERS = 16
 
     def get_image_folder_config(self):
         """
@@ -126,6 +186,31 @@ class ImageFolderConfig:
         return self.__dict__
 
 
+class ExportConfig:
+    """
+    Configuration class for CPU inference export settings.
+    """
+    def __init__(self):
+        """
+        Initialize ExportConfig with default values.
+        """
+        self.MODEL_STORE_PATH = os.path.join(project_root(), "model", "finetuned", "model.pth")
+        self.TORCHSCRIPT_PATH = os.path.join(project_root(), "model", "finetuned", "embedding.pt")
+        self.ONNX_PATH = os.path.join(project_root(), "model", "finetuned", "embedding.onnx")
+        self.EXPORT_ONNX = False
+        self.QUANTIZE = True
+        self.BACKEND = "fbgemm"
+        self.IMAGE_SIZE = 256
+        self.CALIBRATION_BATCHES = 8
+        self.MIN_COSINE_SIMILARITY = 0.98
+
+    def get_export_config(self):
+        """
+        Get the export configuration as a dictionary.
+        """
+        return self.__dict__
+
+
 class EmbeddingsConfig:
     """
     Configuration class for embeddings settings.
@@ -134,7 +219,13 @@ class EmbeddingsConfig:
         """
         Initialize EmbeddingsConfig with default values.
         """
-        self.MODEL_STORE_PATH = os.path.join(from_root(), "model", "finetuned", "model.pth")
+        self.MODEL_STORE_PATH = os.path.join(project_root(), "model", "finetuned", "model.pth")
+        self.EXPORTED_MODEL_PATH = os.path.join(project_root(), "model", "finetuned", "embedding.pt")
+        self.INTRA_OP_THREADS = os.cpu_count()
+        self.INTER_OP_THREADS = 1
+        self.BATCH_SIZE = 64
+        self.NUM_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+        self.SHARD_DIR = os.path.join(project_root(), "data", "embeddings", "shards")
 
     def get_embeddings_config(self):
         """
@@ -143,6 +234,32 @@ class EmbeddingsConfig:
         return self.__dict__
 
 
+class ProjectionConfig:
+    """
+    Configuration class for the PCA projection applied to embeddings before indexing.
+    """
+    def __init__(self):
+        """
+        Initialize ProjectionConfig with default values.
+        """
+        self.ENABLED = False
+        self.DIMENSION = 64
+        self.WHITEN = False
+        self.NORMALIZE = False
+        self.SAMPLE = 100000
+        self.SEED = 0
+        self.RECALL_K = 10
+        self.RECALL_QUERIES = 200
+        self.PROJECTION_PATH = os.path.join(project_root(), "data", "embeddings", "projection.npz")
+        self.PROJECTED_PATH = os.path.join(project_root(), "data", "embeddings", "projected.npz")
+
+    def get_projection_config(self):
+        """
+        Get the projection configuration as a dictionary.
+        """
+        return self.__dict__
+
+
 class AnnoyConfig:
     """
     Configuration class for Annoy settings.
@@ -151,7 +268,24 @@ class AnnoyConfig:
         """
         Initialize AnnoyConfig with default values.
         """
-        self.EMBEDDING_STORE_PATH = os.path.join(from_root(), "data", "embeddings", "embeddings.ann")
+        self.EMBEDDING_STORE_PATH = os.path.join(project_root(), "data", "embeddings", "embeddings.ann")
+        # None calibrates the number of trees for TARGET_RECALL on the catalogue being indexed.
+        self.N_TREES = None
+        self.TARGET_RECALL = 0.95
+        self.RECALL_K = 10
+        self.RECALL_QUERIES = 200
+        self.CALIBRATION_SAMPLE = 20000
+        self.MIN_TREES = 10
+        self.MAX_TREES = 200
+        self.BUILD_JOBS = -1
+        self.ON_DISK_BUILD = True
+        self.LABEL_INDEXES = True
+        self.SHARDS = 1
+        self.PARTITION = "hash"
+        self.SHARD_DIR = os.path.join(project_root(), "data", "embeddings", "index_shards")
+        self.BUILD_WORKERS = min(self.SHARDS, os.cpu_count() or 1)
+        self.KMEANS_SAMPLE = 20000
+        self.KMEANS_ITERATIONS = 20
 
     def get_annoy_config(self):
         """
@@ -160,14 +294,163 @@ class AnnoyConfig:
         return self.__dict__
 
 
+class DedupConfig:
+    """
+    Configuration class for the near-duplicate detection job.
+    """
+    def __init__(self):
+        """
+        Initialize DedupConfig with default values.
+        """
+        self.ROOT_DIR = os.path.join(project_root(), "data", "raw", "images")
+        self.CANONICAL_MAP_PATH = os.path.join(project_root(), "data", "embeddings", "canonical_map.json")
+        self.NEIGHBOURS = 10
+        self.N_TREES = 20
+        self.DISTANCE_THRESHOLD = None
+        self.RELATIVE_THRESHOLD = 0.1
+        self.HASH_WORKERS = 16
+        self.SEARCH_WORKERS = os.cpu_count() or 1
+
+    def get_dedup_config(self):
+        """
+        Get the dedup configuration as a dictionary.
+        """
+        return self.__dict__
+
+
+class MetricsConfig:
+    """
+    Configuration class for pipeline instrumentation settings.
+    """
+    def __init__(self):
+        """
+        Initialize MetricsConfig with default values.
+        """
+        self.REPORT_DIR = os.path.join(project_root(), "data", "reports")
+        self.PROMETHEUS = True
+        self.PROFILE_TRAINING = False
+        self.PROFILE_STEPS = 20
+
+    def get_metrics_config(self):
+        """
+        Get the metrics configuration as a dictionary.
+        """
+        return self.__dict__
+
+
+class BenchmarkConfig:
+    """
+    Configuration class for the synthetic end-to-end benchmark suite.
+    """
+    def __init__(self):
+        """
+        Initialize BenchmarkConfig with default values.
+        """
+        self.WORKSPACE = os.path.join(project_root(), "data", "benchmark")
+        self.BASELINE_PATH = os.path.join(project_root(), "benchmarks", "baseline.json")
+        self.CLASSES = 4
+        self.IMAGES_PER_CLASS = 40
+        self.SOURCE_IMAGE_SIZE = 320
+        self.SEED = 7
+        self.LOADER_BATCHES = 8
+        self.QUERY_SAMPLES = 32
+        self.QUERY_REQUESTS = 256
+        self.QUERY_CONCURRENCY = 8
+        self.TOP_K = 10
+        self.TOLERANCE = 0.25
+        self.MIN_REGRESSION_SECONDS = 0.1
+
+    def get_benchmark_config(self):
+        """
+        Get the benchmark configuration as a dictionary.
+        """
+        return self.__dict__
+
+
+class SearchConfig:
+    """
+    Configuration class for the query-by-image search service.
+    """
+    def __init__(self):
+        """
+        Initialize SearchConfig with default values.
+        """
+        self.MODEL_STORE_PATH = os.path.join(project_root(), "model", "finetuned", "model.pth")
+        self.EXPORTED_MODEL_PATH = os.path.join(project_root(), "model", "finetuned", "embedding.pt")
+        self.INTRA_OP_THREADS = os.cpu_count()
+        self.INTER_OP_THREADS = 1
+        self.EMBEDDING_STORE_PATH = os.path.join(project_root(), "data", "embeddings", "embeddings.ann")
+        self.DIMENSION = 256
+        self.METRIC = "euclidean"
+        self.DEVICE = "cpu"
+        self.HOST = "0.0.0.0"
+        self.PORT = 8080
+        self.TOP_K = 10
+        self.SEARCH_K = -1
+        self.FILTER_OVERFETCH = 1.5
+        self.BRUTE_FORCE_LIMIT = 2048
+        self.SHARD_MANIFEST_PATH = os.path.join(project_root(), "data", "embeddings", "index_shards", "manifest.json")
+        self.PROJECTION_PATH = os.path.join(project_root(), "data", "embeddings", "projection.npz")
+        self.SHARD_WORKERS = "local"
+        self.PROBE_SHARDS = 0
+        self.MAX_BATCH_SIZE = 32
+        self.MAX_WAIT_MS = 5
+        self.CACHE_EMBEDDINGS = 10000
+        self.CACHE_RESULTS = 50000
+        self.CACHE_MAX_BYTES = 256 * 1024 * 1024
+        self.CACHE_TTL = 3600
+
+    def get_search_config(self):
+        """
+        Get the search configuration as a dictionary.
+        """
+        return self.__dict__
+
+
 class S3Config:
     """
     Configuration class for Amazon S3 settings.
     """
     def __init__(self):
         """
-        Initialize S3Config with environment variables and default values.
+        Initialize S3Config with default values. Credentials are read from the environment on first access,
+        so stages that never touch S3 do not need them.
+        """
+        self.BUCKET_NAME = "image-database-system-01"
+        self.KEY = "model"
+        self.ZIP_NAME = "artifacts.tar.gz"
+        embeddings_dir = os.path.join(project_root(), "data", "embeddings")
+        model_dir = os.path.join(project_root(), "model", "finetuned")
+        # Archived on every upload; a missing one fails the upload.
+        self.ZIP_PATHS = [(os.path.join(model_dir, "model.pth"), "model.pth")]
+        # The index is archived in one of its two layouts: the shard directory, or the single index with its links,
+        # metadata and label indexes. One of them must be complete.
+        self.INDEX_ZIP_PATHS = [[(os.path.join(embeddings_dir, "index_shards"), "index_shards")],
+                                [(os.path.join(embeddings_dir, "embeddings.json"), "embeddings.json"),
+                                 (os.path.join(embeddings_dir, "embeddings.ann"), "embeddings.ann"),
+                                 (os.path.join(embeddings_dir, "embeddings.meta.npz"), "embeddings.meta.npz"),
+                                 (os.path.join(embeddings_dir, "embeddings_labels"), "embeddings_labels")]]
+        # Produced only when projection, distillation or export is enabled.
+        self.OPTIONAL_ZIP_PATHS = [(os.path.join(embeddings_dir, "projection.npz"), "projection.npz"),
+                                   (os.path.join(model_dir, "student.pth"), "student.pth"),
+                                   (os.path.join(model_dir, "embedding.pt"), "embedding.pt")]
+        self.MAX_CONCURRENCY = 256
+
+    @property
+    def ACCESS_KEY_ID(self) -> str:
+        return os.environ["ACCESS_KEY_ID"]
+
+    @property
+    def SECRET_KEY(self) -> str:
+        return os.environ["AWS_SECRET_KEY"]
+
+    @property
+    def REGION_NAME(self) -> str:
+        return os.environ.get("AWS_REGION", "ap-south-1")
+
+    def get_s3_config(self):
         """
-        self.ACCESS_KEY_ID = os.environ["ACCESS_KEY_ID"]
-        self.S
+        Get the S3 configuration as a dictionary.
+        """
+        return self.__dict__
 
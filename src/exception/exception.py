@@ -5,6 +5,10 @@ class IntegrityError(Exception):
     """Label Already Exists"""
 
 
+class InvalidImageError(ValueError):
+    """Uploaded Image Cannot Be Decoded"""
+
+
 def error_message_detail(error, error_detail):
     _, _, exc_tb = error_detail.exc_info()
     file_name = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
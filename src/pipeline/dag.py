@@ -0,0 +1,288 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from src.utils.metrics import metrics
+import threading
+import hashlib
+import json
+import time
+import os
+
+
+def hash_path(path: str) -> Optional[str]:
+    """
+    Hash an artifact on disk: file contents for files, a (path, size, mtime) manifest for directories.
+
+    Args:
+        path (str): File or directory.
+
+    Returns:
+        str: Hex digest, or None when the path does not exist.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if os.path.isfile(path):
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                relative = os.path.relpath(os.path.join(root, name), path)
+                digest.update(f"{relative}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+    return None
+
+
+def hash_value(value: Any) -> str:
+    """
+    Hash a JSON-serialisable value.
+    """
+    payload = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class Stage:
+    """
+    A pipeline step with declared upstream stages, output artifacts and fingerprinted inputs.
+    """
+    def __init__(self, name: str, func: Callable[..., Any], deps: Iterable[str] = (),
+                 outputs: Iterable[str] = (), config: Optional[Dict] = None,
+                 inputs: Optional[Callable[[], Any]] = None, cacheable: bool = True):
+        """
+        Args:
+            name (str): Unique stage name.
+            func (Callable): Called with the values of its dependencies as keyword arguments.
+            deps (Iterable[str]): Names of upstream stages.
+            outputs (Iterable[str]): Files or directories the stage produces.
+            config (Dict, optional): Settings whose change invalidates the stage.
+            inputs (Callable, optional): Returns a description of external inputs, e.g. a remote data manifest.
+            cacheable (bool): False for stages that only produce in-memory values; they run whenever a
+                dependent stage runs.
+        """
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.outputs = list(outputs)
+        self.config = config or {}
+        self.inputs = inputs
+        self.cacheable = cacheable
+
+
+class StageGraph:
+    """
+    Runs stages in dependency order, concurrently where possible, skipping stages whose outputs are
+    still valid for their current inputs.
+    """
+    def __init__(self, stages: List[Stage], state_path: str, max_workers: int = 4):
+        """
+        Args:
+            stages (List[Stage]): Stages of the pipeline.
+            state_path (str): JSON file recording the fingerprint and artifact hashes of completed stages.
+            max_workers (int): Maximum number of stages running at the same time.
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.state = self.load_state()
+        self.input_cache = {}
+        self.pinned = set()
+        self.order = self.topological_order()
+
+    def load_state(self) -> Dict:
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as file:
+                return json.load(file)
+        return {}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        temporary = f"{self.state_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(temporary, self.state_path)
+
+    def topological_order(self) -> List[str]:
+        """
+        Order the stages so every stage follows its dependencies.
+
+        Raises:
+            ValueError: On unknown dependencies or cycles.
+        """
+        order, visiting, visited = [], set(), set()
+
+        def visit(name):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage {name}")
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle detected at stage {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def descendants(self, name: str) -> set:
+        found = {name}
+        for stage in self.order:
+            if any(dep in found for dep in self.stages[stage].deps):
+                found.add(stage)
+        return found
+
+    def ancestors(self, name: str) -> set:
+        found, stack = set(), [name]
+        while stack:
+            current = stack.pop()
+            if current not in found:
+                found.add(current)
+                stack.extend(self.stages[current].deps)
+        return found
+
+    def external_inputs(self, stage: Stage):
+        if stage.inputs is None:
+            return None
+        if stage.name not in self.input_cache:
+            self.input_cache[stage.name] = stage.inputs()
+        return self.input_cache[stage.name]
+
+    def fingerprint(self, name: str, artifacts: Dict[str, str]) -> str:
+        """
+        Fingerprint a stage from its config, external inputs and upstream artifact hashes. Pinned stages reuse the
+        fingerprint of their recorded run, so their external inputs (e.g. a remote listing) are never fetched.
+        """
+        if name in self.pinned and name in self.state:
+            return self.state[name]["fingerprint"]
+        stage = self.stages[name]
+        return hash_value({"config": stage.config, "inputs": self.external_inputs(stage),
+                           "deps": {dep: artifacts[dep] for dep in stage.deps}})
+
+    def output_hashes(self, stage: Stage) -> Dict[str, Optional[str]]:
+        return {path: hash_path(path) for path in stage.outputs}
+
+    @staticmethod
+    def artifact(fingerprint: str, outputs: Dict[str, Optional[str]]) -> str:
+        """
+        Hash identifying what a stage handed downstream; memory-only stages are identified by their fingerprint.
+        """
+        return hash_value({"fingerprint": fingerprint, "outputs": outputs})
+
+    def is_valid(self, name: str, fingerprint: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Return the current output hashes if the recorded run matches the fingerprint and outputs are intact.
+        """
+        record = self.state.get(name)
+        stage = self.stages[name]
+        if not stage.cacheable or record is None or record["fingerprint"] != fingerprint:
+            return None
+        outputs = self.output_hashes(stage)
+        if any(value is None for value in outputs.values()) or outputs != record["outputs"]:
+            return None
+        return outputs
+
+    def plan(self, selected: set, forced: set) -> set:
+        """
+        Predict which stages must run, assuming every stale stage changes its outputs.
+
+        Returns:
+            set: Stage names expected to run, including memory-only stages they need.
+        """
+        stale, changed, artifacts = set(), set(), {}
+        for name in self.order:
+            if name not in selected:
+                continue
+            stage = self.stages[name]
+            fingerprint = self.fingerprint(name, artifacts)
+            upstream_changed = any(dep in changed for dep in stage.deps)
+            outputs = {}
+            if stage.cacheable:
+                outputs = self.is_valid(name, fingerprint)
+                if name in forced or outputs is None or upstream_changed:
+                    stale.add(name)
+                    changed.add(name)
+            elif upstream_changed:
+                changed.add(name)
+            artifacts[name] = self.artifact(fingerprint, outputs or {})
+
+        needed = set(stale)
+        for name in reversed(self.order):
+            if name in needed:
+                needed.update(dep for dep in self.stages[name].deps
+                              if dep in selected and not self.stages[dep].cacheable)
+        return needed
+
+    def run(self, start: Optional[str] = None, until: Optional[str] = None, force: bool = False):
+        """
+        Execute the graph.
+
+        Args:
+            start (str, optional): Re-run this stage and everything downstream of it. Upstream stages that ran
+                before are taken as they are: they only re-run if their outputs are missing or were modified.
+            until (str, optional): Only run this stage and its ancestors.
+            force (bool): Ignore all cached results.
+
+        Returns:
+            dict: Status of every selected stage: "ran" or "skipped".
+        """
+        selected = self.ancestors(until) if until else set(self.order)
+        forced = set(selected) if force else (self.descendants(start) & selected if start else set())
+        self.pinned = selected - self.descendants(start) if start and not force else set()
+        needed = self.plan(selected, forced)
+
+        values, artifacts, status = {}, {}, {}
+        remaining = [name for name in self.order if name in selected]
+
+        def execute(name, fingerprint):
+            stage = self.stages[name]
+            for dep in stage.deps:
+                if dep not in values and not self.stages[dep].cacheable:
+                    # A memory-only dependency the plan did not foresee: build it now.
+                    values[dep], _ = execute(dep, artifacts[dep])
+            print(f"\n====================== Running stage {name} ======================\n")
+            started = time.time()
+            with metrics.timer(f"stage_{name}"):
+                value = stage.func(**{dep: values.get(dep) for dep in stage.deps})
+            outputs = self.output_hashes(stage)
+            if stage.cacheable:
+                with self.lock:
+                    self.state[name] = {"fingerprint": fingerprint, "outputs": outputs,
+                                        "seconds": time.time() - started, "finished": time.time()}
+                    self.save_state()
+            return value, outputs
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while remaining or running:
+                for name in list(remaining):
+                    stage = self.stages[name]
+                    if any(dep in remaining or dep in running.values() for dep in stage.deps if dep in selected):
+                        continue
+                    remaining.remove(name)
+                    fingerprint = self.fingerprint(name, artifacts)
+                    outputs = self.is_valid(name, fingerprint) if stage.cacheable else None
+                    if stage.cacheable and outputs is not None and name not in forced:
+                        artifacts[name] = self.artifact(fingerprint, outputs)
+                        status[name] = "skipped"
+                        print(f"Skipping stage {name} : outputs are up to date")
+                    elif name in needed or stage.cacheable:
+                        running[executor.submit(execute, name, fingerprint)] = name
+                    else:
+                        artifacts[name] = self.artifact(fingerprint, {})
+                        status[name] = "skipped"
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    values[name], outputs = future.result()
+                    artifacts[name] = self.artifact(self.fingerprint(name, artifacts), outputs)
+                    status[name] = "ran"
+        return status
@@ -1,17 +1,22 @@
-from src.components.data_ingestion import DataIngestion
-from src.components.data_preprocessing import DataPreprocessing
-from src.components.embeddings import EmbeddingGenerator, ImageFolder
-from src.utils.storage_handler import S3Connector
-from src.components.nearest_neighbours import Annoy
-from src.components.model import NeuralNet
-from src.components.trainer import Trainer
-from torch.utils.data import DataLoader
-from from_root import from_root
-from tqdm import tqdm
-import torch
+# Components are imported inside the stages that use them, so running one stage only loads its own
+# dependencies (torch, boto3, pymongo, ...).
+from src.pipeline.dag import Stage, StageGraph
+from src.utils.metrics import metrics
+from src.entity.config_entity import (DataIngestionConfig, DataPreprocessingConfig, ModelConfig, TrainerConfig,
+                                      ExportConfig, ImageFolderConfig, AnnoyConfig, MetricsConfig, DedupConfig,
+                                      ProjectionConfig, DistillationConfig, project_root)
+from datetime import datetime
+import argparse
 import os
 
 
+def pick(config, *keys):
+    """
+    Select the settings of a config object that affect a stage's outputs.
+    """
+    return {key: getattr(config, key) for key in keys}
+
+
 class Pipeline:
     def __init__(self):
         """
@@ -19,20 +24,37 @@ class Pipeline:
         """
         self.paths = ["data", "data/raw", "data/splitted", "data/embeddings",
                       "model", "model/benchmark", "model/finetuned"]
+        self.state_path = os.path.join(project_root(), "data", "pipeline_state.json")
 
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    @property
+    def device(self) -> str:
+        """
+        Device used for training and embedding.
+        """
+        import torch
+        return "cuda" if torch.cuda.is_available() else "cpu"
 
     def initiate_data_ingestion(self):
         """
-        Initialize and run the data ingestion process.
+        Initialize and run the data download.
         """
+        from src.components.data_ingestion import DataIngestion
         for folder in self.paths:
-            path = os.path.join(from_root(), folder)
+            path = os.path.join(project_root(), folder)
             if not os.path.exists(path):
-                os.mkdir(folder)
+                os.mkdir(path)
 
         dc = DataIngestion()
-        dc.run_step()
+        dc.download_dir()
+
+    @staticmethod
+    def initiate_data_split():
+        """
+        Split the downloaded data into train, validation and test sets.
+        """
+        from src.components.data_ingestion import DataIngestion
+        dc = DataIngestion()
+        dc.split_data()
 
     @staticmethod
     def initiate_data_preprocessing():
@@ -42,6 +64,7 @@ class Pipeline:
         Returns:
             dict: Data loaders for training, testing, and validation.
         """
+        from src.components.data_preprocessing import DataPreprocessing
         dp = DataPreprocessing()
         loaders = dp.run_step()
         return loaders
@@ -49,12 +72,13 @@ class Pipeline:
     @staticmethod
     def initiate_model_architecture():
         """
-        Initialize the neural network model.
+        Initialize the neural network model with pretrained backbone weights for training.
 
         Returns:
             NeuralNet: Instance of the neural network model.
         """
-        return NeuralNet()
+        from src.components.model import NeuralNet
+        return NeuralNet(pretrained=True)
 
     def initiate_model_training(self, loaders, net):
         """
@@ -64,61 +88,214 @@ class Pipeline:
             loaders (dict): Data loaders for training, testing, and validation.
             net (NeuralNet): Instance of the neural network model.
         """
+        from src.components.trainer import Trainer
         trainer = Trainer(loaders, self.device, net)
         trainer.train_model()
         trainer.evaluate(validate=True)
         trainer.save_model_in_pth()
 
-    def generate_embeddings(self, loaders, net):
+    def distill_model(self, loaders):
         """
-        Generate embeddings using the trained model.
+        Distill the trained model into the smaller student network, when distillation is enabled.
 
         Args:
             loaders (dict): Data loaders for training, testing, and validation.
-            net (NeuralNet): Instance of the neural network model.
+
+        Returns:
+            dict: Distillation report.
         """
-        data = ImageFolder(label_map=loaders["valid_data_loader"][1].class_to_idx)
-        dataloader = DataLoader(dataset=data, batch_size=64, shuffle=True)
-        embeds = EmbeddingGenerator(model=net, device=self.device)
+        config = DistillationConfig()
+        if not config.ENABLED:
+            if config.SERVE_STUDENT:
+                raise ValueError("SERVE_STUDENT is set but distillation is disabled, so the student would not be "
+                                 "distilled from the current model; enable DistillationConfig.ENABLED")
+            return {"Response": "Distillation disabled"}
+        from src.components.model import NeuralNet
+        from src.components.trainer import Trainer
+        import torch
+        net = NeuralNet(pretrained=False)
+        net.load_state_dict(torch.load(TrainerConfig().MODEL_STORE_PATH, map_location=self.device))
+        response = Trainer(loaders, self.device, net).distill_model()
+        print(response)
+        return response
 
-        for batch, values in tqdm(enumerate(dataloader)):
-            img, target, link = values
-            print(embeds.run_step(batch, img, target, link))
+    @staticmethod
+    def export_model(loaders):
+        """
+        Export the trained embedding network as an optimised CPU inference graph.
+
+        Args:
+            loaders (dict): Data loaders used for quantisation calibration and drift checks.
+        """
+        from src.components.export import ModelExporter
+        exporter = ModelExporter(loaders)
+        print(exporter.run_step())
+
+    def generate_embeddings(self, loaders):
+        """
+        Generate embeddings using the trained model, sharded across worker processes.
+
+        Args:
+            loaders (dict): Data loaders for training, testing, and validation.
+        """
+        from src.components.embeddings import ShardedEmbeddingGenerator
+        embeds = ShardedEmbeddingGenerator(label_map=loaders["valid_data_loader"][1].class_to_idx,
+                                           device=self.device)
+        print(embeds.run_step())
 
     @staticmethod
     def create_annoy():
         """
         Create Annoy index using generated embeddings.
         """
+        from src.components.nearest_neighbours import Annoy
         ann = Annoy()
         ann.run_step()
 
+    @staticmethod
+    def deduplicate():
+        """
+        Map near-duplicate catalogue images to canonical ones.
+        """
+        from src.components.dedup import Deduplicator
+        return Deduplicator().run_step()
+
+    @staticmethod
+    def project_embeddings():
+        """
+        Fit the PCA projection and project the embeddings, or remove the projection when it is disabled.
+        """
+        from src.components.projection import Projector
+        return Projector().run_step()
+
     @staticmethod
     def push_artifacts():
         """
         Push artifacts to storage (S3).
         """
+        from src.utils.storage_handler import S3Connector
         connection = S3Connector()
         response = connection.zip_files()
         return response
 
-    def run_pipeline(self):
+    @staticmethod
+    def pull_artifacts():
+        """
+        Download and extract the artifacts pushed by an earlier run.
+        """
+        from src.utils.storage_handler import S3Connector
+        return S3Connector().pull_artifacts()
+
+    def build_graph(self):
+        """
+        Declare the pipeline stages with their dependencies, outputs and fingerprinted settings.
+
+        Returns:
+            StageGraph: Executable stage graph.
+        """
+        ingestion, preprocessing, model = DataIngestionConfig(), DataPreprocessingConfig(), ModelConfig()
+        trainer, export, image_folder, annoy = TrainerConfig(), ExportConfig(), ImageFolderConfig(), AnnoyConfig()
+        dedup, projection, distillation = DedupConfig(), ProjectionConfig(), DistillationConfig()
+        stem = os.path.splitext(annoy.EMBEDDING_STORE_PATH)[0]
+        index_outputs = [annoy.SHARD_DIR] if annoy.SHARDS > 1 else \
+            [annoy.EMBEDDING_STORE_PATH, f"{stem}.json", f"{stem}.meta.npz", f"{stem}_labels"]
+
+        # The canonical map is deliberately not an ingest input: a dedup run must not force a re-download, re-split
+        # and retrain. Duplicates drop out of the local data at the next ingestion; the index skips them at once.
+        def ingest_inputs():
+            from src.components.data_ingestion import DataIngestion
+            return {"manifest": DataIngestion().remote_manifest()}
+        stages = [
+            Stage("ingest", lambda: self.initiate_data_ingestion(),
+                  outputs=[os.path.join(project_root(), ingestion.RAW, ingestion.PREFIX)],
+                  config=pick(ingestion, "BUCKET", "PREFIX"),
+                  inputs=ingest_inputs),
+            Stage("split", lambda ingest: self.initiate_data_split(), deps=["ingest"],
+                  outputs=[os.path.join(project_root(), ingestion.SPLIT)], config=pick(ingestion, "SEED", "RATIO")),
+            Stage("preprocess", lambda split: self.initiate_data_preprocessing(), deps=["split"],
+                  config=pick(preprocessing, "BATCH_SIZE", "IMAGE_SIZE"), cacheable=False),
+            Stage("model", lambda: self.initiate_model_architecture(),
+                  config=pick(model, "LABEL", "BASEMODEL", "PRETRAINED"), cacheable=False),
+            Stage("train", lambda preprocess, model: self.initiate_model_training(preprocess, model),
+                  deps=["preprocess", "model"], outputs=[trainer.MODEL_STORE_PATH], config=pick(trainer, "EPOCHS")),
+            Stage("export", lambda train, preprocess: self.export_model(preprocess), deps=["train", "preprocess"],
+                  outputs=[export.TORCHSCRIPT_PATH],
+                  config=pick(export, "QUANTIZE", "BACKEND", "IMAGE_SIZE", "MIN_COSINE_SIMILARITY")),
+            Stage("distill", lambda train, preprocess: self.distill_model(preprocess), deps=["train", "preprocess"],
+                  outputs=[distillation.STUDENT_STORE_PATH] if distillation.ENABLED else [],
+                  config=pick(distillation, "ENABLED", "SERVE_STUDENT", "BACKBONE", "PRETRAINED", "IMAGE_SIZE",
+                              "EMBEDDING_DIMENSION", "EPOCHS", "LEARNING_RATE")),
+            Stage("embed", lambda export, preprocess, distill: self.generate_embeddings(preprocess),
+                  deps=["export", "preprocess", "distill"],
+                  config={**pick(image_folder, "IMAGE_SIZE", "BUCKET", "S3_LINK"),
+                          **pick(distillation, "SERVE_STUDENT")}),
+            Stage("dedup", lambda embed: self.deduplicate(), deps=["embed"], outputs=[dedup.CANONICAL_MAP_PATH],
+                  config=pick(dedup, "NEIGHBOURS", "N_TREES", "DISTANCE_THRESHOLD", "RELATIVE_THRESHOLD")),
+            Stage("project", lambda dedup: self.project_embeddings(), deps=["dedup"],
+                  outputs=[projection.PROJECTION_PATH, projection.PROJECTED_PATH] if projection.ENABLED else [],
+                  config=pick(projection, "ENABLED", "DIMENSION", "WHITEN", "NORMALIZE", "SAMPLE", "SEED")),
+            Stage("index", lambda project: self.create_annoy(), deps=["project"], outputs=index_outputs,
+                  config=pick(annoy, "N_TREES", "TARGET_RECALL", "RECALL_K", "RECALL_QUERIES", "CALIBRATION_SAMPLE",
+                              "MIN_TREES", "MAX_TREES", "LABEL_INDEXES", "SHARDS", "PARTITION", "KMEANS_SAMPLE",
+                              "KMEANS_ITERATIONS")),
+            Stage("push", lambda index, export: self.push_artifacts(), deps=["index", "export"]),
+        ]
+        return StageGraph(stages, self.state_path)
+
+    def run_pipeline(self, start: str = None, until: str = None, force: bool = False):
         """
-        Run the complete image search pipeline.
+        Run the image search pipeline, skipping stages whose outputs are still up to date.
+
+        Args:
+            start (str, optional): Re-run this stage and everything downstream of it.
+            until (str, optional): Stop after this stage.
+            force (bool): Re-run every stage regardless of cached results.
 
         Returns:
-            dict: Response indicating the completion of the pipeline.
+            dict: Response indicating the completion of the pipeline, the status of each stage and the run report.
         """
-        self.initiate_data_ingestion()
-        loaders = self.initiate_data_preprocessing()
-        net = self.initiate_model_architecture()
-        self.initiate_model_training(loaders, net)
-        self.generate_embeddings(loaders, net)
-        self.create_annoy()
-        self.push_artifacts()
-        return {"Response": "Pipeline Run Complete"}
+        metrics.reset()
+        status, error = {}, None
+        try:
+            status = self.build_graph().run(start=start, until=until, force=force)
+        except Exception as e:
+            error = e
+            raise e
+        finally:
+            report = self.write_report(status, error)
+        return {"Response": "Pipeline Run Complete", "Info": status, "Report": report}
+
+    @staticmethod
+    def write_report(status: dict, error: Exception = None):
+        """
+        Write the metrics collected during the run to a timestamped JSON report, and optionally a
+        Prometheus textfile.
+
+        Args:
+            status (dict): Status of each stage.
+            error (Exception, optional): Failure that ended the run.
+
+        Returns:
+            str: Path of the JSON report.
+        """
+        config = MetricsConfig()
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = metrics.export_json(os.path.join(config.REPORT_DIR, f"run-{timestamp}.json"),
+                                   {"stages": status, "error": repr(error) if error else None})
+        if config.PROMETHEUS:
+            metrics.export_prometheus(os.path.join(config.REPORT_DIR, "pipeline.prom"))
+        print(f"Run report written to {path}")
+        return path
 
 
 if __name__ == "__main__":
+    stages = ["ingest", "split", "preprocess", "model", "train", "distill", "export", "embed", "dedup", "project",
+              "index", "push"]
+    parser = argparse.ArgumentParser(description="Run the image search training pipeline.")
+    parser.add_argument("--from", dest="start", choices=stages, help="re-run this stage and everything after it")
+    parser.add_argument("--until", choices=stages, help="stop after this stage")
+    parser.add_argument("--force", action="store_true", help="ignore cached stage results")
+    args = parser.parse_args()
+
     image_search = Pipeline()
-    image_search.run_pipeline()
+    print(image_search.run_pipeline(start=args.start, until=args.until, force=args.force))
@@ -0,0 +1,100 @@
+from src.components.search import SearchEngine, MicroBatcher
+from src.entity.config_entity import ImageFolderConfig
+from src.utils.cache import QueryCache
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+import numpy as np
+import argparse
+import random
+import time
+import os
+
+
+def sample_images(root: str, count: int, seed: int = 42):
+    """
+    Read a reproducible sample of encoded images from the local image tree.
+
+    Args:
+        root (str): Directory with one sub-directory per class.
+        count (int): Number of images to sample.
+        seed (int): Sampling seed.
+
+    Returns:
+        list: Raw image bytes.
+    """
+    paths = [os.path.join(root, label, name)
+             for label in sorted(os.listdir(root))
+             for name in sorted(os.listdir(os.path.join(root, label)))]
+    random.Random(seed).shuffle(paths)
+    images = []
+    for path in paths[:count]:
+        with open(path, "rb") as file:
+            images.append(file.read())
+    return images
+
+
+def run_benchmark(images, concurrency: int, requests: int, k: int, url: str = None, cached: bool = True):
+    """
+    Fire queries from concurrent clients and report latency percentiles and throughput.
+
+    Args:
+        images (list): Encoded query images, used round-robin.
+        concurrency (int): Number of concurrent clients.
+        requests (int): Total number of queries.
+        k (int): Neighbours per query.
+        url (str, optional): Base URL of a running service; in-process when omitted.
+        cached (bool): Use the query caches of the in-process engine; disable to time every query end to end.
+
+    Returns:
+        dict: Benchmark report.
+    """
+    batcher = None
+    if url is None:
+        engine = SearchEngine()
+        if not cached:
+            engine.cache = QueryCache(0, 0, 0, 0)
+        batcher = MicroBatcher(engine)
+        batcher.query(images[0], k)
+
+    def query(i):
+        data = images[i % len(images)]
+        start = time.perf_counter()
+        if batcher is not None:
+            batcher.query(data, k)
+        else:
+            urlopen(Request(f"{url}/search?k={k}", data=data, method="POST")).read()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = np.array(list(executor.map(query, range(requests)))) * 1000
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput_qps": requests / elapsed,
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        "latency_ms_p99": float(np.percentile(latencies, 99)),
+    }
+    if batcher is not None and batcher.batches:
+        report["mean_batch_size"] = batcher.requests / batcher.batches
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark query-by-image latency on CPU.")
+    parser.add_argument("--images", default=ImageFolderConfig().ROOT_DIR)
+    parser.add_argument("--samples", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--no-cache", action="store_true", help="bypass the in-process query caches")
+    args = parser.parse_args()
+
+    result = run_benchmark(sample_images(args.images, args.samples), args.concurrency,
+                           args.requests, args.k, args.url, cached=not args.no_cache)
+    for key, value in result.items():
+        print(f"{key} : {value:.2f}" if isinstance(value, float) else f"{key} : {value}")
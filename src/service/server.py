@@ -0,0 +1,86 @@
+from src.components.search import SearchEngine, MicroBatcher
+from src.exception.exception import InvalidImageError
+from src.utils.metrics import metrics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import json
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler: POST raw image bytes to /search?k=10 (optionally with label, since and until filters),
+    POST /reload after publishing a new index, GET /health for readiness and GET /metrics for cache and
+    batching statistics.
+    """
+    batcher: MicroBatcher = None
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(200, {"Response": "Success"})
+        elif path == "/metrics":
+            self._send(200, {"Response": "Success", "Info": {
+                "cache": self.batcher.engine.cache.stats(),
+                "batches": self.batcher.batches,
+                "requests": self.batcher.requests,
+                "timings": metrics.snapshot()["histograms"]}})
+        else:
+            self._send(404, {"Response": "Not Found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/reload":
+            try:
+                self._send(200, self.batcher.engine.reload_index())
+            except Exception as e:
+                self._send(500, {"Response": "Failure", "Info": str(e)})
+            return
+        if url.path != "/search":
+            self._send(404, {"Response": "Not Found"})
+            return
+        try:
+            params = parse_qs(url.query)
+            k = int(params.get("k", [self.batcher.engine.config.TOP_K])[0])
+            label, since, until = (int(params[name][0]) if name in params else None
+                                   for name in ("label", "since", "until"))
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        except ValueError as e:
+            self._send(400, {"Response": "Failure", "Info": str(e)})
+            return
+        try:
+            links = self.batcher.query(data, k, label, since, until)
+            self._send(200, {"Response": "Success", "Info": links})
+        except InvalidImageError as e:
+            self._send(400, {"Response": "Failure", "Info": str(e)})
+        except Exception as e:
+            self._send(500, {"Response": "Failure", "Info": str(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve():
+    """
+    Load the model and index once and serve search requests until interrupted.
+    """
+    engine = SearchEngine()
+    SearchHandler.batcher = MicroBatcher(engine)
+    server = ThreadingHTTPServer((engine.config.HOST, engine.config.PORT), SearchHandler)
+    print(f"Serving image search on {engine.config.HOST}:{engine.config.PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+def run_sync(coroutine: Awaitable[T]) -> T:
+    """
+    Run a coroutine to completion from synchronous code.
+
+    Args:
+        coroutine (Awaitable): Coroutine to execute.
+
+    Returns:
+        The value returned by the coroutine.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # Called from inside an event loop: run on a private loop in a helper thread.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+async def gather_bounded(coroutines, limit: int):
+    """
+    Await coroutines concurrently with at most `limit` in flight.
+
+    Args:
+        coroutines: Iterable of coroutines.
+        limit (int): Maximum number of concurrently running coroutines.
+
+    Returns:
+        list: Results in the order of the input coroutines.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines))
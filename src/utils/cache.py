@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import threading
+import hashlib
+import time
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and approximate size, with per-entry TTL.
+    """
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, sizeof: Callable[[Any], int]):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int): Maximum number of entries.
+            max_bytes (int): Maximum total size of the values as reported by `sizeof`.
+            ttl (float): Seconds after which an entry expires; 0 disables expiry.
+            sizeof (Callable): Function returning the approximate size of a value in bytes.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the cached value, or None on a miss or an expired entry.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires = entry
+            if self.ttl and expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Insert or refresh a value, evicting least recently used entries to stay within bounds.
+        """
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        """
+        Drop every entry while keeping the hit and miss counters.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Return hit-rate and occupancy metrics.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "expirations": self.expirations}
+
+
+class QueryCache:
+    """
+    Two-level cache for query-by-image: image hash -> embedding, and
+    (image hash, k, index version) -> neighbour list.
+    """
+    def __init__(self, max_embeddings: int, max_results: int, max_bytes: int, ttl: float):
+        """
+        Initialize both cache levels, splitting the byte budget evenly between them.
+
+        Args:
+            max_embeddings (int): Maximum number of cached embeddings.
+            max_results (int): Maximum number of cached neighbour lists.
+            max_bytes (int): Total approximate memory budget in bytes.
+            ttl (float): Seconds after which entries expire; 0 disables expiry.
+        """
+        self.embeddings = LRUCache(max_embeddings, max_bytes // 2, ttl, sizeof=lambda vector: vector.nbytes)
+        self.results = LRUCache(max_results, max_bytes // 2, ttl,
+                                sizeof=lambda links: sum(len(link) + 56 for link in links) + 64)
+        self.index_version = None
+
+    @staticmethod
+    def image_key(data: bytes) -> str:
+        """
+        Hash the encoded image content.
+        """
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def set_index_version(self, version: str):
+        """
+        Record the loaded index version, invalidating neighbour lists computed against an older one.
+        """
+        if version != self.index_version:
+            self.results.clear()
+            self.index_version = version
+
+    def get_embedding(self, key: str):
+        return self.embeddings.get(key)
+
+    def put_embedding(self, key: str, vector):
+        self.embeddings.put(key, vector)
+
+    def get_results(self, key: str, k: int):
+        return self.results.get((key, k, self.index_version))
+
+    def put_results(self, key: str, k: int, links, version: Optional[str] = None):
+        """
+        Cache a neighbour list under the index version it was computed against (the current one by default).
+        """
+        self.results.put((key, k, version or self.index_version), links)
+
+    def stats(self) -> dict:
+        """
+        Return the metrics of both levels and the current index version.
+        """
+        return {"index_version": self.index_version,
+                "embeddings": self.embeddings.stats(),
+                "results": self.results.stats()}
@@ -1,19 +1,105 @@
 from src.entity.config_entity import DatabaseConfig
-from pymongo import MongoClient
-from typing import List, Dict, Any
+from src.utils.async_utils import gather_bounded
+from src.utils.metrics import metrics
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo.errors import OperationFailure
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from tqdm import tqdm
+import numpy as np
+import threading
+import weakref
+import asyncio
+import queue
+import time
 
 
 class MongoDBClient:
     """
     Class for interacting with MongoDB.
     """
+    _client = None
+    _client_lock = threading.Lock()
+    _indexed_collections = set()
+
     def __init__(self):
         """
-        Initialize MongoDBClient with configuration settings and establish a connection to MongoDB.
+        Initialize MongoDBClient with configuration settings and attach to the shared MongoDB connection.
         """
         self.config = DatabaseConfig()
-        url = self.config.URL.replace("<username>", self.config.USERNAME).replace("<password>", self.config.PASSWORD)
-        self.client = MongoClient(url)
+        self.client = self.get_client(self.config)
+        self.ensure_indexes()
+
+    @classmethod
+    def get_client(cls, config: DatabaseConfig) -> MongoClient:
+        """
+        Return the process-wide MongoClient, creating it on first use.
+
+        Args:
+            config (DatabaseConfig): Database configuration holding credentials and pool settings.
+
+        Returns:
+            MongoClient: Shared client with a tuned connection pool.
+        """
+        if cls._client is None:
+            with cls._client_lock:
+                if cls._client is None:
+                    url = config.URL.replace("<username>", config.USERNAME).replace("<password>", config.PASSWORD)
+                    cls._client = MongoClient(
+                        url,
+                        maxPoolSize=config.MAX_POOL_SIZE,
+                        minPoolSize=config.MIN_POOL_SIZE,
+                        maxIdleTimeMS=config.MAX_IDLE_TIME_MS,
+                        serverSelectionTimeoutMS=config.SERVER_SELECTION_TIMEOUT_MS,
+                        connect=False
+                    )
+        return cls._client
+
+    def ensure_indexes(self):
+        """
+        Create the unique index on the S3 link once per process and collection. Duplicates left by inserts made
+        before the index existed are removed first, since the index cannot be built over them.
+
+        Raises:
+            OperationFailure: If the index cannot be created for any other reason.
+        """
+        key = (self.config.DBNAME, self.config.COLLECTION)
+        if key in self._indexed_collections:
+            return
+        with self._client_lock:
+            if key in self._indexed_collections:
+                return
+            collection = self.client[self.config.DBNAME][self.config.COLLECTION]
+            index = [(self.config.UNIQUE_KEY, ASCENDING)]
+            try:
+                collection.create_index(index, unique=True)
+            except OperationFailure as e:
+                if e.code != 11000:
+                    raise
+                self.remove_duplicates(collection)
+                collection.create_index(index, unique=True)
+            self._indexed_collections.add(key)
+
+    def remove_duplicates(self, collection) -> int:
+        """
+        Keep only the most recently inserted document for every S3 link.
+
+        Args:
+            collection: Collection to deduplicate.
+
+        Returns:
+            int: Number of documents removed.
+        """
+        duplicates = collection.aggregate([
+            {"$sort": {"_id": ASCENDING}},
+            {"$group": {"_id": f"${self.config.UNIQUE_KEY}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True)
+        stale = [_id for group in duplicates for _id in group["ids"][:-1]]
+        for start in range(0, len(stale), self.config.WRITE_BATCH_SIZE):
+            collection.delete_many({"_id": {"$in": stale[start:start + self.config.WRITE_BATCH_SIZE]}})
+        print(f"Removed {len(stale)} duplicate documents by {self.config.UNIQUE_KEY}")
+        return len(stale)
 
     def insert_bulk_record(self, documents: List[Dict[str, Any]]):
         """
@@ -27,14 +113,47 @@ class MongoDBClient:
         """
         try:
             db = self.client[self.config.DBNAME]
-            collection = self.config.COLLECTION
-            if collection not in db.list_collection_names():
-                db.create_collection(collection)
-            result = db[collection].insert_many(documents)
+            result = db[self.config.COLLECTION].insert_many(documents, ordered=False)
             return {"Response": "Success", "Inserted Documents": len(result.inserted_ids)}
         except Exception as e:
             raise e
 
+    def upsert_bulk_record(self, documents: List[Dict[str, Any]]):
+        """
+        Upsert a list of documents keyed by their S3 link using a single unordered bulk write.
+
+        Args:
+            documents (List[Dict[str, Any]]): List of documents to be upserted.
+
+        Returns:
+            dict: A response dictionary indicating the success and the number of upserted and modified documents.
+        """
+        try:
+            operations = self.upsert_operations(documents, self.config.UNIQUE_KEY)
+            if not operations:
+                return {"Response": "Success", "Upserted Documents": 0, "Modified Documents": 0}
+            db = self.client[self.config.DBNAME]
+            result = db[self.config.COLLECTION].bulk_write(operations, ordered=False)
+            return {"Response": "Success", "Upserted Documents": result.upserted_count,
+                    "Modified Documents": result.modified_count}
+        except Exception as e:
+            raise e
+
+    @staticmethod
+    def upsert_operations(documents: List[Dict[str, Any]], key: str) -> List[UpdateOne]:
+        """
+        Build one upsert per unique key, keeping the last document seen for each key.
+
+        Args:
+            documents (List[Dict[str, Any]]): Documents to be upserted.
+            key (str): Field identifying a document.
+
+        Returns:
+            List[UpdateOne]: Upsert operations for a bulk write.
+        """
+        unique = {document[key]: document for document in documents}
+        return [UpdateOne({key: value}, {"$set": document}, upsert=True) for value, document in unique.items()]
+
     def get_collection_documents(self):
         """
         Retrieve all documents from the MongoDB collection.
@@ -50,6 +169,125 @@ class MongoDBClient:
         except Exception as e:
             raise e
 
+    def async_client(self) -> "AsyncMongoDBClient":
+        """
+        Return the asyncio counterpart of this client, for callers that keep many writes in flight.
+
+        Returns:
+            AsyncMongoDBClient: Client for the same database and collection.
+        """
+        return AsyncMongoDBClient()
+
+    def split_id_ranges(self, workers: int):
+        """
+        Split the collection into contiguous `_id` ranges of roughly equal size.
+
+        Args:
+            workers (int): Number of ranges to produce.
+
+        Returns:
+            list: Tuples of (lower bound, upper bound, row offset, row count); `None` bounds are open.
+        """
+        collection = self.client[self.config.DBNAME][self.config.COLLECTION]
+        total = collection.count_documents({})
+        workers = max(1, min(workers, total))
+        bounds = [None]
+        for i in range(1, workers):
+            cursor = collection.find({}, {"_id": 1}).sort("_id", ASCENDING).skip(total * i // workers).limit(1)
+            bounds.append(next(cursor)["_id"])
+        bounds.append(None)
+
+        ranges, offset = [], 0
+        for lower, upper in zip(bounds[:-1], bounds[1:]):
+            count = collection.count_documents(self._id_filter(lower, upper))
+            ranges.append((lower, upper, offset, count))
+            offset += count
+        return ranges
+
+    @staticmethod
+    def _id_filter(lower, upper) -> Dict[str, Any]:
+        """
+        Build a half-open `_id` range filter.
+        """
+        condition = {}
+        if lower is not None:
+            condition["$gte"] = lower
+        if upper is not None:
+            condition["$lt"] = upper
+        return {"_id": condition} if condition else {}
+
+    def export_embeddings(self, workers: Optional[int] = None, batch_size: Optional[int] = None):
+        """
+        Read every embedding into a preallocated float32 matrix using projected, parallel range scans.
+
+        Args:
+            workers (int, optional): Number of parallel range readers. Defaults to READ_WORKERS.
+            batch_size (int, optional): Cursor batch size. Defaults to READ_BATCH_SIZE.
+
+        Returns:
+            dict: A response dictionary with the vectors, their S3 links, label ids and ingestion times
+            (-1 and 0 when missing), the row count and the read throughput.
+        """
+        try:
+            workers = workers or self.config.READ_WORKERS
+            batch_size = batch_size or self.config.READ_BATCH_SIZE
+            vector_field, link_field = self.config.VECTOR_FIELD, self.config.UNIQUE_KEY
+            label_field, ingested_field = self.config.LABEL_FIELD, self.config.INGESTED_FIELD
+            projection = {"_id": 0, vector_field: 1, link_field: 1, label_field: 1, ingested_field: 1}
+            collection = self.client[self.config.DBNAME][self.config.COLLECTION]
+
+            start = time.perf_counter()
+            first = collection.find_one({}, projection)
+            if first is None:
+                return {"Response": "Success", "Vectors": np.empty((0, 0), dtype=np.float32), "Links": [],
+                        "Labels": np.empty(0, dtype=np.int64), "IngestedAt": np.empty(0, dtype=np.int64),
+                        "Rows": 0, "Seconds": 0.0, "Throughput": 0.0}
+
+            ranges = self.split_id_ranges(workers)
+            rows = sum(count for _, _, _, count in ranges)
+            vectors = np.empty((rows, len(first[vector_field])), dtype=np.float32)
+            links = [None] * rows
+            labels = np.full(rows, -1, dtype=np.int64)
+            ingested_at = np.zeros(rows, dtype=np.int64)
+            progress = tqdm(total=rows, desc="Exporting embeddings")
+
+            def read_range(lower, upper, offset, count):
+                cursor = collection.find(self._id_filter(lower, upper), projection) \
+                    .sort("_id", ASCENDING).batch_size(batch_size).limit(count)
+                row = offset
+                for document in cursor:
+                    vectors[row] = document[vector_field]
+                    links[row] = document[link_field]
+                    labels[row] = document.get(label_field, -1)
+                    ingested_at[row] = document.get(ingested_field, 0)
+                    row += 1
+                    if (row - offset) % batch_size == 0:
+                        progress.update(batch_size)
+                progress.update((row - offset) % batch_size)
+                return row - offset
+
+            # limit(0) means "no limit" to pymongo, so an empty range could read rows inserted since it was
+            # counted past the preallocated matrix.
+            ranges = [r for r in ranges if r[3] > 0]
+            with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+                read = sum(executor.map(lambda r: read_range(*r), ranges))
+            progress.close()
+
+            if read < rows:
+                keep = [i for i, link in enumerate(links) if link is not None]
+                vectors, links = vectors[keep], [links[i] for i in keep]
+                labels, ingested_at = labels[keep], ingested_at[keep]
+            seconds = time.perf_counter() - start
+            throughput = read / seconds if seconds else 0.0
+            print(f"Exported {read} embeddings in {seconds:.2f}s ({throughput:.0f} rows/s)")
+            metrics.increment("db_rows_read", read)
+            metrics.observe("db_export_seconds", seconds)
+            metrics.gauge("db_read_rows_per_second", throughput)
+            return {"Response": "Success", "Vectors": vectors, "Links": links,
+                    "Labels": labels, "IngestedAt": ingested_at, "Rows": read, "Seconds": seconds, "Throughput": throughput}
+        except Exception as e:
+            raise e
+
     def drop_collection(self):
         """
         Drop the MongoDB collection.
@@ -61,23 +299,242 @@ class MongoDBClient:
             db = self.client[self.config.DBNAME]
             collection = self.config.COLLECTION
             db[collection].drop()
+            self._indexed_collections.discard((self.config.DBNAME, collection))
             return {"Response": "Success"}
         except Exception as e:
             raise e
 
 
+class AsyncMongoDBClient:
+    """
+    Asyncio counterpart of MongoDBClient built on the Motor driver.
+    """
+    _clients = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        """
+        Initialize AsyncMongoDBClient with configuration settings.
+        """
+        self.config = DatabaseConfig()
+
+    @property
+    def client(self) -> "AsyncIOMotorClient":
+        """
+        Return the Motor client shared by everything running on the current event loop.
+        """
+        from motor.motor_asyncio import AsyncIOMotorClient
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            config = self.config
+            url = config.URL.replace("<username>", config.USERNAME).replace("<password>", config.PASSWORD)
+            self._clients[loop] = AsyncIOMotorClient(
+                url,
+                maxPoolSize=config.MAX_POOL_SIZE,
+                minPoolSize=config.MIN_POOL_SIZE,
+                maxIdleTimeMS=config.MAX_IDLE_TIME_MS,
+                serverSelectionTimeoutMS=config.SERVER_SELECTION_TIMEOUT_MS
+            )
+        return self._clients[loop]
+
+    @property
+    def collection(self):
+        """
+        Return the configured collection on the current event loop's client.
+        """
+        return self.client[self.config.DBNAME][self.config.COLLECTION]
+
+    async def insert_bulk_record(self, documents: List[Dict[str, Any]]):
+        """
+        Insert a list of documents into the MongoDB collection.
+
+        Args:
+            documents (List[Dict[str, Any]]): List of documents to be inserted.
+
+        Returns:
+            dict: A response dictionary indicating the success and the number of inserted documents.
+        """
+        result = await self.collection.insert_many(documents, ordered=False)
+        return {"Response": "Success", "Inserted Documents": len(result.inserted_ids)}
+
+    async def upsert_bulk_record(self, documents: List[Dict[str, Any]]):
+        """
+        Upsert a list of documents keyed by their S3 link using a single unordered bulk write.
+
+        Args:
+            documents (List[Dict[str, Any]]): List of documents to be upserted.
+
+        Returns:
+            dict: A response dictionary indicating the success and the number of upserted and modified documents.
+        """
+        operations = MongoDBClient.upsert_operations(documents, self.config.UNIQUE_KEY)
+        if not operations:
+            return {"Response": "Success", "Upserted Documents": 0, "Modified Documents": 0}
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return {"Response": "Success", "Upserted Documents": result.upserted_count,
+                "Modified Documents": result.modified_count}
+
+    async def upsert_batches(self, batches: List[List[Dict[str, Any]]]):
+        """
+        Upsert many batches concurrently, bounded by the connection pool size.
+
+        Args:
+            batches (List[List[Dict[str, Any]]]): Batches of documents to be upserted.
+
+        Returns:
+            dict: A response dictionary with the total number of upserted and modified documents.
+        """
+        results = await gather_bounded((self.upsert_bulk_record(batch) for batch in batches),
+                                       self.config.MAX_POOL_SIZE)
+        return {"Response": "Success",
+                "Upserted Documents": sum(result["Upserted Documents"] for result in results),
+                "Modified Documents": sum(result["Modified Documents"] for result in results)}
+
+    async def get_collection_documents(self):
+        """
+        Retrieve all documents from the MongoDB collection.
+
+        Returns:
+            dict: A response dictionary indicating the success and an async cursor over the documents.
+        """
+        return {"Response": "Success", "Info": self.collection.find()}
+
+    async def drop_collection(self):
+        """
+        Drop the MongoDB collection.
+
+        Returns:
+            dict: A response dictionary indicating the success of dropping the collection.
+        """
+        await self.collection.drop()
+        return {"Response": "Success"}
+
+
+class MongoWriteBuffer:
+    """
+    Background writer that coalesces small batches into large unordered upserts, keeping up to WRITE_CONCURRENCY
+    of them in flight on its own event loop.
+    """
+    _STOP = object()
+
+    def __init__(self, mongo: MongoDBClient):
+        """
+        Initialize the write buffer and start its flushing thread.
+
+        Args:
+            mongo (MongoDBClient): Client whose asyncio counterpart performs the bulk upserts.
+        """
+        self.mongo = mongo
+        self.writer = mongo.async_client()
+        self.batch_size = mongo.config.WRITE_BATCH_SIZE
+        self.flush_interval = mongo.config.WRITE_FLUSH_INTERVAL
+        self.concurrency = mongo.config.WRITE_CONCURRENCY
+        self.queue = queue.Queue(maxsize=mongo.config.WRITE_QUEUE_SIZE)
+        self.written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="mongo-write-buffer", daemon=True)
+        self.thread.start()
+
+    def add(self, documents: List[Dict[str, Any]]):
+        """
+        Queue documents for writing without waiting for the database.
+
+        Args:
+            documents (List[Dict[str, Any]]): Documents to be upserted.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(documents)
+
+    async def _flush(self, pending: List[Dict[str, Any]], slots: asyncio.Semaphore):
+        """
+        Write the pending documents, remembering the first failure for the producer.
+
+        Args:
+            pending (List[Dict[str, Any]]): Documents collected since the last flush.
+            slots (asyncio.Semaphore): In-flight write slot acquired for this flush, released when it finishes.
+        """
+        try:
+            if self.error is None:
+                with metrics.timer("db_write"):
+                    await self.writer.upsert_bulk_record(pending)
+                self.written += len(pending)
+                metrics.increment("db_documents_written", len(pending))
+        except Exception as e:
+            self.error = self.error or e
+        finally:
+            slots.release()
+
+    def _run(self):
+        asyncio.run(self._drain())
+
+    async def _drain(self):
+        """
+        Drain the queue, starting a write whenever a full batch has accumulated or the producer goes idle. Once
+        WRITE_CONCURRENCY writes are in flight the queue is no longer drained, so the producer blocks in add().
+        """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        writes = set()
+
+        async def write(documents):
+            if not documents:
+                return
+            await slots.acquire()
+            task = loop.create_task(self._flush(documents, slots))
+            writes.add(task)
+            task.add_done_callback(writes.discard)
+
+        pending = []
+        while True:
+            timeout = self.flush_interval if pending else None
+            try:
+                item = await loop.run_in_executor(None, lambda: self.queue.get(timeout=timeout))
+            except queue.Empty:
+                await write(pending)
+                pending = []
+                continue
+            if item is self._STOP:
+                await write(pending)
+                await asyncio.gather(*writes)
+                return
+            pending.extend(item)
+            if len(pending) >= self.batch_size:
+                await write(pending)
+                pending = []
+
+    def close(self):
+        """
+        Flush all queued documents and stop the background thread.
+
+        Returns:
+            dict: A response dictionary indicating the success and the number of written documents.
+        """
+        self.queue.put(self._STOP)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return {"Response": "Success", "Written Documents": self.written}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 if __name__ == "__main__":
     data = [
-        {"embedding": [1, 2, 3, 4, 5, 6], "label": 1, "link": "https://test.com/"},
-        {"embedding": [1, 2, 3, 4, 5, 6], "label": 1, "link": "https://test.com/"},
-        {"embedding": [1, 2, 3, 4, 5, 6], "label": 1, "link": "https://test.com/"},
-        {"embedding": [1, 2, 3, 4, 5, 6], "label": 1, "link": "https://test.com/"}
+        {"embedding": [1, 2, 3, 4, 5, 6], "label": 1, "s3_link": "https://test.com/1"},
+        {"embedding": [1, 2, 3, 4, 5, 6], "label": 1, "s3_link": "https://test.com/2"},
+        {"embedding": [1, 2, 3, 4, 5, 6], "label": 1, "s3_link": "https://test.com/3"},
+        {"embedding": [1, 2, 3, 4, 5, 6], "label": 1, "s3_link": "https://test.com/4"}
     ]
 
     mongo = MongoDBClient()
-    print(mongo.insert_bulk_record(data))
+    print(mongo.upsert_bulk_record(data))
     # Uncomment the following lines to test the methods
+    # with MongoWriteBuffer(mongo) as writer:
+    #     writer.add(data)
     # print(mongo.drop_collection())
     # result = mongo.get_collection_documents()
     # print(result["Info"])
-
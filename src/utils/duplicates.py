@@ -0,0 +1,80 @@
+from typing import Dict, Hashable, Iterable
+import json
+import os
+
+
+class UnionFind:
+    """
+    Disjoint-set forest with path halving and union by size.
+    """
+    def __init__(self, items: Iterable[Hashable] = ()):
+        self.parent = {}
+        self.size = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Hashable):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item: Hashable) -> Hashable:
+        self.add(item)
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, left: Hashable, right: Hashable) -> bool:
+        """
+        Merge the sets of two items.
+
+        Returns:
+            bool: True if the items were in different sets.
+        """
+        left, right = self.find(left), self.find(right)
+        if left == right:
+            return False
+        if self.size[left] < self.size[right]:
+            left, right = right, left
+        self.parent[right] = left
+        self.size[left] += self.size[right]
+        return True
+
+    def groups(self) -> Dict[Hashable, list]:
+        """
+        Return the members of every set keyed by its root.
+        """
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return groups
+
+
+def image_key(link_or_path: str) -> str:
+    """
+    Identify a catalogue image by its "<class>/<file>" suffix, shared by S3 keys, S3 links and local paths.
+
+    Args:
+        link_or_path (str): S3 link, S3 key or local path of the image.
+
+    Returns:
+        str: The image key.
+    """
+    return "/".join(link_or_path.replace(os.sep, "/").split("/")[-2:])
+
+
+def load_canonical_map(path: str) -> Dict[str, str]:
+    """
+    Load the duplicate -> canonical image key map written by the dedup job.
+
+    Args:
+        path (str): Location of the map.
+
+    Returns:
+        dict: The map, empty when the dedup job has not run yet.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
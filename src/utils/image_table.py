@@ -0,0 +1,195 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from bisect import bisect_left
+import numpy as np
+import tempfile
+import os
+
+
+class ImageTable:
+    """
+    Column-oriented table of the images under a "<root>/<class>/<file>" tree.
+
+    Class names are interned into `classes` and referenced by `class_ids`. The relative "<class>/<file>" paths
+    share one UTF-8 byte blob indexed by `offsets`. Every column is a NumPy array, so forked DataLoader workers
+    share the table without copying per-row Python objects.
+    """
+    def __init__(self, classes: List[str], class_ids: np.ndarray, offsets: np.ndarray, blob: np.ndarray,
+                 ingested_at: np.ndarray, dir_mtimes: Optional[np.ndarray] = None):
+        self.classes = list(classes)
+        self.class_ids = class_ids
+        self.offsets = offsets
+        self.blob = blob
+        self.ingested_at = ingested_at
+        self.dir_mtimes = dir_mtimes if dir_mtimes is not None else np.zeros(len(self.classes), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def relative_path(self, row: int) -> str:
+        """
+        Return the "<class>/<file>" path of a row.
+        """
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].tobytes().decode()
+
+    def name(self, row: int) -> str:
+        """
+        Return the file name of a row.
+        """
+        return self.relative_path(row).split("/", 1)[1]
+
+    @classmethod
+    def scan(cls, root: str, workers: int = 16) -> "ImageTable":
+        """
+        Walk every class directory concurrently with os.scandir.
+
+        Args:
+            root (str): Directory with one sub-directory per class.
+            workers (int): Directories scanned at a time.
+
+        Returns:
+            ImageTable: Rows ordered by class name, then file name.
+        """
+        classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+
+        def scan_class(name):
+            path = os.path.join(root, name)
+            with os.scandir(path) as entries:
+                files = sorted((entry.name, int(entry.stat().st_mtime)) for entry in entries if entry.is_file())
+            return os.stat(path).st_mtime_ns, files
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            scanned = list(executor.map(scan_class, classes))
+
+        counts = np.array([len(files) for _, files in scanned], dtype=np.int64)
+        paths = [f"{name}/{file}".encode() for name, (_, files) in zip(classes, scanned) for file, _ in files]
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in paths], out=offsets[1:])
+        return cls(classes,
+                   np.repeat(np.arange(len(classes), dtype=np.int32), counts),
+                   offsets,
+                   np.frombuffer(b"".join(paths), dtype=np.uint8),
+                   np.array([mtime for _, files in scanned for _, mtime in files], dtype=np.int64),
+                   np.array([mtime for mtime, _ in scanned], dtype=np.int64))
+
+    def is_current(self, root: str) -> bool:
+        """
+        Check the table still matches the tree: same class directories, none modified since the scan.
+
+        Args:
+            root (str): Directory the table was scanned from.
+
+        Returns:
+            bool: True if the table can be reused.
+        """
+        classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+        if classes != self.classes:
+            return False
+        return all(os.stat(os.path.join(root, name)).st_mtime_ns == mtime
+                   for name, mtime in zip(classes, self.dir_mtimes))
+
+    @classmethod
+    def load_or_scan(cls, root: str, cache_path: Optional[str] = None, workers: int = 16) -> "ImageTable":
+        """
+        Load the table cached at `cache_path` if it is still current, otherwise scan the tree and cache it.
+
+        Args:
+            root (str): Directory with one sub-directory per class.
+            cache_path (str, optional): Location of the cached table; None disables caching.
+            workers (int): Directories scanned at a time.
+
+        Returns:
+            ImageTable: The table.
+        """
+        if cache_path and os.path.exists(cache_path):
+            table = cls.load(cache_path)
+            if table.is_current(root):
+                return table
+        table = cls.scan(root, workers)
+        if cache_path:
+            table.save(cache_path)
+        return table
+
+    def save(self, path: str):
+        """
+        Write the table to an .npz file atomically, through a uniquely named temporary file so concurrent
+        writers never collide.
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(suffix=".npz", prefix=".image_table-", dir=directory)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                np.savez(file, classes=np.array(self.classes, dtype=str), class_ids=self.class_ids,
+                         offsets=self.offsets, blob=self.blob, ingested_at=self.ingested_at,
+                         dir_mtimes=self.dir_mtimes)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "ImageTable":
+        """
+        Read a table written by `save`.
+        """
+        with np.load(path) as data:
+            return cls(data["classes"].tolist(), data["class_ids"], data["offsets"], data["blob"],
+                       data["ingested_at"], data["dir_mtimes"])
+
+    def find(self, key: str) -> Optional[int]:
+        """
+        Locate the row of a "<class>/<file>" key with a binary search inside its class.
+
+        Args:
+            key (str): Image key.
+
+        Returns:
+            int: The row, or None when the image is not in the table.
+        """
+        name, _, file = key.partition("/")
+        position = bisect_left(self.classes, name)
+        if position == len(self.classes) or self.classes[position] != name:
+            return None
+        lo, hi = np.searchsorted(self.class_ids, [position, position + 1])
+        names = _NameView(self)
+        row = bisect_left(names, file, int(lo), int(hi))
+        return row if row < hi and names[row] == file else None
+
+    def select(self, rows: np.ndarray) -> "ImageTable":
+        """
+        Return a table with only the given rows, in the given order.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts, lengths = self.offsets[rows], self.offsets[rows + 1] - self.offsets[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return ImageTable(self.classes, self.class_ids[rows], offsets, self.blob[gather], self.ingested_at[rows],
+                          self.dir_mtimes)
+
+    def without(self, keys: Dict[str, str]) -> "ImageTable":
+        """
+        Return the table without the rows of the given image keys, e.g. the duplicates of a canonical map.
+        """
+        drop = [row for row in (self.find(key) for key in keys) if row is not None]
+        if not drop:
+            return self
+        keep = np.ones(len(self), dtype=bool)
+        keep[drop] = False
+        return self.select(np.flatnonzero(keep))
+
+
+class _NameView:
+    """
+    Sequence of the file names of a table, decoded on access, for bisect.
+    """
+    def __init__(self, table: ImageTable):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, row: int) -> str:
+        return self.table.name(row)
@@ -0,0 +1,197 @@
+from contextlib import contextmanager
+from typing import Dict, Optional
+import threading
+import random
+import json
+import time
+import os
+
+
+class Histogram:
+    """
+    Running count, sum, min and max plus a bounded reservoir sample for percentiles.
+    """
+    def __init__(self, samples: int = 2048):
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.samples = samples
+        self.reservoir = []
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.reservoir) < self.samples:
+            self.reservoir.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.samples:
+                self.reservoir[slot] = value
+
+    def percentile(self, q: float) -> float:
+        if not self.reservoir:
+            return 0.0
+        ordered = sorted(self.reservoir)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def summary(self) -> Dict[str, float]:
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count,
+                "min": self.min, "max": self.max, "p50": self.percentile(50),
+                "p95": self.percentile(95), "p99": self.percentile(99)}
+
+    def merge(self, state: Dict):
+        self.count += state["count"]
+        self.sum += state["sum"]
+        self.min = min(self.min, state["min"])
+        self.max = max(self.max, state["max"])
+        self.reservoir = (self.reservoir + state["reservoir"])[-self.samples:]
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters, gauges, histograms and timers that pipeline stages report into.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters: Dict[str, float] = {}
+            self.gauges: Dict[str, float] = {}
+            self.histograms: Dict[str, Histogram] = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            self.histograms.setdefault(name, Histogram()).observe(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Record the wall time of the enclosed block in the `<name>_seconds` histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start)
+
+    def state(self) -> Dict:
+        """
+        Raw state that another process can merge, e.g. from embedding workers.
+        """
+        with self.lock:
+            return {"counters": dict(self.counters), "gauges": dict(self.gauges),
+                    "histograms": {name: {"count": h.count, "sum": h.sum, "min": h.min, "max": h.max,
+                                          "reservoir": list(h.reservoir)}
+                                   for name, h in self.histograms.items() if h.count}}
+
+    def merge(self, state: Dict):
+        with self.lock:
+            for name, value in state["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.gauges.update(state["gauges"])
+            for name, histogram in state["histograms"].items():
+                self.histograms.setdefault(name, Histogram()).merge(histogram)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {"started": self.started, "elapsed_seconds": time.time() - self.started,
+                    "counters": dict(self.counters), "gauges": dict(self.gauges),
+                    "histograms": {name: h.summary() for name, h in self.histograms.items()}}
+
+    def export_json(self, path: str, extra: Optional[Dict] = None) -> str:
+        """
+        Write the per-run report.
+
+        Args:
+            path (str): Destination file.
+            extra (Dict, optional): Additional fields such as stage statuses.
+
+        Returns:
+            str: The written path.
+        """
+        report = self.snapshot()
+        report.update(extra or {})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        return path
+
+    def export_prometheus(self, path: str, prefix: str = "search_engine") -> str:
+        """
+        Write the metrics in the Prometheus text exposition format, e.g. for a node-exporter textfile collector.
+
+        Args:
+            path (str): Destination file.
+            prefix (str): Metric name prefix.
+
+        Returns:
+            str: The written path.
+        """
+        lines = []
+        snapshot = self.snapshot()
+        for name, value in snapshot["counters"].items():
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+        for name, value in snapshot["gauges"].items():
+            lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+        for name, summary in snapshot["histograms"].items():
+            if not summary["count"]:
+                continue
+            lines.append(f"# TYPE {prefix}_{name} summary")
+            for quantile in ("50", "95", "99"):
+                lines.append(f'{prefix}_{name}{{quantile="0.{quantile}"}} {summary["p" + quantile]}')
+            lines += [f"{prefix}_{name}_sum {summary['sum']}", f"{prefix}_{name}_count {summary['count']}"]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        return path
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def profile_trace(trace_path: str, enabled: bool = True, active_steps: Optional[int] = None):
+    """
+    Capture a torch profiler trace of the enclosed block as a Chrome trace file.
+
+    Args:
+        trace_path (str): Destination of the trace.
+        enabled (bool): When False the block runs unprofiled and None is yielded.
+        active_steps (int, optional): Only record this many steps after one wait and one warm-up step;
+            the caller must call `profiler.step()` once per step.
+    """
+    if not enabled:
+        yield None
+        return
+    # Imported here so modules that only report metrics do not pay for importing torch.
+    import torch
+
+    def export(profiler):
+        os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+        profiler.export_chrome_trace(trace_path)
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    schedule = torch.profiler.schedule(wait=1, warmup=1, active=active_steps, repeat=1) if active_steps else None
+    with torch.profiler.profile(activities=activities, schedule=schedule, record_shapes=True,
+                                on_trace_ready=export if schedule else None) as profiler:
+        yield profiler
+    if schedule is None:
+        export(profiler)
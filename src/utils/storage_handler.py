@@ -1,54 +1,199 @@
 from src.entity.config_entity import S3Config
+from src.utils.async_utils import run_sync, gather_bounded
+from typing import List, Optional, Set, Tuple
 import tarfile
-from boto3 import Session
+import asyncio
 import os
 
 
+def artifact_paths(config: S3Config) -> List[Tuple[str, str]]:
+    """
+    Select the artifacts to archive: the required ones, whichever index layout was built and the optional
+    artifacts that exist.
+
+    Args:
+        config (S3Config): Configuration listing the artifact paths.
+
+    Returns:
+        list: (path, archive name) pairs.
+
+    Raises:
+        FileNotFoundError: If a required artifact or a complete index is missing.
+    """
+    missing = [path for path, _ in config.ZIP_PATHS if not os.path.exists(path)]
+    layouts = [layout for layout in config.INDEX_ZIP_PATHS if all(os.path.exists(path) for path, _ in layout)]
+    if not layouts:
+        missing.append(" or ".join(", ".join(path for path, _ in layout) for layout in config.INDEX_ZIP_PATHS))
+    if missing:
+        raise FileNotFoundError(f"Cannot archive the artifacts, missing: {'; '.join(missing)}")
+    return config.ZIP_PATHS + layouts[0] + [(path, name) for path, name in config.OPTIONAL_ZIP_PATHS
+                                            if os.path.exists(path)]
+
+
 class S3Connector:
     """
-    Class for connecting to and interacting with Amazon S3.
+    Synchronous interface to Amazon S3, running the AsyncS3Connector implementation to completion.
+    """
+    def __init__(self):
+        """
+        Initialize S3Connector with configuration settings.
+        """
+        self.config = S3Config()
+
+    def zip_files(self):
+        """
+        Compress the artifacts into a tar.gz archive and upload to S3. Only the index layout that was built is
+        archived, and optional artifacts are skipped when absent.
+
+        Raises:
+            FileNotFoundError: If a required artifact or a complete index is missing.
+        """
+        return run_sync(AsyncS3Connector().zip_files())
+
+    def pull_artifacts(self):
+        """
+        Download and extract artifacts from S3.
+        """
+        return run_sync(AsyncS3Connector().pull_artifacts())
+
+    def download_dir(self, prefix: str, path: str, exclude: Optional[Set[str]] = None):
+        """
+        Synchronise an S3 prefix into a local directory using concurrent async downloads.
+
+        Args:
+            prefix (str): S3 key prefix to download.
+            path (str): Local destination directory.
+            exclude (Set[str], optional): Keys relative to the prefix to skip, e.g. known duplicates.
+
+        Returns:
+            dict: A response dictionary with the number of downloaded files and bytes.
+        """
+        return run_sync(AsyncS3Connector().download_dir(prefix, path, exclude))
+
+
+class AsyncS3Connector:
+    """
+    Asyncio counterpart of S3Connector for overlapping many S3 requests from one process.
     """
     def __init__(self):
         """
-        Initialize S3Connector with configuration settings and establish a connection to S3.
+        Initialize AsyncS3Connector with configuration settings and an aioboto3 session.
         """
+        # Imported here so the synchronous stages do not pay for aioboto3 at startup.
+        from botocore.config import Config
+        import aioboto3
         self.config = S3Config()
-        self.session = Session(
+        self.session = aioboto3.Session(
             aws_access_key_id=self.config.ACCESS_KEY_ID,
             aws_secret_access_key=self.config.SECRET_KEY,
             region_name=self.config.REGION_NAME
         )
-        self.client = self.session.client("s3")
-        self.s3 = self.session.resource("s3")
-        self.bucket = self.s3.Bucket(self.config.BUCKET_NAME)
+        self.client_config = Config(max_pool_connections=self.config.MAX_CONCURRENCY)
 
-    def zip_files(self):
+    def client(self):
         """
-        Compress specified files into a tar.gz archive and upload to S3.
+        Create an async S3 client context with a connection pool sized for MAX_CONCURRENCY.
         """
-        folder = tarfile.open(self.config.ZIP_NAME, "w:gz")
-        for path, name in self.config.ZIP_PATHS:
-            folder.add(path, name)
-        folder.close()
+        return self.session.client("s3", config=self.client_config)
 
-        self.s3.meta.client.upload_file(
-            self.config.ZIP_NAME,
-            self.config.BUCKET_NAME,
-            f'{self.config.KEY}/{self.config.ZIP_NAME}'
-        )
+    async def list_objects(self, prefix: str):
+        """
+        List every object under a prefix.
+
+        Args:
+            prefix (str): S3 key prefix.
+
+        Returns:
+            list: Object summaries with `Key`, `Size` and `ETag`.
+        """
+        objects = []
+        async with self.client() as client:
+            paginator = client.get_paginator("list_objects_v2")
+            async for page in paginator.paginate(Bucket=self.config.BUCKET_NAME, Prefix=prefix):
+                objects.extend(page.get("Contents", []))
+        return objects
+
+    async def download_dir(self, prefix: str, path: str, exclude: Optional[Set[str]] = None):
+        """
+        Download every object under a prefix that is missing locally or has a different size.
+
+        Args:
+            prefix (str): S3 key prefix to download.
+            path (str): Local destination directory.
+            exclude (Set[str], optional): Keys relative to the prefix to skip, e.g. known duplicates.
+
+        Returns:
+            dict: A response dictionary with the number of downloaded files and bytes.
+        """
+        objects = await self.list_objects(prefix)
+        pending = []
+        for item in objects:
+            relative = os.path.relpath(item["Key"], prefix)
+            if item["Key"].endswith("/") or (exclude and relative in exclude):
+                continue
+            target = os.path.join(path, relative)
+            if not os.path.exists(target) or os.path.getsize(target) != item["Size"]:
+                pending.append((item["Key"], target, item["Size"]))
+
+        async with self.client() as client:
+            async def download(key, target, size):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                await client.download_file(self.config.BUCKET_NAME, key, target)
+                return size
+
+            sizes = await gather_bounded((download(*item) for item in pending), self.config.MAX_CONCURRENCY)
+        return {"Response": "Success", "Downloaded Files": len(sizes), "Downloaded Bytes": sum(sizes)}
+
+    async def upload_files(self, files):
+        """
+        Upload local files concurrently.
+
+        Args:
+            files: Iterable of (local path, S3 key) pairs.
+
+        Returns:
+            dict: A response dictionary with the number of uploaded files.
+        """
+        async with self.client() as client:
+            uploads = (client.upload_file(path, self.config.BUCKET_NAME, key) for path, key in files)
+            results = await gather_bounded(uploads, self.config.MAX_CONCURRENCY)
+        return {"Response": "Success", "Uploaded Files": len(results)}
+
+    async def zip_files(self):
+        """
+        Compress the artifacts into a tar.gz archive and upload to S3. Only the index layout that was built is
+        archived, and optional artifacts are skipped when absent.
+
+        Raises:
+            FileNotFoundError: If a required artifact or a complete index is missing.
+        """
+        paths = artifact_paths(self.config)
+
+        def archive():
+            with tarfile.open(self.config.ZIP_NAME, "w:gz") as folder:
+                for path, name in paths:
+                    folder.add(path, name)
+
+        await asyncio.to_thread(archive)
+        await self.upload_files([(self.config.ZIP_NAME, f'{self.config.KEY}/{self.config.ZIP_NAME}')])
         os.remove(self.config.ZIP_NAME)
 
-    def pull_artifacts(self):
+    async def pull_artifacts(self):
         """
         Download and extract artifacts from S3.
         """
-        self.bucket.download_file(
-            f'{self.config.KEY}/{self.config.ZIP_NAME}',
-            self.config.ZIP_NAME
-        )
-        folder = tarfile.open(self.config.ZIP_NAME)
-        folder.extractall()
-        folder.close()
+        async with self.client() as client:
+            await client.download_file(
+                self.config.BUCKET_NAME,
+                f'{self.config.KEY}/{self.config.ZIP_NAME}',
+                self.config.ZIP_NAME
+            )
+
+        def extract():
+            with tarfile.open(self.config.ZIP_NAME) as folder:
+                folder.extractall()
+
+        await asyncio.to_thread(extract)
         os.remove(self.config.ZIP_NAME)
 
 
@@ -57,4 +202,4 @@ if __name__ == "__main__":
     # Uncomment the following lines to test the methods
     # connection.zip_files()
     # connection.pull_artifacts()
-
+    # run_sync(AsyncS3Connector().pull_artifacts())